@@ -0,0 +1,537 @@
+"""
+Local stand-in LLM server for offline benchmarks
+* Speaks enough of the Anthropic messages (tool use) and message batches, and OpenAI chat completions / assistants wire formats for this repo's call sites
+* Latency is drawn from a configurable distribution; 429 / 5xx responses can be injected at a given rate
+* tool_use inputs are generated from the request's own tool schema and are deterministic in the request text
+"""
+import hashlib, json, math, random, re, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockConfig:
+    """
+    latency: "fixed", "uniform" or "lognormal" around median_ms (sigma is the lognormal shape, spread_ms the uniform half-width)
+    rate_429 / rate_5xx: fraction of requests answered with that error, retry_after is sent with 429s
+    weak_rate: fraction of translations from non-opus models that come back untranslated (exercises the model cascade)
+    require_cache_markers: answer 400 to Anthropic tool requests without prompt-caching markers / beta header
+      (a marked prefix is only cached on the models in prompt_cache_min_tokens and from that many tokens up, as on the real API)
+    prefix_ms_per_1k: extra latency per 1k uncached prefix tokens, so provider-side prompt caching shows up in latency
+    batch_ms: time a message batch stays in_progress; batch_error_rate: fraction of batched requests that come back errored (overloaded)
+    """
+
+    def __init__(self, latency="lognormal", median_ms=300.0, sigma=0.4, spread_ms=100.0, rate_429=0.0, rate_5xx=0.0, retry_after=1, weak_rate=0.0,
+                 require_cache_markers=False, prefix_ms_per_1k=0.0, batch_ms=200.0, batch_error_rate=0.0, seed=0):
+        self.latency = latency
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.spread_ms = spread_ms
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.weak_rate = weak_rate
+        self.require_cache_markers = require_cache_markers
+        self.prefix_ms_per_1k = prefix_ms_per_1k
+        self.batch_ms = batch_ms
+        self.batch_error_rate = batch_error_rate
+        self.seed = seed
+
+    def sample_latency(self, rng):
+        if self.latency == "fixed":
+            ms = self.median_ms
+        elif self.latency == "uniform":
+            ms = rng.uniform(self.median_ms - self.spread_ms, self.median_ms + self.spread_ms)
+        else:
+            ms = self.median_ms * math.exp(rng.gauss(0.0, self.sigma))
+        return max(ms, 0.0) / 1000.0
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.status_codes = {}
+            self.latencies = {}
+            self.requests_log = []
+            self.prompt_cache = {"marked": 0, "unmarked": 0, "writes": 0, "reads": 0, "uncacheable": 0}
+
+    def record(self, route, status_code, latency, body=None):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+            self.latencies.setdefault(route, []).append(latency)
+            if body is not None:
+                self.requests_log.append({"route": route, "status": status_code, "body": body})
+
+    def count_prompt_cache(self, event):
+        with self._lock:
+            self.prompt_cache[event] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "prompt_cache": dict(self.prompt_cache),
+                "requests": dict(self.requests),
+                "status_codes": dict(self.status_codes),
+                "latencies": {route: list(values) for route, values in self.latencies.items()},
+            }
+
+
+# Models with prompt caching and their minimum cacheable prefix in tokens; other models ignore cache_control markers
+prompt_cache_min_tokens = {
+    "claude-3-opus-20240229": 1024,
+    "claude-3-5-sonnet-20240620": 1024,
+    "claude-3-haiku-20240307": 2048,
+}
+
+
+def _digest(text):
+    return int(hashlib.sha256(str(text).encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _numbered_segments(text):
+    return [(int(i), segment) for i, segment in re.findall(r"^\[(\d+)\]\s*(?:\([^)]*\)\s*)?(.*)$", text, re.M)]
+
+
+def _source_text(text):
+    return text.split("Here is the text:", 1)[-1].split("Here is the thai text:", 1)[-1].strip()
+
+
+def fake_value(name, schema, text, index=None):
+    """
+    Deterministic value for one schema property, given the source text it describes
+    """
+    kind = schema.get("type")
+    if kind == "boolean":
+        if name.endswith("is_related_question") or name.endswith("_present"):
+            return "?" in text or "ไหม" in text or _digest(name + text) % 4 == 0
+        return _digest(name + text) % 3 == 0
+    if kind == "integer":
+        if name == "index":
+            return index if index is not None else 0
+        if name == "answer_to":
+            return -1 if index is None else index - 1
+        return _digest(name + text) % 10
+    if kind == "array" and "question_segment" in schema.get("items", {}).get("properties", {}):
+        # Chunked QA: question types are the "[i]" lines of the description; some segments ask one, the next segment answers it
+        n_types = max(1, len(re.findall(r"^\s*\[\d+\]", schema.get("description", ""), re.M)))
+        segments = _numbered_segments(text)
+        entries = []
+        for (i, segment), (j, answer) in zip(segments, segments[1:]):
+            if _digest(segment) % 4 == 0:
+                entries.append({"index": _digest(segment) % n_types, "present": True, "question": segment, "answer": answer,
+                                "question_segment": i, "answer_segment": j})
+        return entries
+    if kind == "array":
+        items = schema.get("items", {})
+        segments = _numbered_segments(text) or [(0, text)]
+        return [fake_value(name, items, segment, index=i) for i, segment in segments]
+    if kind == "object":
+        return {key: fake_value(key, value, text, index=index) for key, value in schema.get("properties", {}).items()}
+    if name == "revision":
+        return text
+    if name == "translation":
+        # English-looking text about as long as the source
+        words = ["the", "patient", "said", "that", "he", "has", "no", "history", "of", "illness", "and", "is", "fine"]
+        n_words = max(1, len(text) // 5)
+        return " ".join(words[(_digest(text) + i) % len(words)] for i in range(n_words))
+    return f"{name}:{_digest(text) % 1000}"
+
+
+def fake_tool_input(schema, text):
+    return fake_value("", schema, text)
+
+
+def _message_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content or [] if isinstance(block, dict))
+    return "\n".join(parts)
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockLLM/0.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    # Helpers
+    def _send_json(self, status_code, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status_code, text, content_type="application/x-jsonl"):
+        body = text.encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_events(self, events):
+        body = "".join(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n" for event, data in events)
+        body += "event: done\ndata: [DONE]\n\n"
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def _inject_error(self, route, started):
+        server = self.server
+        with server.rng_lock:
+            roll = server.rng.random()
+            latency = server.config.sample_latency(server.rng)
+        if roll < server.config.rate_429:
+            server.stats.record(route, 429, time.perf_counter() - started)
+            self._send_json(429, {"type": "error", "error": {"type": "rate_limit_error", "message": "mock rate limit"}},
+                            headers={"retry-after": server.config.retry_after})
+            return None
+        if roll < server.config.rate_429 + server.config.rate_5xx:
+            time.sleep(latency / 2)
+            server.stats.record(route, 529, time.perf_counter() - started)
+            self._send_json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "mock overloaded"}})
+            return None
+        return latency
+
+    # Routing
+    def do_GET(self):
+        started = time.perf_counter()
+        path = self.path.split("?")[0]
+        if path.endswith("/assistants"):
+            with self.server.state_lock:
+                assistants = list(self.server.assistants.values())
+            self.server.stats.record("openai.assistants.list", 200, time.perf_counter() - started)
+            return self._send_json(200, {"object": "list", "data": assistants, "first_id": None, "last_id": None, "has_more": False})
+        match = re.search(r"/messages/batches/([^/]+)(/results)?$", path)
+        if match:
+            return self._anthropic_batch_get(match.group(1), bool(match.group(2)), started)
+        match = re.search(r"/threads/([^/]+)/runs/([^/]+)$", path)
+        if match:
+            with self.server.state_lock:
+                run = self.server.runs.get(match.group(2))
+            if run is None:
+                return self._send_json(404, {"error": {"message": "no such run"}})
+            if run["status"] == "queued" and time.time() >= run["_ready_at"]:
+                run["status"] = "requires_action"
+            self.server.stats.record("openai.runs.retrieve", 200, time.perf_counter() - started)
+            return self._send_json(200, {k: v for k, v in run.items() if not k.startswith("_")})
+        self._send_json(404, {"error": {"message": f"unknown route {path}"}})
+
+    def do_POST(self):
+        started = time.perf_counter()
+        path = self.path.split("?")[0]
+        body = self._read_body()
+        if path.endswith("/v1/messages"):
+            return self._anthropic_messages(body, started)
+        if path.endswith("/v1/messages/batches"):
+            return self._anthropic_batch_create(body, started)
+        match = re.search(r"/messages/batches/([^/]+)/cancel$", path)
+        if match:
+            return self._anthropic_batch_cancel(match.group(1), started)
+        if path.endswith("/chat/completions"):
+            return self._openai_chat(body, started)
+        if path.endswith("/assistants"):
+            return self._openai_create_assistant(body, started)
+        if path.endswith("/threads/runs"):
+            return self._openai_create_and_run(body, started)
+        self._send_json(404, {"error": {"message": f"unknown route {path}"}})
+
+    # Anthropic
+    def _cached_prefix(self, body, beta=None):
+        """
+        (prefix tokens, tokens already in the provider cache) for the tools / system prefix up to the last cache_control marker
+        * None when the request carries no marker or lacks the prompt-caching beta header
+        * (0, 0) when the marker is ignored: the model has no prompt caching or the prefix is under its minimum size
+        """
+        blocks = list(body.get("tools") or [])
+        if isinstance(body.get("system"), list):
+            blocks += body["system"]
+        marked = [i for i, block in enumerate(blocks) if isinstance(block, dict) and block.get("cache_control")]
+        beta = self.headers.get("anthropic-beta") if beta is None else beta
+        if not marked or "prompt-caching" not in (beta or ""):
+            return None
+        prefix = json.dumps([body.get("model")] + blocks[:marked[-1] + 1], sort_keys=True, ensure_ascii=False)
+        n_tokens = max(1, len(prefix) // 4)
+        min_tokens = prompt_cache_min_tokens.get(body.get("model"))
+        if min_tokens is None or n_tokens < min_tokens:
+            return 0, 0
+        with self.server.state_lock:
+            hit = prefix in self.server.prompt_prefixes
+            self.server.prompt_prefixes.add(prefix)
+        return n_tokens, n_tokens if hit else 0
+
+    def _anthropic_messages(self, body, started):
+        route = "anthropic.messages"
+        prefix = self._cached_prefix(body)
+        if body.get("tools"):
+            self.server.stats.count_prompt_cache("unmarked" if prefix is None else "marked")
+            if prefix is None and self.server.config.require_cache_markers:
+                self.server.stats.record(route, 400, time.perf_counter() - started)
+                return self._send_json(400, {"type": "error", "error": {"type": "invalid_request_error", "message": "missing prompt-caching markers"}})
+        latency = self._inject_error(route, started)
+        if latency is None:
+            return
+        payload, prefix_ms = self._anthropic_message(body, prefix)
+        time.sleep(latency + prefix_ms / 1000.0)
+        self.server.stats.record(route, 200, time.perf_counter() - started, body if self.server.log_bodies else None)
+        self._send_json(200, payload)
+
+    def _anthropic_message(self, body, prefix):
+        """
+        (message, extra prefix latency in ms) answering one messages request
+        """
+        usage = {"input_tokens": max(1, len(json.dumps(body, ensure_ascii=False)) // 4)}
+        if prefix is not None:
+            n_prefix, n_read = prefix
+            usage["input_tokens"] = max(1, usage["input_tokens"] - n_prefix)
+            usage["cache_read_input_tokens"] = n_read
+            usage["cache_creation_input_tokens"] = n_prefix - n_read
+            self.server.stats.count_prompt_cache("reads" if n_read else "writes" if n_prefix else "uncacheable")
+            prefix_ms = self.server.config.prefix_ms_per_1k * (usage["input_tokens"] + n_prefix - n_read) / 1000.0
+        else:
+            prefix_ms = self.server.config.prefix_ms_per_1k * usage["input_tokens"] / 1000.0
+        text = _message_text(body.get("messages", []))
+        tools = body.get("tools") or []
+        content = []
+        if tools:
+            tool = tools[0]
+            source = text if _numbered_segments(text) else _source_text(text)
+            tool_input = fake_tool_input(tool.get("input_schema", {}), source)
+            if "translation" in tool_input and "opus" not in str(body.get("model")) and _digest(str(body.get("model")) + source) % 1000 < 1000 * self.server.config.weak_rate:
+                tool_input["translation"] = source
+            content.append({"type": "tool_use", "id": "toolu_" + uuid.uuid4().hex[:20], "name": tool["name"], "input": tool_input})
+        else:
+            content.append({"type": "text", "text": "mock"})
+        output_tokens = max(1, len(json.dumps(content, ensure_ascii=False)) // 4)
+        payload = {
+            "id": "msg_" + uuid.uuid4().hex[:20],
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model"),
+            "content": content,
+            "stop_reason": "tool_use" if tools else "end_turn",
+            "stop_sequence": None,
+            "usage": {**usage, "output_tokens": output_tokens},
+        }
+        return payload, prefix_ms
+
+    def _batch_object(self, batch):
+        ended = batch["results"] is not None
+        counts = {"processing": 0 if ended else len(batch["requests"]), "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0}
+        for entry in batch["results"] or []:
+            counts[entry["result"]["type"]] += 1
+        return {
+            "id": batch["id"], "type": "message_batch", "processing_status": "ended" if ended else ("canceling" if batch["canceled"] else "in_progress"),
+            "request_counts": counts, "created_at": batch["created_at"], "ended_at": batch["ended_at"], "expires_at": None,
+            "cancel_initiated_at": None, "results_url": f"{self.server.url}/v1/messages/batches/{batch['id']}/results" if ended else None,
+        }
+
+    def _batch_result(self, request, beta, canceled):
+        if canceled:
+            return {"type": "canceled"}
+        with self.server.rng_lock:
+            roll = self.server.rng.random()
+        if roll < self.server.config.batch_error_rate:
+            self.server.stats.record("anthropic.batches.request", 529, 0.0)
+            return {"type": "errored", "error": {"type": "error", "error": {"type": "overloaded_error", "message": "mock overloaded"}}}
+        params = request.get("params") or {}
+        prefix = self._cached_prefix(params, beta)
+        if params.get("tools"):
+            self.server.stats.count_prompt_cache("unmarked" if prefix is None else "marked")
+        message, _ = self._anthropic_message(params, prefix)
+        self.server.stats.record("anthropic.batches.request", 200, 0.0, params if self.server.log_bodies else None)
+        return {"type": "succeeded", "message": message}
+
+    def _anthropic_batch_create(self, body, started):
+        route = "anthropic.batches.create"
+        if self._inject_error(route, started) is None:
+            return
+        requests = body.get("requests") or []
+        ids = [request.get("custom_id") for request in requests]
+        if not requests or len(set(ids)) != len(ids) or not all(isinstance(i, str) and re.fullmatch(r"[a-zA-Z0-9_-]{1,64}", i) for i in ids):
+            self.server.stats.record(route, 400, time.perf_counter() - started)
+            return self._send_json(400, {"type": "error", "error": {"type": "invalid_request_error", "message": "invalid or duplicate custom_id"}})
+        batch = {
+            "id": "msgbatch_" + uuid.uuid4().hex[:20], "requests": requests, "beta": self.headers.get("anthropic-beta") or "",
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "ended_at": None, "results": None, "canceled": False,
+            "_ready_at": time.time() + self.server.config.batch_ms / 1000.0,
+        }
+        with self.server.state_lock:
+            self.server.batches[batch["id"]] = batch
+        self.server.stats.record(route, 200, time.perf_counter() - started)
+        self._send_json(200, self._batch_object(batch))
+
+    def _anthropic_batch_get(self, batch_id, results, started):
+        route = "anthropic.batches.results" if results else "anthropic.batches.retrieve"
+        with self.server.state_lock:
+            batch = self.server.batches.get(batch_id)
+        if batch is None:
+            return self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": "no such batch"}})
+        with self.server.batch_lock:
+            if batch["results"] is None and (time.time() >= batch["_ready_at"] or batch["canceled"]):
+                batch["results"] = [{"custom_id": request["custom_id"], "result": self._batch_result(request, batch["beta"], batch["canceled"])}
+                                    for request in batch["requests"]]
+                batch["ended_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        if not results:
+            self.server.stats.record(route, 200, time.perf_counter() - started)
+            return self._send_json(200, self._batch_object(batch))
+        if batch["results"] is None:
+            return self._send_json(400, {"type": "error", "error": {"type": "invalid_request_error", "message": "batch has not ended"}})
+        if self._inject_error(route, started) is None:
+            return
+        self.server.stats.record(route, 200, time.perf_counter() - started)
+        self._send_text(200, "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch["results"]))
+
+    def _anthropic_batch_cancel(self, batch_id, started):
+        with self.server.state_lock:
+            batch = self.server.batches.get(batch_id)
+        if batch is None:
+            return self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": "no such batch"}})
+        batch["canceled"] = True
+        self.server.stats.record("anthropic.batches.cancel", 200, time.perf_counter() - started)
+        self._send_json(200, self._batch_object(batch))
+
+    # OpenAI
+    def _openai_chat(self, body, started):
+        route = "openai.chat.completions"
+        latency = self._inject_error(route, started)
+        if latency is None:
+            return
+        time.sleep(latency)
+        text = _source_text(_message_text(body.get("messages", [])))
+        tool_calls = []
+        for tool in (body.get("tools") or [])[:1]:
+            function = tool["function"]
+            arguments = fake_tool_input(function.get("parameters", {}), text)
+            tool_calls.append({"id": "call_" + uuid.uuid4().hex[:20], "type": "function",
+                               "function": {"name": function["name"], "arguments": json.dumps(arguments, ensure_ascii=False)}})
+        payload = {
+            "id": "chatcmpl-" + uuid.uuid4().hex[:20],
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "finish_reason": "tool_calls" if tool_calls else "stop",
+                         "message": {"role": "assistant", "content": None if tool_calls else "mock", "tool_calls": tool_calls or None}}],
+            "usage": {"prompt_tokens": max(1, len(json.dumps(body)) // 4), "completion_tokens": 16, "total_tokens": 16 + max(1, len(json.dumps(body)) // 4)},
+        }
+        self.server.stats.record(route, 200, time.perf_counter() - started, body if self.server.log_bodies else None)
+        self._send_json(200, payload)
+
+    def _openai_create_assistant(self, body, started):
+        assistant = {
+            "id": "asst_" + uuid.uuid4().hex[:20], "object": "assistant", "created_at": int(time.time()),
+            "name": body.get("name"), "description": None, "model": body.get("model"), "instructions": body.get("instructions"),
+            "tools": body.get("tools", []), "metadata": body.get("metadata") or {},
+        }
+        with self.server.state_lock:
+            self.server.assistants[assistant["id"]] = assistant
+        self.server.stats.record("openai.assistants.create", 200, time.perf_counter() - started)
+        self._send_json(200, assistant)
+
+    def _openai_create_and_run(self, body, started):
+        route = "openai.threads.create_and_run"
+        latency = self._inject_error(route, started)
+        if latency is None:
+            return
+        with self.server.state_lock:
+            assistant = self.server.assistants.get(body.get("assistant_id"), {})
+        text = _source_text(_message_text((body.get("thread") or {}).get("messages", [])))
+        tool_calls = []
+        for tool in assistant.get("tools", [])[:1]:
+            function = tool["function"]
+            arguments = fake_tool_input(function.get("parameters", {}), text)
+            tool_calls.append({"id": "call_" + uuid.uuid4().hex[:20], "type": "function",
+                               "function": {"name": function["name"], "arguments": json.dumps(arguments, ensure_ascii=False)}})
+        run = {
+            "id": "run_" + uuid.uuid4().hex[:20], "object": "thread.run", "created_at": int(time.time()),
+            "thread_id": "thread_" + uuid.uuid4().hex[:20], "assistant_id": body.get("assistant_id"),
+            "status": "queued", "required_action": {"type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": tool_calls}},
+            "last_error": None, "expires_at": None, "started_at": None, "cancelled_at": None, "failed_at": None, "completed_at": None,
+            "model": assistant.get("model"), "instructions": assistant.get("instructions", ""), "tools": assistant.get("tools", []),
+            "file_ids": [], "metadata": {}, "usage": None, "_ready_at": time.time() + latency,
+        }
+        with self.server.state_lock:
+            self.server.runs[run["id"]] = run
+        public = {k: v for k, v in run.items() if not k.startswith("_")}
+        if body.get("stream"):
+            time.sleep(latency)
+            run["status"] = "requires_action"
+            queued = dict(public, status="queued")
+            done = dict(public, status="requires_action")
+            self.server.stats.record(route, 200, time.perf_counter() - started)
+            return self._send_events([("thread.run.created", queued), ("thread.run.queued", queued), ("thread.run.requires_action", done)])
+        self.server.stats.record(route, 200, time.perf_counter() - started)
+        self._send_json(200, public)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, config=None, log_bodies=False):
+        super().__init__((host, port), MockLLMHandler)
+        self.config = config or MockConfig()
+        self.rng = random.Random(self.config.seed)
+        self.rng_lock = threading.Lock()
+        self.state_lock = threading.Lock()
+        self.stats = MockStats()
+        self.log_bodies = log_bodies
+        self.assistants = {}
+        self.runs = {}
+        self.batches = {}
+        self.batch_lock = threading.Lock()
+        self.prompt_prefixes = set()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        import sys
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return # The client gave up on the call (a cancelled hedge or timeout)
+        super().handle_error(request, client_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Local stand-in for the Anthropic / OpenAI APIs")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--median-ms", type=float, default=300.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    args = parser.parse_args()
+    server = MockLLMServer(port=args.port, config=MockConfig(latency=args.latency, median_ms=args.median_ms, rate_429=args.rate_429, rate_5xx=args.rate_5xx))
+    print(f"Mock LLM server on {server.url} (ANTHROPIC_BASE_URL={server.url} OPENAI_BASE_URL={server.url}/v1)")
+    server.serve_forever()
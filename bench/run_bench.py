@@ -0,0 +1,179 @@
+"""
+Offline benchmark of the pipeline against the local mock LLM server
+* Runs process_file, post_proc_llm and get_translation_gpt over the sample CSVs in data/
+* Reports rows/sec, p50 / p99 server-side latency per call and request counts per scenario
+
+python -m bench.run_bench --median-ms 200 --rate-429 0.02 --json bench_output.json
+"""
+import argparse, asyncio, glob, json, os, shutil, tempfile, time
+import pandas as pd
+from bench.mock_server import MockConfig, MockLLMServer
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(q / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def prepare_inputs(data_dir, work_dir, max_files=None):
+    """
+    Raw transcripts (Start time, End time, Transcript) rebuilt from the sample _llm.csv files, plus copies of the _llm.csv files
+    """
+    raw_files, llm_files = [], []
+    for i, llm_file in enumerate(sorted(glob.glob(os.path.join(data_dir, "*_llm.csv")))[:max_files]):
+        df = pd.read_csv(llm_file)
+        if 'thai_transcript' not in df.columns:
+            continue
+        raw = df[['Start time', 'End time']].copy()
+        raw['Transcript'] = df['thai_transcript'].astype(str)
+        raw_file = os.path.join(work_dir, f"recording_{i:03d}.csv")
+        raw.to_csv(raw_file, index=False)
+        raw_files.append(raw_file)
+        llm_copy = os.path.join(work_dir, f"sample_{i:03d}_llm.csv")
+        shutil.copy(llm_file, llm_copy)
+        llm_files.append(llm_copy)
+    return raw_files, llm_files
+
+
+def count_rows(file_names):
+    return sum(len(pd.read_csv(f)) for f in file_names)
+
+
+def scenarios(raw_files, llm_files, n_gpt):
+    from src import translate
+    from src.dedup import NearDuplicateIndex
+    from src.batch import translate_files_batch
+    from src.backends import AnthropicBackend, HedgedBackend
+
+    api_key = os.environ['ANTHROPIC_API_KEY']
+    thai_texts = [text for f in raw_files for text in pd.read_csv(f)['Transcript'].astype(str)][:n_gpt]
+
+    def translate_files(**kwargs):
+        for f in raw_files:
+            translate.process_file(f, api_key, **kwargs)
+        return count_rows(raw_files)
+
+    def translate_bulk():
+        # Batch jobs: the request count covers batch API calls plus one entry per batched request
+        translate_files_batch(raw_files, api_key, poll_interval=0.1)
+        return count_rows(raw_files)
+
+    def post_proc_files(**kwargs):
+        for f in llm_files:
+            translate.post_proc_llm(f, **kwargs)
+        return count_rows(llm_files)
+
+    def qa_full_questions():
+        # The full question set from questions.txt, the worst case for the QA schema size
+        with open("questions.txt", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        for text in thai_texts:
+            translate.parse_qa_anthropic(text, questions, api_key)
+        return len(thai_texts)
+
+    def gpt_assistant():
+        for text in thai_texts:
+            translate.get_translation_gpt(text, use_cache=False)
+        return len(thai_texts)
+
+    def gpt_chat_async():
+        async def run():
+            await asyncio.gather(*[translate.get_translation_gpt_async(text, use_cache=False) for text in thai_texts])
+        translate.run_async(run())
+        return len(thai_texts)
+
+    return {
+        "translate_sequential": lambda: translate_files(max_concurrency=1),
+        "translate_concurrent": lambda: translate_files(max_concurrency=8),
+        "translate_batched": lambda: translate_files(max_concurrency=8, batch_chars=1500),
+        "translate_cascade": lambda: translate_files(max_concurrency=8, cascade=True),
+        "translate_dedup": lambda: translate_files(max_concurrency=8, dedup=NearDuplicateIndex()),
+        "translate_bulk": translate_bulk,
+        "translate_hedged": lambda: translate_files(max_concurrency=8, backend=HedgedBackend(AnthropicBackend(api_key), quantile=0.9, max_hedge_rate=0.1)),
+        "postproc_sequential": lambda: post_proc_files(),
+        "postproc_windowed": lambda: post_proc_files(window=16, overlap=4),
+        "qa_full_questions": qa_full_questions,
+        "gpt_assistant": gpt_assistant,
+        "gpt_chat_async": gpt_chat_async,
+    }
+
+
+def run_benchmark(config, data_dir="data", max_files=3, n_gpt=20, selected=None):
+    server = MockLLMServer(config=config).start()
+    os.environ["ANTHROPIC_BASE_URL"] = server.url
+    os.environ["OPENAI_BASE_URL"] = server.url + "/v1"
+    os.environ.setdefault("ANTHROPIC_API_KEY", "mock-key")
+    os.environ.setdefault("OPENAI_API_KEY", "mock-key")
+    os.environ["TRANSLATE_CACHE_DISABLE"] = "1" # Every scenario must hit the server
+
+    work_dir = tempfile.mkdtemp(prefix="translate-bench-")
+    results = {}
+    try:
+        raw_files, llm_files = prepare_inputs(data_dir, work_dir, max_files)
+        for name, scenario in scenarios(raw_files, llm_files, n_gpt).items():
+            if selected and name not in selected:
+                continue
+            server.stats.reset()
+            started = time.perf_counter()
+            n_rows = scenario()
+            elapsed = time.perf_counter() - started
+            stats = server.stats.snapshot()
+            latencies = [value for values in stats["latencies"].values() for value in values]
+            results[name] = {
+                "rows": n_rows,
+                "seconds": round(elapsed, 3),
+                "rows_per_sec": round(n_rows / elapsed, 2) if elapsed else 0.0,
+                "requests": sum(stats["requests"].values()),
+                "requests_by_route": stats["requests"],
+                "status_codes": stats["status_codes"],
+                "prompt_cache": stats["prompt_cache"],
+                "p50_ms": round(1000 * percentile(latencies, 50), 1),
+                "p99_ms": round(1000 * percentile(latencies, 99), 1),
+            }
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def print_report(results):
+    print(f"{'scenario':<22}{'rows':>7}{'rows/s':>9}{'requests':>10}{'p50 ms':>9}{'p99 ms':>9}  status codes / prompt cache")
+    for name, result in results.items():
+        print(f"{name:<22}{result['rows']:>7}{result['rows_per_sec']:>9}{result['requests']:>10}{result['p50_ms']:>9}{result['p99_ms']:>9}  {result['status_codes']} {result['prompt_cache']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark against a local mock LLM server")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--max-files", type=int, default=3)
+    parser.add_argument("--n-gpt", type=int, default=20, help="segments for the GPT scenarios")
+    parser.add_argument("--latency", default="lognormal", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--median-ms", type=float, default=300.0)
+    parser.add_argument("--sigma", type=float, default=0.4)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--weak-rate", type=float, default=0.1, help="untranslated answers from non-opus models")
+    parser.add_argument("--require-cache-markers", action="store_true", help="reject Anthropic tool requests without prompt-caching markers")
+    parser.add_argument("--prefix-ms-per-1k", type=float, default=0.0, help="extra latency per 1k uncached prompt-prefix tokens")
+    parser.add_argument("--batch-ms", type=float, default=200.0, help="time a message batch stays in progress")
+    parser.add_argument("--batch-error-rate", type=float, default=0.0, help="batched requests that come back errored")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenarios", nargs="*", help="subset of scenarios to run")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    config = MockConfig(latency=args.latency, median_ms=args.median_ms, sigma=args.sigma, rate_429=args.rate_429, rate_5xx=args.rate_5xx, weak_rate=args.weak_rate,
+                        require_cache_markers=args.require_cache_markers, prefix_ms_per_1k=args.prefix_ms_per_1k,
+                        batch_ms=args.batch_ms, batch_error_rate=args.batch_error_rate, seed=args.seed)
+    results = run_benchmark(config, data_dir=args.data_dir, max_files=args.max_files, n_gpt=args.n_gpt, selected=args.scenarios)
+    print_report(results)
+    from src.cascade import cascade_stats
+    if cascade_stats.summary():
+        print("\nmodel cascade")
+        print(cascade_stats.report())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
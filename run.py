@@ -1,9 +1,5 @@
-from src.translate import *
-# process_file("")
-import glob
-import os
-file_names = glob.glob("data/*.csv")
-file_name = file_names[1]
-
-process_file(file_name, api_key = os.environ['ANTHROPIC_API_KEY'])
+# Same as `python -m src ...`; with no arguments it prints the usage and exits without calling any API
+import sys
+from src.cli import main
 
+sys.exit(main(sys.argv[1:]))
@@ -1,5 +1,45 @@
-from .tool_use import *
-from .translate import *
-import glob
-import os
-import pandas as pd
\ No newline at end of file
+"""
+Submodules are imported on first attribute access (PEP 562), so `import src` and `python -m src --help` stay cheap
+* `from src import *` still exports every submodule's names, plus glob, os and pd
+* Lookups try the light modules first; the provider SDKs are only imported by the clients that use them
+"""
+import importlib
+
+
+# Cheapest first: pandas comes in with checkpoint / table / translate
+_submodules = ("cache", "metrics", "controller", "schemas", "cascade", "dedup", "prefilter", "clients", "tool_use", "checkpoint", "table", "store", "translate", "backends", "batch", "mapreduce", "stream", "runner", "cli")
+_extras = {"glob": "glob", "os": "os", "pd": "pandas"}
+
+
+def _public_names(module):
+    names = getattr(module, "__all__", None)
+    if names is None:
+        names = [name for name in vars(module) if not name.startswith("_")]
+    return names
+
+
+def __getattr__(name):
+    if name == "__all__":
+        names = list(_extras)
+        for submodule in _submodules:
+            names += [n for n in _public_names(importlib.import_module("." + submodule, __name__)) if n not in names]
+        globals()["__all__"] = names
+        return names
+    if name in _extras:
+        value = importlib.import_module(_extras[name])
+    elif name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    else:
+        for submodule in _submodules:
+            module = importlib.import_module("." + submodule, __name__)
+            if name in vars(module) and not name.startswith("_"):
+                value = vars(module)[name]
+                break
+        else:
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules) | set(_extras))
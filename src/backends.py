@@ -0,0 +1,211 @@
+"""
+Provider-agnostic translation backends
+* AnthropicBackend and OpenAIBackend both answer translate / translate_async with the same {'translation', 'revision'} record
+* HedgedBackend wraps a primary backend: a call still running after the primary's latency percentile gets a duplicate on the
+  hedge backend (the same one or the other provider); the first answer wins and the loser is cancelled
+* Hedges are capped at max_hedge_rate of all calls, so a slow provider cannot double the spend
+
+backend = HedgedBackend(AnthropicBackend(api_key), OpenAIBackend(), quantile=0.95, max_hedge_rate=0.05)
+await get_translate_async(thai_text, api_key, backend=backend)
+"""
+import asyncio, collections, threading, time
+from src.cascade import OPUS, resolve_models
+from src.metrics import current_calls, has_call_latency
+from src.translate import (translate_english_call_anthropic, translate_english_call_anthropic_async, translate_cascade_call_anthropic,
+                           translate_cascade_call_anthropic_async, get_translation_gpt, get_translation_gpt_async, run_async)
+
+
+def translation_record(calls):
+    """
+    {'translation', 'revision'} from the parsed calls of either provider; raises ValueError (a parse error) when there is none
+    """
+    if not calls or not calls[0].get('translation') or not calls[0].get('revision'):
+        raise ValueError("no translation in the answer")
+    return {'translation': calls[0]['translation'], 'revision': calls[0]['revision']}
+
+
+class Backend:
+    name = "backend"
+
+    def translate(self, thai_text, hints=()):
+        raise NotImplementedError
+
+    async def translate_async(self, thai_text, hints=()):
+        raise NotImplementedError
+
+
+class AnthropicBackend(Backend):
+    """
+    Claude tool use; cascade=True (or a tier list) goes through src.cascade
+    """
+
+    def __init__(self, api_key=None, model=OPUS, cascade=False, use_cache=True):
+        self.api_key = api_key
+        self.model = model
+        self.cascade = cascade
+        self.use_cache = use_cache
+        self.name = "anthropic"
+
+    def translate(self, thai_text, hints=()):
+        if self.cascade:
+            calls = translate_cascade_call_anthropic(thai_text, self.api_key, self.use_cache, models=resolve_models(self.cascade), hints=hints)
+        else:
+            calls = translate_english_call_anthropic(thai_text, self.api_key, self.use_cache, model=self.model, hints=hints)
+        return translation_record(calls)
+
+    async def translate_async(self, thai_text, hints=()):
+        if self.cascade:
+            calls = await translate_cascade_call_anthropic_async(thai_text, self.api_key, self.use_cache, models=resolve_models(self.cascade), hints=hints)
+        else:
+            calls = await translate_english_call_anthropic_async(thai_text, self.api_key, self.use_cache, model=self.model, hints=hints)
+        return translation_record(calls)
+
+
+class OpenAIBackend(Backend):
+    """
+    GPT function calling (chat completions, or the assistants API with use_assistant=True); hints are not used
+    """
+
+    def __init__(self, use_assistant=False, use_cache=True):
+        self.use_assistant = use_assistant
+        self.use_cache = use_cache
+        self.name = "openai"
+
+    def translate(self, thai_text, hints=()):
+        return translation_record(get_translation_gpt(thai_text, use_cache=self.use_cache, use_assistant=self.use_assistant))
+
+    async def translate_async(self, thai_text, hints=()):
+        return translation_record(await get_translation_gpt_async(thai_text, use_cache=self.use_cache, use_assistant=self.use_assistant))
+
+
+def get_backend(name, api_key=None, cascade=False):
+    """
+    "anthropic" or "openai"
+    """
+    if name == "anthropic":
+        return AnthropicBackend(api_key, cascade=cascade)
+    if name == "openai":
+        return OpenAIBackend()
+    raise ValueError(f"unknown backend: {name}")
+
+
+class LatencyWindow:
+    """
+    The last max_samples call latencies of one backend and their percentiles
+    """
+
+    def __init__(self, max_samples=512):
+        self._samples = collections.deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def add(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class HedgedBackend(Backend):
+    """
+    Hedged requests over a primary backend
+    * The hedge fires after the primary's quantile latency (initial_delay until min_samples calls have finished, never below min_delay)
+    * hedge=None hedges on the primary itself
+    * At most max_hedge_rate of calls are hedged (plus a burst of max_burst while the count is small); past the cap the call just waits
+    * A failed call does not wait for the hedge delay: its hedge fires immediately if the budget allows, otherwise the error propagates
+    * Latencies of cancelled losers are recorded at cancellation, a lower bound, so the tail estimate does not shrink because slow calls are cut short
+    * Only primary calls that reached the provider are recorded: an answer from the local cache would pull the percentile down to min_delay
+    """
+
+    def __init__(self, primary, hedge=None, quantile=0.95, max_hedge_rate=0.05, max_burst=2, initial_delay=5.0, min_delay=0.05, min_samples=20):
+        self.primary = primary
+        self.hedge = hedge or primary
+        self.quantile = quantile
+        self.max_hedge_rate = max_hedge_rate
+        self.max_burst = max_burst
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.name = f"hedged({self.primary.name}->{self.hedge.name})"
+        self.latencies = LatencyWindow()
+        self._lock = threading.Lock()
+        self.counts = collections.Counter()
+
+    def hedge_delay(self):
+        if len(self.latencies) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, self.latencies.percentile(self.quantile))
+
+    def _take_hedge(self):
+        with self._lock:
+            if self.counts["hedged"] >= self.max_hedge_rate * self.counts["calls"] + self.max_burst:
+                self.counts["over_budget"] += 1
+                return False
+            self.counts["hedged"] += 1
+            return True
+
+    def translate(self, thai_text, hints=()):
+        return run_async(self.translate_async(thai_text, hints))
+
+    async def translate_async(self, thai_text, hints=()):
+        with self._lock:
+            self.counts["calls"] += 1
+        started = time.perf_counter()
+        calls = [] # Metrics records of the primary's calls; the task copies the context, so they land here
+        token = current_calls.set(calls)
+        try:
+            primary = asyncio.ensure_future(self.primary.translate_async(thai_text, hints))
+        finally:
+            current_calls.reset(token)
+        tasks = {primary: self.primary}
+
+        def add_latency():
+            if not calls or any(has_call_latency(record) for record in calls):
+                self.latencies.add(time.perf_counter() - started)
+
+        try:
+            done, _ = await asyncio.wait([primary], timeout=self.hedge_delay())
+            if done and not primary.exception():
+                add_latency()
+                return primary.result()
+            # Slow or failed: duplicate the call on the hedge backend if the budget allows
+            if self._take_hedge():
+                tasks[asyncio.ensure_future(self.hedge.translate_async(thai_text, hints))] = self.hedge
+            error = None
+            while tasks:
+                done, _ = await asyncio.wait(list(tasks), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    del tasks[task]
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is primary:
+                        add_latency()
+                    else:
+                        with self._lock:
+                            self.counts["hedge_wins"] += 1
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    if task is primary:
+                        add_latency()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        counts.setdefault("calls", 0)
+        counts["hedge_rate"] = counts.get("hedged", 0) / counts["calls"] if counts["calls"] else 0.0
+        counts["hedge_delay"] = self.hedge_delay()
+        return counts
@@ -0,0 +1,333 @@
+"""
+Offline bulk mode through the Anthropic message batches endpoint
+* The same tool_use requests as translate_english_call_anthropic / parse_qa_anthropic, submitted as batch jobs instead of one call each
+  (batched requests are billed at half price and do not count against the per-minute rate limits)
+* Every request carries a custom_id that maps it back to its file and row; results are reconciled as each batch ends
+* Errored, expired and canceled requests, and answers that do not parse, are resubmitted in the next round (up to max_rounds)
+* Submitted batch ids are kept in an optional state file, so a restarted job picks up its in-flight batches instead of paying for them twice
+* Plain HTTP (httpx) against ANTHROPIC_BASE_URL, so it runs against bench.mock_server as well
+
+python -m src translate data/ --bulk --batch-state data/.batches.json
+"""
+import hashlib, json, os, time
+from types import SimpleNamespace
+from tqdm import tqdm
+from src.cache import get_cache
+from src.checkpoint import TranslationJournal
+from src.controller import controller
+from src.cascade import OPUS
+from src.metrics import metrics, usage_fields
+from src.schemas import batch_headers
+from src.table import read_table, write_table, llm_name, qa_name, transcript_text
+from src.translate import (build_translate_request, translate_cache_key, parse_translation_calls, build_qa_request, parse_qa_calls,
+                           fill_translation_columns)
+
+
+ANTHROPIC_VERSION = "2023-06-01"
+# Result types worth another round; an errored request is resubmitted unless the request itself was rejected
+retryable_results = {"errored", "expired", "canceled"}
+fatal_errors = {"invalid_request_error", "authentication_error", "permission_error", "not_found_error"}
+
+
+class BatchAPIError(Exception):
+    """
+    Non-2xx answer from the batches endpoint; status_code / response let src.controller classify it and honor retry-after
+    """
+
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} {response.text[:200]}")
+        self.status_code = response.status_code
+        self.response = response
+
+
+def as_message(message):
+    """
+    Batch result message (JSON) -> object with the attributes the parse_* functions and metrics read from SDK responses
+    """
+    return SimpleNamespace(
+        content=[SimpleNamespace(**block) for block in message.get("content", [])],
+        usage=SimpleNamespace(**message.get("usage", {})),
+        model=message.get("model"),
+        stop_reason=message.get("stop_reason"),
+    )
+
+
+def batch_params(request):
+    # Headers are per batch (batch_headers), not per request
+    return {key: value for key, value in request.items() if key != "extra_headers"}
+
+
+def custom_id(prefix, file_name, row=None):
+    """
+    [a-zA-Z0-9_-]{1,64} id that stays the same across runs, so the state file and journals line up after a restart
+    """
+    digest = hashlib.sha1(os.path.abspath(file_name).encode("utf-8")).hexdigest()[:16]
+    return f"{prefix}-{digest}" if row is None else f"{prefix}-{digest}-{row}"
+
+
+class BatchClient:
+    """
+    Minimal client for /v1/messages/batches: create, retrieve, results, cancel
+    * Every HTTP call goes through src.controller, so 429 / 5xx / connection errors are retried with backoff
+    """
+
+    def __init__(self, api_key=None, base_url=None, timeout=120.0):
+        import httpx
+        self.base_url = (base_url or os.environ.get("ANTHROPIC_BASE_URL") or "https://api.anthropic.com").rstrip("/")
+        self.headers = {
+            "x-api-key": api_key or os.environ.get("ANTHROPIC_API_KEY") or "",
+            "anthropic-version": ANTHROPIC_VERSION,
+            **batch_headers,
+        }
+        self._http = httpx.Client(timeout=timeout, headers=self.headers)
+        self._transport_error = httpx.TransportError
+
+    def _request(self, method, url, **kwargs):
+        if url.startswith("/"):
+            url = self.base_url + url
+        try:
+            response = self._http.request(method, url, **kwargs)
+        except self._transport_error as e:
+            raise ConnectionError(str(e)) from e # Classified as a connection error and retried
+        if response.status_code >= 400:
+            raise BatchAPIError(response)
+        return response
+
+    def create(self, requests):
+        """
+        requests: [{"custom_id": ..., "params": {...}}]
+        """
+        return controller.call(self._request, "POST", "/v1/messages/batches", json={"requests": requests}).json()
+
+    def retrieve(self, batch_id):
+        return controller.call(self._request, "GET", f"/v1/messages/batches/{batch_id}").json()
+
+    def cancel(self, batch_id):
+        return controller.call(self._request, "POST", f"/v1/messages/batches/{batch_id}/cancel").json()
+
+    def results(self, batch):
+        """
+        One {"custom_id", "result"} per request of an ended batch
+        """
+        url = batch.get("results_url") or f"/v1/messages/batches/{batch['id']}/results"
+        response = controller.call(self._request, "GET", url)
+        for line in response.text.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+    def close(self):
+        self._http.close()
+
+
+class BatchRunner:
+    """
+    Submit requests as batch jobs, poll them and hand each result to its handler, resubmitting what failed
+    * requests: {custom_id: params}; handle(custom_id, message) parses a succeeded message and returns False (or raises a parse error:
+      KeyError, TypeError, ValueError) to resubmit it
+    * max_requests caps the size of one batch (the endpoint accepts up to 100,000 requests / 256 MB)
+    * Returns the custom_ids that never succeeded, with the last error of each
+    * Several jobs can share a state file: a job only waits for and removes the batches holding at least one of its own custom_ids
+    """
+
+    def __init__(self, client, max_rounds=3, max_requests=10_000, poll_interval=30.0, state_file=None, call_site="batch"):
+        self.client = client
+        self.max_rounds = max_rounds
+        self.max_requests = max_requests
+        self.poll_interval = poll_interval
+        self.state_file = state_file
+        self.call_site = call_site
+
+    # State file: {batch_id: [custom_id, ...]} for the batches that are submitted but not reconciled yet
+    def _load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_state(self, state):
+        if not self.state_file:
+            return
+        tmp_name = self.state_file + ".tmp"
+        with open(tmp_name, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_name, self.state_file)
+
+    def submit(self, requests, state):
+        custom_ids = list(requests)
+        for start in range(0, len(custom_ids), self.max_requests):
+            chunk = custom_ids[start:start + self.max_requests]
+            batch = self.client.create([{"custom_id": i, "params": requests[i]} for i in chunk])
+            state[batch["id"]] = chunk
+            self._save_state(state)
+            print(f"Submitted batch {batch['id']}: {len(chunk)} requests")
+
+    def wait(self, batch_id):
+        delay = min(5.0, self.poll_interval)
+        while True:
+            batch = self.client.retrieve(batch_id)
+            if batch.get("processing_status") == "ended":
+                return batch
+            time.sleep(delay)
+            delay = min(delay * 2, self.poll_interval)
+
+    def run(self, requests, handle):
+        pending = dict(requests)
+        errors = {}
+        done = set()
+        state = self._load_state()
+        # Batches left by an interrupted run: wait for them rather than submitting their requests again
+        for batch_id in own_batches(state, requests):
+            for i in state[batch_id]:
+                pending.pop(i, None)
+        progress = tqdm(total=len(requests))
+        for round_index in range(self.max_rounds):
+            if pending:
+                if round_index:
+                    print(f"Resubmitting {len(pending)} requests")
+                self.submit(pending, state)
+            pending = {}
+            for batch_id in own_batches(state, requests):
+                for entry in self.client.results(self.wait(batch_id)):
+                    i, result = entry["custom_id"], entry["result"]
+                    if i not in requests or i in done:
+                        continue
+                    if result["type"] == "succeeded":
+                        message = as_message(result["message"])
+                        metrics.record(self.call_site, message.model, cache="batch", **usage_fields(message))
+                        try:
+                            handled = handle(i, message)
+                        except (KeyError, TypeError, ValueError): # Parse errors the handler let through: resubmit, do not abort the run
+                            handled = False
+                        if handled is not False:
+                            done.add(i)
+                            progress.update(1)
+                            continue
+                        errors[i] = "unparsable answer"
+                    else:
+                        # {"type": "errored", "error": {"type": "error", "error": {"type": "overloaded_error", ...}}}
+                        error = (result.get("error") or {}).get("error") or {}
+                        errors[i] = error.get("type") or result["type"]
+                        metrics.record(self.call_site, requests[i].get("model"), cache="batch", status="error", error=errors[i])
+                        if result["type"] not in retryable_results or errors[i] in fatal_errors:
+                            continue
+                    pending[i] = requests[i]
+                del state[batch_id]
+                self._save_state(state)
+            if not pending:
+                break
+        progress.close()
+        if self.state_file and os.path.exists(self.state_file) and not state:
+            os.remove(self.state_file)
+        return {i: errors.get(i, "no result") for i in requests if i not in done}
+
+
+def own_batches(state, requests):
+    """
+    Ids of the state file's batches that carry requests of this job
+    """
+    return [batch_id for batch_id, custom_ids in state.items() if any(i in requests for i in custom_ids)]
+
+
+def translate_files_batch(file_names, api_key, model=OPUS, resume=False, use_cache=True, state_file=None, max_rounds=3,
+                          max_requests=10_000, poll_interval=30.0, store=None, export=True):
+    """
+    Bulk process_file: translate every row of every file through batch jobs, one request per row
+    * Outputs, journals and "NA" failed rows are the same as process_file's, so retry_failed=True can pick up the rows that never succeeded
+    * resume=True keeps the rows already journaled as translated; cached rows are answered locally and never submitted
+    * store / export as in process_file: each file goes to the store in one transaction
+    """
+    cache = get_cache()
+    files = {}
+    requests = {}
+    for file_name in file_names:
+        output_name = llm_name(file_name)
+        journal = TranslationJournal(output_name + ".journal")
+        if not resume:
+            journal.reset()
+        finished = journal.entries()
+        df = read_table(file_name)
+        thai_texts = df['Transcript'].tolist()
+        results = [None] * len(thai_texts)
+        for row, thai_text in enumerate(thai_texts):
+            entry = finished.get(row)
+            if entry is not None and entry["status"] == "ok":
+                results[row] = (entry["translation"], entry["revision"])
+                continue
+            calls = cache.get(translate_cache_key(str(thai_text), model)) if use_cache else None
+            if calls:
+                results[row] = (calls[0]['translation'], calls[0]['revision'])
+                journal.record(row, "ok", translation=results[row][0], revision=results[row][1])
+                continue
+            requests[custom_id("t", file_name, row)] = batch_params(build_translate_request(str(thai_text), model))
+        files[file_name] = (df, thai_texts, results, journal)
+    rows = {custom_id("t", file_name, row): (file_name, row) for file_name, (_, thai_texts, _, _) in files.items() for row in range(len(thai_texts))}
+
+    def handle(i, message):
+        try:
+            calls = parse_translation_calls(message)
+            if not calls or not calls[0]['translation'] or not calls[0]['revision']:
+                return False
+        except (KeyError, TypeError, ValueError): # A tool input without its fields
+            return False
+        file_name, row = rows[i]
+        _, thai_texts, results, journal = files[file_name]
+        results[row] = (calls[0]['translation'], calls[0]['revision'])
+        journal.record(row, "ok", translation=results[row][0], revision=results[row][1])
+        if use_cache:
+            cache.set(translate_cache_key(str(thai_texts[row]), model), calls)
+
+    client = BatchClient(api_key)
+    try:
+        failed = BatchRunner(client, max_rounds=max_rounds, max_requests=max_requests, poll_interval=poll_interval, state_file=state_file,
+                             call_site="translate_english_call_anthropic").run(requests, handle) if requests else {}
+    finally:
+        client.close()
+
+    for file_name, (df, thai_texts, results, journal) in files.items():
+        output_name = llm_name(file_name)
+        for row, result in enumerate(results):
+            if result is None:
+                journal.record(row, "failed", text=str(thai_texts[row]))
+        if store is not None:
+            store.write_chunk(file_name, df, results, 0, model=model)
+        if export or store is None:
+            write_table(fill_translation_columns(df, results), output_name)
+        journal.close()
+        n_failed = sum(result is None for result in results)
+        if n_failed:
+            print(f"{n_failed} rows failed, rerun with retry_failed=True to retry them: {output_name}.journal")
+        else:
+            journal.remove()
+    return failed
+
+
+def parse_qa_files_batch(file_names, questions, api_key, model=OPUS, state_file=None, max_rounds=3, poll_interval=30.0, store=None):
+    """
+    Bulk parse_qa_anthropic: one request per transcript, written to <name>_qa.json as `python -m src qa` does, and to store if given
+    """
+    requests, outputs, sources = {}, {}, {}
+    for file_name in file_names:
+        i = custom_id("qa", file_name)
+        requests[i] = batch_params(build_qa_request(transcript_text(read_table(file_name)), questions, model))
+        outputs[i] = qa_name(file_name)
+        sources[i] = file_name
+
+    def handle(i, message):
+        try:
+            calls = parse_qa_calls(message, n_types=len(questions))
+        except (KeyError, TypeError, ValueError): # A tool input without its fields
+            return False
+        if not calls:
+            return False
+        if store is not None:
+            store.write_qa_calls(sources[i], calls, questions, model=model)
+        with open(outputs[i], "w", encoding="utf-8") as f:
+            json.dump({"questions": list(questions), "calls": calls}, f, ensure_ascii=False, indent=2)
+        print(outputs[i])
+
+    client = BatchClient(api_key)
+    try:
+        return BatchRunner(client, max_rounds=max_rounds, poll_interval=poll_interval, state_file=state_file,
+                           call_site="parse_qa_anthropic").run(requests, handle)
+    finally:
+        client.close()
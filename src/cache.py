@@ -0,0 +1,148 @@
+import functools, hashlib, json, os, sqlite3, threading, time, unicodedata
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "translate-thai", "llm_cache.sqlite")
+
+
+def normalize_text(text):
+    """
+    Normalize input text before it is hashed into a cache key
+    * Unicode NFC, so composed / decomposed Thai vowels and tone marks hash the same
+    * Leading, trailing and repeated whitespace collapsed
+    """
+    text = unicodedata.normalize("NFC", str(text))
+    return " ".join(text.split())
+
+
+def _schema_hash(schema):
+    payload = json.dumps(schema, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_frozen_schema_hash = functools.lru_cache(maxsize=1024)(_schema_hash)
+
+
+def schema_hash(schema):
+    # Frozen (hashable) schemas from src.schemas are hashed once; plain dicts / lists every time
+    try:
+        return _frozen_schema_hash(schema)
+    except TypeError:
+        return _schema_hash(schema)
+
+
+def make_key(text, model, schema):
+    """
+    Content-addressed key: normalized text + model name + hash of the tool schema / description
+    * Editing a tool description or schema changes the key, so stale entries are never served
+    """
+    payload = "\x1f".join([normalize_text(text), model, schema_hash(schema)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    On-disk SQLite cache for parsed LLM tool calls
+    * Least recently used entries are evicted once max_entries is exceeded
+    * hits / misses are counted per process
+    * enabled=False bypasses both lookups and writes
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=200_000, enabled=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._n_entries = 0
+
+    def _connect(self):
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+            self._n_entries = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return self._conn
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with conn:
+                conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                exists = conn.execute("SELECT 1 FROM cache WHERE key = ?", (key,)).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, last_access) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), time.time()),
+                )
+                if exists is None:
+                    self._n_entries += 1
+                if self._n_entries > self.max_entries:
+                    n_evict = self._n_entries - self.max_entries
+                    conn.execute(
+                        "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_access LIMIT ?)",
+                        (n_evict,),
+                    )
+                    self._n_entries -= n_evict
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM cache")
+            self._n_entries = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self._n_entries,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Shared process-wide cache
+    * TRANSLATE_CACHE_PATH overrides the database location
+    * TRANSLATE_CACHE_DISABLE=1 bypasses the cache entirely
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache(
+                path=os.environ.get("TRANSLATE_CACHE_PATH", DEFAULT_CACHE_PATH),
+                enabled=os.environ.get("TRANSLATE_CACHE_DISABLE", "0") != "1",
+            )
+        return _cache
+
+
+def set_cache(cache):
+    global _cache
+    with _cache_lock:
+        _cache = cache
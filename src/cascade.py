@@ -0,0 +1,162 @@
+"""
+Model cascade: try the fast model first and escalate only when its answer fails local checks
+* Tiers run haiku -> sonnet -> opus; each answer is validated locally, without another LLM call
+* Translation checks: well-formed tool_use, Thai script in revision, English in translation, translation / source length ratio in bounds
+* Per-tier acceptance and escalation reasons are counted, so the thresholds can be tuned
+"""
+import collections, re, threading
+
+
+HAIKU = "claude-3-haiku-20240307"
+SONNET = "claude-3-sonnet-20240229"
+OPUS = "claude-3-opus-20240229"
+
+cascade_tiers = (HAIKU, SONNET, OPUS)
+model_aliases = {"haiku": HAIKU, "sonnet": SONNET, "opus": OPUS}
+
+thai_pattern = re.compile(r"[\u0e00-\u0e7f]")
+latin_pattern = re.compile(r"[A-Za-z]")
+
+
+def resolve_models(models):
+    """
+    Tier list from True (the full cascade), a model name / alias, or a sequence of them (comma-separated in a string)
+    """
+    if models is True:
+        return cascade_tiers
+    if isinstance(models, str):
+        models = models.split(",")
+    return tuple(model_aliases.get(model.strip(), model.strip()) for model in models)
+
+
+def script_ratio(text, pattern):
+    """
+    Share of the letters in text that match pattern (whitespace, digits and punctuation are ignored)
+    """
+    letters = [c for c in str(text) if c.isalpha()]
+    if not letters:
+        return 0.0
+    return sum(1 for c in letters if pattern.match(c)) / len(letters)
+
+
+def validate_translation(thai_text, calls, min_ratio=0.3, max_ratio=5.0, min_chars=8):
+    """
+    None when the translation looks usable, otherwise the reason to escalate
+    """
+    if not calls:
+        return "no_tool_use"
+    translation, revision = calls[0].get('translation'), calls[0].get('revision')
+    if not isinstance(translation, str) or not isinstance(revision, str) or not translation.strip() or not revision.strip():
+        return "empty"
+    if script_ratio(thai_text, thai_pattern) > 0.5:
+        if script_ratio(revision, thai_pattern) < 0.5:
+            return "revision_not_thai"
+        if script_ratio(translation, latin_pattern) < 0.8:
+            return "translation_not_english"
+        # Ratios are meaningless for a word or two
+        if len(str(thai_text)) >= min_chars:
+            ratio = len(translation) / len(str(thai_text))
+            if ratio < min_ratio or ratio > max_ratio:
+                return "length_ratio"
+    return None
+
+
+def validate_qa(calls, n_types):
+    """
+    None when the QA tool call is well-formed: one call, every present question comes with a non-empty answer
+    """
+    if not calls:
+        return "no_tool_use"
+    for i in range(n_types):
+        if ('question_' + str(i)) in calls[0] and not str(calls[0].get('answer_' + str(i), "")).strip():
+            return "missing_answer"
+    return None
+
+
+class CascadeStats:
+    """
+    Counts per (call site, tier): calls, accepted answers and escalation reasons
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.tiers = collections.defaultdict(collections.Counter)
+
+    def record(self, call_site, model, reason):
+        with self._lock:
+            counts = self.tiers[(call_site, model)]
+            counts["calls"] += 1
+            counts["accepted" if reason is None else reason] += 1
+
+    def summary(self):
+        """
+        {(call_site, model): {"calls", "accepted", "hit_rate", <reason>: count}}
+        """
+        with self._lock:
+            tiers = {key: dict(counts) for key, counts in self.tiers.items()}
+        for counts in tiers.values():
+            counts.setdefault("accepted", 0)
+            counts["hit_rate"] = counts["accepted"] / counts["calls"] if counts["calls"] else 0.0
+        return tiers
+
+    def report(self):
+        lines = []
+        for (call_site, model), counts in sorted(self.summary().items()):
+            reasons = {k: v for k, v in counts.items() if k not in ("calls", "accepted", "hit_rate")}
+            lines.append(f"{call_site:<36}{model:<28}{counts['calls']:>7}{counts['hit_rate']:>8.1%}  {reasons}")
+        return "\n".join(lines)
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP llm_cascade_tier_calls_total Cascade tier answers by call site, model and outcome (accepted or the reason to escalate).",
+            "# TYPE llm_cascade_tier_calls_total counter",
+        ]
+        for (call_site, model), counts in sorted(self.summary().items()):
+            for outcome, count in sorted(counts.items()):
+                if outcome not in ("calls", "hit_rate"):
+                    lines.append(f'llm_cascade_tier_calls_total{{call_site="{call_site}",model="{model}",outcome="{outcome}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def run_cascade(call_site, call, validate, models=cascade_tiers):
+    """
+    call(model) returns the parsed calls of one tier, validate(calls) returns None or the reason to escalate
+    * The first accepted answer is returned; the last tier's answer is returned even when it fails validation
+    * A tier that raises escalates too; the last tier's error propagates
+    """
+    for n, model in enumerate(models):
+        last = n == len(models) - 1
+        try:
+            calls = call(model)
+        except Exception as e:
+            cascade_stats.record(call_site, model, "error:" + type(e).__name__)
+            if last:
+                raise
+            continue
+        reason = validate(calls)
+        cascade_stats.record(call_site, model, reason)
+        if reason is None or last:
+            return calls
+
+
+async def run_cascade_async(call_site, call, validate, models=cascade_tiers):
+    for n, model in enumerate(models):
+        last = n == len(models) - 1
+        try:
+            calls = await call(model)
+        except Exception as e:
+            cascade_stats.record(call_site, model, "error:" + type(e).__name__)
+            if last:
+                raise
+            continue
+        reason = validate(calls)
+        cascade_stats.record(call_site, model, reason)
+        if reason is None or last:
+            return calls
+
+
+cascade_stats = CascadeStats()
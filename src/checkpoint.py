@@ -0,0 +1,70 @@
+import json, os
+import pandas as pd
+
+
+class TranslationJournal:
+    """
+    Append-only journal of finished rows, one JSON line per row
+    * {"row": i, "status": "ok", "translation": ..., "revision": ...}
+    * {"row": i, "status": "failed", "text": ...}, so a later pass can retry only the failed rows
+    * The latest line for a row wins
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def reset(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def entries(self, min_row=0):
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # Torn last line from a crash
+                if entry["row"] >= min_row:
+                    entries[entry["row"]] = entry
+        return entries
+
+    def failed_rows(self):
+        return {row: entry for row, entry in self.entries().items() if entry["status"] == "failed"}
+
+    def record(self, row, status, **fields):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({"row": row, "status": status, **fields}, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.reset()
+
+
+def count_rows(file_name, chunk_size=10_000):
+    if not os.path.exists(file_name) or os.path.getsize(file_name) == 0:
+        return 0
+    return sum(len(chunk) for chunk in pd.read_csv(file_name, chunksize=chunk_size))
+
+
+def append_rows(df, file_name):
+    """
+    Append a chunk of rows to a CSV, writing the header only for the first chunk
+    * The chunk is rendered first and written with a single write, then fsynced
+    """
+    header = not os.path.exists(file_name) or os.path.getsize(file_name) == 0
+    payload = df.to_csv(index=False, header=header)
+    with open(file_name, "a", encoding="utf-8", newline="") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
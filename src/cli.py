@@ -0,0 +1,428 @@
+"""
+Command line entry point: python -m src <command> ...
+* translate: raw transcripts (<name>.csv / .parquet / .arrow) -> <name>_llm.<ext>
+* postproc:  <name>_llm.<ext> -> <name>__llm_proc.<ext> (question / answer slots)
+* qa:        one QA extraction per transcript -> <name>_qa.json
+* all:       translate + post process every recording in a directory, pipelined (see src.runner)
+* qa --chunked: map-reduce extraction over overlapping chunks, every answer with its time span (see src.mapreduce)
+* --bulk (translate, qa): submit everything as message batch jobs instead of live calls (see src.batch)
+* stream:    replay a raw transcript as a live feed and print translation / question / qa events as JSON lines (see src.stream)
+* --store results.db: also write every result to an indexed SQLite store (see src.store); --no-export then skips the output files
+* Cascade runs (--cascade / --models) end with the per-tier hit rates on stderr, and in the --metrics file
+* search / answers: full-text and question / date reports over the store; export / import: store <-> _llm / _llm_proc files
+Heavy modules (pandas, the provider SDKs) are imported inside the commands, so --help and argument errors return immediately.
+
+python -m src translate data/ --max-concurrency 16 --cascade
+python -m src postproc data/02_llm.csv --window 16
+python -m src postproc data/ --gate --evaluate --gate-thresholds 0.04,0.08,0.12
+python -m src all data --models haiku,opus --trace trace.jsonl
+python -m src translate data/ --dedup
+python -m src qa data/ --chunked --max-chars 2000
+python -m src translate data/ --bulk --batch-state data/.batches.json
+python -m src stream data/recording.csv --hedge openai --hedge-quantile 0.9
+python -m src --store results.db translate data/ --no-export
+python -m src --store results.db answers --question 0 --since 2024-04-01 --until 2024-04-30
+"""
+import argparse, asyncio, contextlib, glob, json, os, sys
+
+
+def expand_paths(paths, translated=False):
+    """
+    Files as given, directories expanded to their CSV / Parquet / Arrow files: translated (_llm) files or raw transcripts
+    """
+    from src.runner import is_llm_file, is_raw_file
+    file_names = []
+    for path in paths:
+        if os.path.isdir(path):
+            for file_name in sorted(glob.glob(os.path.join(path, "*.*"))):
+                if (is_llm_file if translated else is_raw_file)(file_name):
+                    file_names.append(file_name)
+        elif os.path.exists(path):
+            file_names.append(path)
+        else:
+            raise SystemExit(f"no such file or directory: {path}")
+    return file_names
+
+
+def read_questions(path):
+    if path is None:
+        from src.translate import qa_questions
+        return qa_questions
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def get_cascade(args):
+    if getattr(args, "models", None):
+        return args.models
+    return bool(getattr(args, "cascade", False))
+
+
+def make_dedup(args, paths):
+    """
+    NearDuplicateIndex over the _llm files next to the inputs, or None without --dedup
+    """
+    if not getattr(args, "dedup", False):
+        return None
+    from src.dedup import build_index
+    dirs = sorted({path if os.path.isdir(path) else os.path.dirname(path) or "." for path in paths})
+    return build_index(expand_paths(dirs, translated=True), reuse_threshold=args.dedup_threshold)
+
+
+def make_backend(args):
+    """
+    None for the default Claude path, otherwise a src.backends backend: another provider and / or hedged requests
+    """
+    backend_name, hedge = getattr(args, "backend", "anthropic"), getattr(args, "hedge", None)
+    if backend_name == "anthropic" and not hedge:
+        return None
+    from src.backends import get_backend, HedgedBackend
+    backend = get_backend(backend_name, args.api_key, cascade=get_cascade(args))
+    if not hedge:
+        return backend
+    hedge_backend = backend if hedge == "same" else get_backend(hedge, args.api_key, cascade=get_cascade(args))
+    return HedgedBackend(backend, hedge_backend, quantile=args.hedge_quantile, max_hedge_rate=args.hedge_rate)
+
+
+def get_single_model(args, mode="--bulk"):
+    """
+    The one model a bulk or chunked job runs on: there is no cascade to escalate through
+    """
+    from src.cascade import OPUS, resolve_models
+    if getattr(args, "cascade", False):
+        raise SystemExit(f"{mode} runs a single model, pick it with --models")
+    models = resolve_models(args.models) if getattr(args, "models", None) else (OPUS,)
+    if len(models) != 1:
+        raise SystemExit(f"{mode} runs a single model, pick it with --models")
+    return models[0]
+
+
+def make_store(args):
+    if not args.store:
+        if getattr(args, "no_export", False):
+            raise SystemExit("--no-export needs --store")
+        return None
+    from src.store import ResultStore
+    return ResultStore(args.store)
+
+
+def expand_translated(args, store):
+    """
+    Translated files for postproc / qa; with a store, raw transcripts whose _llm file was never exported are read from the store
+    """
+    file_names = expand_paths(args.paths, translated=True)
+    if store is not None:
+        from src.table import llm_name
+        file_names += [llm_name(f) for f in expand_paths(args.paths) if not os.path.exists(llm_name(f))]
+    return file_names
+
+
+def print_frame(df):
+    df.to_csv(sys.stdout, index=False)
+
+
+def make_gate(args):
+    if not getattr(args, "gate", False):
+        return None
+    from src.prefilter import SegmentGate
+    return SegmentGate(read_questions(args.questions), threshold=args.gate_threshold)
+
+
+def cmd_translate(args):
+    from src.translate import process_file_async, run_async
+
+    file_names = expand_paths(args.paths)
+    store = make_store(args)
+    if args.bulk and not args.retry_failed:
+        from src.batch import translate_files_batch
+        translate_files_batch(file_names, args.api_key, model=get_single_model(args), resume=args.resume, state_file=args.batch_state,
+                              poll_interval=args.poll_interval, store=store, export=not args.no_export)
+        return
+    dedup = make_dedup(args, args.paths)
+    backend = make_backend(args)
+
+    async def run():
+        semaphore = asyncio.Semaphore(args.max_concurrency)
+        file_slots = asyncio.Semaphore(args.max_files)
+
+        async def translate_file(file_name):
+            async with file_slots:
+                await process_file_async(file_name, args.api_key, batch_chars=args.batch_chars, chunk_size=args.chunk_size,
+                                         resume=args.resume, retry_failed=args.retry_failed, semaphore=semaphore, cascade=get_cascade(args),
+                                         dedup=dedup, backend=backend, store=store, export=not args.no_export)
+        await asyncio.gather(*[translate_file(file_name) for file_name in file_names])
+
+    run_async(run())
+
+
+def cmd_postproc(args):
+    from src.translate import post_proc_llm
+
+    if args.evaluate:
+        from src.prefilter import evaluate_gate_files
+        if not args.gate:
+            raise SystemExit("--evaluate needs --gate")
+        thresholds = [float(t) for t in args.gate_thresholds.split(",")] if args.gate_thresholds else None
+        for row in evaluate_gate_files(make_gate(args), expand_paths(args.paths, translated=True), thresholds):
+            print(json.dumps(row))
+        return
+    store = make_store(args)
+    questions = read_questions(args.questions)
+    for file_name in expand_translated(args, store):
+        post_proc_llm(file_name, window=args.window, overlap=args.overlap, max_concurrency=args.max_concurrency, gate=make_gate(args),
+                      store=store, export=not args.no_export, api_key=args.api_key, questions=questions)
+
+
+def cmd_qa(args):
+    from src.table import read_table, qa_name, transcript_text
+    from src.translate import parse_qa_anthropic, parse_qa_cascade
+
+    questions = read_questions(args.questions)
+    store = make_store(args)
+    if args.bulk:
+        from src.batch import parse_qa_files_batch
+        parse_qa_files_batch(expand_paths(args.paths, translated=True), questions, args.api_key, model=get_single_model(args),
+                             state_file=args.batch_state, poll_interval=args.poll_interval, store=store)
+        return
+    if args.chunked:
+        from src.mapreduce import extract_qa, as_qa_calls
+        from src.translate import read_segments
+        model = get_single_model(args, "--chunked")
+        for file_name in expand_translated(args, store):
+            answers = extract_qa(read_segments(file_name, store), questions, args.api_key, max_chars=args.max_chars, overlap=args.overlap,
+                                 max_concurrency=args.max_concurrency, model=model)
+            if store is not None:
+                store.write_chunked_answers(file_name, answers, model=model)
+            output_name = qa_name(file_name)
+            with open(output_name, "w", encoding="utf-8") as f:
+                json.dump({"questions": questions, "calls": as_qa_calls(answers), "answers": answers}, f, ensure_ascii=False, indent=2, default=str)
+            print(output_name)
+        return
+    cascade = get_cascade(args)
+    for file_name in expand_paths(args.paths, translated=True):
+        thai_text = transcript_text(read_table(file_name))
+        if cascade:
+            from src.cascade import resolve_models
+            calls = parse_qa_cascade(thai_text, questions, args.api_key, models=resolve_models(cascade))
+        else:
+            calls = parse_qa_anthropic(thai_text, questions, args.api_key)
+        if store is not None:
+            from src.store import model_label
+            store.write_qa_calls(file_name, calls, questions, model=model_label(cascade=cascade))
+        output_name = qa_name(file_name)
+        with open(output_name, "w", encoding="utf-8") as f:
+            json.dump({"questions": questions, "calls": calls}, f, ensure_ascii=False, indent=2)
+        print(output_name)
+
+
+def cmd_all(args):
+    from src.runner import run_corpus
+
+    run_corpus(args.data_dir, args.api_key, max_concurrency=args.max_concurrency, max_files=args.max_files, batch_chars=args.batch_chars,
+               window=args.window, overlap=args.overlap, gate=make_gate(args), force=args.force, status_file=args.status_file,
+               cascade=get_cascade(args), dedup=make_dedup(args, [args.data_dir]), backend=make_backend(args), store=make_store(args),
+               questions=read_questions(args.questions))
+
+
+def get_store(args):
+    if not args.store:
+        raise SystemExit(f"{args.command} needs --store")
+    return make_store(args)
+
+
+def cmd_search(args):
+    print_frame(get_store(args).search(args.text, recording=args.recording, limit=args.limit))
+
+
+def cmd_answers(args):
+    print_frame(get_store(args).answers(question_index=args.question, since=args.since, until=args.until, recording=args.recording,
+                                        text=args.text, source=args.source, limit=args.limit))
+
+
+def cmd_export(args):
+    from src.table import llm_name, llm_proc_name
+    store = get_store(args)
+    recordings = store.recordings()
+    names = args.recordings or recordings["name"].tolist()
+    for name in names:
+        output_name = os.path.join(args.output_dir, llm_name(name + args.format))
+        store.export(output_name, proc=args.proc)
+        print(llm_proc_name(output_name) if args.proc else output_name)
+
+
+def cmd_import(args):
+    store = get_store(args)
+    questions = read_questions(args.questions)
+    for path in args.paths:
+        file_names = sorted(glob.glob(os.path.join(path, "*.*"))) if os.path.isdir(path) else [path]
+        for file_name in file_names:
+            base = os.path.splitext(file_name)[0]
+            if base.endswith(("_llm", "_llm_proc")) or file_name.endswith("_qa.json"):
+                store.import_file(file_name, questions)
+    print_frame(store.recordings())
+
+
+def cmd_stream(args):
+    from src.stream import stream_segments, replay_segments
+    from src.translate import run_async
+
+    out = sys.stdout
+
+    async def run():
+        async for event in stream_segments(replay_segments(args.path, speed=args.speed), args.api_key, max_concurrency=args.max_concurrency,
+                                           cascade=get_cascade(args), segment_timeout=args.segment_timeout, backend=make_backend(args)):
+            if args.qa_only and event["event"] == "translation":
+                continue
+            print(json.dumps(event, ensure_ascii=False, default=str), file=out, flush=True)
+
+    # Progress prints from the pipeline go to stderr, so stdout stays one JSON event per line
+    with contextlib.redirect_stdout(sys.stderr):
+        run_async(run())
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m src", description="Thai transcript translation and QA parsing")
+    parser.add_argument("--api-key", default=os.environ.get("ANTHROPIC_API_KEY"), help="Anthropic API key (default: $ANTHROPIC_API_KEY)")
+    parser.add_argument("--trace", help="append a JSONL record per LLM call to this file")
+    parser.add_argument("--metrics", help="write a Prometheus text-format summary to this file on exit")
+    parser.add_argument("--store", help="SQLite result store (see src.store): results are written to it, reports read from it")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_bulk_options(p):
+        p.add_argument("--bulk", action="store_true", help="submit every request as a message batch job: half price, results within 24h")
+        p.add_argument("--batch-state", help="keep submitted batch ids in this file, so an interrupted bulk job resumes its batches")
+        p.add_argument("--poll-interval", type=float, default=30.0, help="seconds between batch status checks")
+
+    def add_backend_options(p):
+        p.add_argument("--backend", choices=["anthropic", "openai"], default="anthropic", help="provider for single-segment translations")
+        p.add_argument("--hedge", choices=["same", "anthropic", "openai"], help="duplicate slow calls on this backend, first answer wins")
+        p.add_argument("--hedge-quantile", type=float, default=0.95, help="hedge calls slower than this latency percentile")
+        p.add_argument("--hedge-rate", type=float, default=0.05, help="upper bound on the share of calls that are hedged")
+
+    def add_translate_options(p):
+        p.add_argument("--batch-chars", type=int, help="pack consecutive segments into batched calls of up to this many characters")
+        models = p.add_mutually_exclusive_group()
+        models.add_argument("--cascade", action="store_true", help="haiku -> sonnet -> opus, escalating only when local checks fail")
+        models.add_argument("--models", help="comma-separated tiers, e.g. haiku,opus or a single model (default: opus)")
+        p.add_argument("--dedup", action="store_true", help="reuse translations of near-duplicate segments, seeded from existing _llm files")
+        p.add_argument("--dedup-threshold", type=float, default=0.9, help="estimated similarity at which a translation is reused")
+        add_backend_options(p)
+
+    def add_postproc_options(p):
+        p.add_argument("--window", type=int, help="classify windows of this many segments per call (default: one call per segment)")
+        p.add_argument("--overlap", type=int, default=4)
+        p.add_argument("--gate", action="store_true", help="skip LLM calls for segments the offline pre-filter rejects")
+        p.add_argument("--gate-threshold", type=float, default=0.08)
+        p.add_argument("--questions", help="question list the LLM checks for and the gate screens with, one per line "
+                                           "(default: the built-in qa_questions)")
+
+    p = subparsers.add_parser("translate", help="translate raw transcripts")
+    p.add_argument("paths", nargs="+", help="CSV files or directories")
+    p.add_argument("--max-concurrency", type=int, default=8, help="LLM requests in flight across all files")
+    p.add_argument("--max-files", type=int, default=4)
+    p.add_argument("--chunk-size", type=int, default=256)
+    p.add_argument("--resume", action="store_true")
+    p.add_argument("--retry-failed", action="store_true")
+    p.add_argument("--no-export", action="store_true", help="write results only to --store, not to _llm files")
+    add_translate_options(p)
+    add_bulk_options(p)
+    p.set_defaults(func=cmd_translate)
+
+    p = subparsers.add_parser("postproc", help="slot questions and answers in translated transcripts")
+    p.add_argument("paths", nargs="+", help="_llm.csv files or directories")
+    p.add_argument("--max-concurrency", type=int, default=8)
+    p.add_argument("--no-export", action="store_true", help="write results only to --store, not to _llm_proc files")
+    p.add_argument("--evaluate", action="store_true", help="with --gate: report calls skipped and recall given up against the existing "
+                                                           "_llm_proc outputs, without any LLM call")
+    p.add_argument("--gate-thresholds", help="comma-separated thresholds to evaluate (default: --gate-threshold)")
+    add_postproc_options(p)
+    p.set_defaults(func=cmd_postproc)
+
+    p = subparsers.add_parser("qa", help="extract question / answer pairs from whole transcripts")
+    p.add_argument("paths", nargs="+", help="_llm.csv files or directories")
+    p.add_argument("--questions", help="question list, one per line (default: the built-in qa_questions)")
+    models = p.add_mutually_exclusive_group()
+    models.add_argument("--cascade", action="store_true")
+    models.add_argument("--models")
+    add_bulk_options(p)
+    p.add_argument("--chunked", action="store_true", help="map-reduce over overlapping chunks: every answer with its start / end time")
+    p.add_argument("--max-chars", type=int, default=2000, help="characters of transcript per chunk")
+    p.add_argument("--overlap", type=int, default=2, help="segments shared by consecutive chunks")
+    p.add_argument("--max-concurrency", type=int, default=16)
+    p.set_defaults(func=cmd_qa)
+
+    p = subparsers.add_parser("stream", help="replay a raw transcript as a live ASR feed")
+    p.add_argument("path", help="raw transcript file (Start time, End time, Transcript)")
+    p.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 releases every segment at once")
+    p.add_argument("--max-concurrency", type=int, default=8)
+    p.add_argument("--segment-timeout", type=float, default=30.0, help="upper bound in seconds on each LLM call")
+    p.add_argument("--qa-only", action="store_true", help="print only question / qa events")
+    models = p.add_mutually_exclusive_group()
+    models.add_argument("--cascade", action="store_true")
+    models.add_argument("--models")
+    add_backend_options(p)
+    p.set_defaults(func=cmd_stream)
+
+    p = subparsers.add_parser("all", help="translate and post process a whole directory")
+    p.add_argument("data_dir", nargs="?", default="data")
+    p.add_argument("--max-concurrency", type=int, default=16)
+    p.add_argument("--max-files", type=int, default=4)
+    p.add_argument("--force", action="store_true", help="redo outputs that are newer than their inputs")
+    p.add_argument("--status-file", help="write per-file progress to this JSON file")
+    add_translate_options(p)
+    add_postproc_options(p)
+    p.set_defaults(func=cmd_all)
+
+    p = subparsers.add_parser("search", help="segments of the store whose Thai or English text contains a phrase")
+    p.add_argument("text")
+    p.add_argument("--recording", help="only this recording (a name or any of its file names)")
+    p.add_argument("--limit", type=int, default=100)
+    p.set_defaults(func=cmd_search)
+
+    p = subparsers.add_parser("answers", help="answers in the store by question index, recording date and / or text")
+    p.add_argument("--question", type=int, help="question index (0-based, in --questions order)")
+    p.add_argument("--since", help="first recording date, YYYY-MM-DD")
+    p.add_argument("--until", help="last recording date, YYYY-MM-DD (inclusive)")
+    p.add_argument("--recording")
+    p.add_argument("--text", help="answers or questions containing this phrase")
+    p.add_argument("--source", choices=["postproc", "chunked", "qa"])
+    p.add_argument("--limit", type=int, default=1000)
+    p.set_defaults(func=cmd_answers)
+
+    p = subparsers.add_parser("export", help="write _llm (or _llm_proc) files from the store")
+    p.add_argument("recordings", nargs="*", help="recording names (default: all)")
+    p.add_argument("--output-dir", default=".")
+    p.add_argument("--format", choices=[".csv", ".parquet", ".arrow"], default=".csv")
+    p.add_argument("--proc", action="store_true", help="export post-processing answers (_llm_proc) instead of translations")
+    p.set_defaults(func=cmd_export)
+
+    p = subparsers.add_parser("import", help="load existing _llm, _llm_proc and _qa.json outputs into the store")
+    p.add_argument("paths", nargs="+", help="files or directories")
+    p.add_argument("--questions", help="question list the outputs were made with, one per line (default: the built-in qa_questions)")
+    p.set_defaults(func=cmd_import)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.trace or args.metrics:
+        from src.metrics import metrics, jsonl_hook
+        if args.trace:
+            metrics.add_hook(jsonl_hook(args.trace))
+    try:
+        args.func(args)
+    finally:
+        # Per-tier hit rates of a cascade run, to tune escalation; src.cascade is only loaded if a command used it
+        cascade = sys.modules.get("src.cascade")
+        cascade_stats = cascade.cascade_stats if cascade is not None and cascade.cascade_stats.summary() else None
+        if cascade_stats is not None:
+            print("model cascade\n" + cascade_stats.report(), file=sys.stderr)
+        if args.metrics:
+            metrics.export_prometheus(args.metrics)
+            if cascade_stats is not None:
+                with open(args.metrics, "a", encoding="utf-8") as f:
+                    f.write(cascade_stats.prometheus_text())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
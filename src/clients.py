@@ -0,0 +1,134 @@
+"""
+Shared API clients
+* One client per api key (and per event loop for async clients), so HTTP connection pools and TLS sessions are reused
+* Async clients are bound to the loop that created them, hence the per-loop registry
+* SDK retries are off: src.controller owns retries and backoff for every call, the assistant lookups here included
+* Each SDK is imported on first use, so a job that only talks to one provider never loads the other
+"""
+import asyncio, hashlib, json, threading, weakref
+from src.controller import controller
+
+
+_lock = threading.Lock()
+_anthropic_clients = {}
+_openai_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_anthropic_client(api_key=None):
+    with _lock:
+        if api_key not in _anthropic_clients:
+            import anthropic
+            _anthropic_clients[api_key] = anthropic.Anthropic(api_key = api_key, max_retries = 0)
+        return _anthropic_clients[api_key]
+
+
+def get_openai_client(api_key=None):
+    with _lock:
+        if api_key not in _openai_clients:
+            from openai import OpenAI
+            _openai_clients[api_key] = OpenAI(api_key = api_key, max_retries = 0) # Falls back to the OPENAI_API_KEY environment variable
+        return _openai_clients[api_key]
+
+
+def _get_async_client(provider, api_key):
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        if (provider, api_key) not in clients:
+            if provider == "anthropic":
+                import anthropic
+                clients[(provider, api_key)] = anthropic.AsyncAnthropic(api_key = api_key, max_retries = 0)
+            else:
+                from openai import AsyncOpenAI
+                clients[(provider, api_key)] = AsyncOpenAI(api_key = api_key, max_retries = 0)
+        return clients[(provider, api_key)]
+
+
+def get_async_anthropic_client(api_key=None):
+    return _get_async_client("anthropic", api_key)
+
+
+def get_async_openai_client(api_key=None):
+    return _get_async_client("openai", api_key)
+
+
+def tools_hash(tools):
+    payload = json.dumps(tools, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AssistantRegistry:
+    """
+    Create each OpenAI assistant once and reuse it
+    * Keyed by (name, instructions, tools hash, model)
+    * The key is stored in the assistant metadata, so later processes find and reuse it instead of creating another one
+    """
+
+    def __init__(self):
+        self._assistant_ids = {}
+        self._lock = threading.Lock()
+        self._async_locks = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def _find(client, key):
+        # Walks the pages itself, so one controller call covers (and retries) the whole listing
+        for assistant in client.beta.assistants.list(limit=100):
+            if (assistant.metadata or {}).get("registry_key") == key:
+                return assistant.id
+        return None
+
+    @staticmethod
+    async def _find_async(client, key):
+        async for assistant in client.beta.assistants.list(limit=100):
+            if (assistant.metadata or {}).get("registry_key") == key:
+                return assistant.id
+        return None
+
+    def _registry_key(self, name, instructions, tools, model):
+        payload = "\x1f".join([name, instructions, tools_hash(tools), model])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def get(self, client, name, instructions, tools, model):
+        key = self._registry_key(name, instructions, tools, model)
+        with self._lock:
+            if key not in self._assistant_ids:
+                assistant_id = controller.call(self._find, client, key)
+                if assistant_id is None:
+                    assistant_id = controller.call(
+                        client.beta.assistants.create,
+                        name=name,
+                        instructions=instructions,
+                        model=model,
+                        tools=tools,
+                        metadata={"registry_key": key},
+                    ).id
+                self._assistant_ids[key] = assistant_id
+            return self._assistant_ids[key]
+
+    async def get_async(self, client, name, instructions, tools, model):
+        key = self._registry_key(name, instructions, tools, model)
+        if key in self._assistant_ids:
+            return self._assistant_ids[key]
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            lock = self._async_locks.setdefault(loop, asyncio.Lock())
+        async with lock:
+            if key not in self._assistant_ids:
+                assistant_id = await controller.call_async(self._find_async, client, key)
+                if assistant_id is None:
+                    assistant = await controller.call_async(
+                        client.beta.assistants.create,
+                        name=name,
+                        instructions=instructions,
+                        model=model,
+                        tools=tools,
+                        metadata={"registry_key": key},
+                    )
+                    assistant_id = assistant.id
+                with self._lock:
+                    self._assistant_ids[key] = assistant_id
+        return self._assistant_ids[key]
+
+
+assistant_registry = AssistantRegistry()
@@ -0,0 +1,223 @@
+"""
+Shared request controller for every LLM call
+* Classifies errors (rate limit, overloaded, timeout, connection, parse, fatal) and retries only the transient ones; parse errors are left to the caller
+* Jittered exponential backoff, overridden by the provider's retry-after headers
+* AIMD concurrency: the in-flight limit grows by ~1 per limit successes and halves on a 429 (at most once per cooldown)
+* Works from threads (call) and from asyncio (call_async), with one shared limit
+"""
+import asyncio, collections, email.utils, functools, json, random, threading, time
+from src.metrics import note_retry, note_queue_wait
+
+
+RATE_LIMIT = "rate_limit"
+OVERLOADED = "overloaded"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+PARSE = "parse"
+FATAL = "fatal"
+
+retryable_kinds = {RATE_LIMIT, OVERLOADED, TIMEOUT, CONNECTION}
+
+
+def classify_error(e):
+    """
+    Error kind from an Anthropic / OpenAI SDK exception (duck-typed, so neither SDK has to be imported)
+    """
+    status_code = getattr(e, "status_code", None)
+    name = type(e).__name__
+    if status_code == 429 or name == "RateLimitError":
+        return RATE_LIMIT
+    if status_code is not None:
+        if status_code in (408, 409) or status_code >= 500:
+            return OVERLOADED
+        return FATAL
+    if "Timeout" in name or isinstance(e, (TimeoutError, asyncio.TimeoutError)):
+        return TIMEOUT
+    if "Connection" in name or isinstance(e, ConnectionError):
+        return CONNECTION
+    if isinstance(e, (KeyError, IndexError, TypeError, ValueError, json.JSONDecodeError)):
+        return PARSE
+    return FATAL
+
+
+def retry_after(e):
+    """
+    Seconds to wait according to the response headers (retry-after-ms, retry-after as seconds or HTTP date), or None
+    """
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestController:
+
+    def __init__(self, max_attempts=6, base_delay=0.5, max_delay=30.0,
+                 initial_limit=8, min_limit=1, max_limit=64, decrease_factor=0.5, cooldown=2.0, latency_target=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.counts = collections.Counter()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+
+    # Concurrency limit
+    def _try_acquire(self):
+        if self.in_flight < max(int(self.limit), self.min_limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def _wake(self):
+        # Wake as many waiters as there are free slots; each re-checks the limit itself
+        with self._lock:
+            n_free = max(int(self.limit), self.min_limit) - self.in_flight
+            wakers = [self._waiters.popleft() for _ in range(min(max(n_free, 0), len(self._waiters)))]
+        for wake in wakers:
+            wake()
+
+    def acquire(self):
+        started = time.perf_counter()
+        while True:
+            with self._lock:
+                if self._try_acquire():
+                    break
+                event = threading.Event()
+                self._waiters.append(event.set)
+            event.wait()
+        note_queue_wait(time.perf_counter() - started)
+
+    async def acquire_async(self):
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self._try_acquire():
+                    break
+                future = loop.create_future()
+                waker = functools.partial(loop.call_soon_threadsafe, _resolve, future)
+                self._waiters.append(waker)
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._lock:
+                    try:
+                        self._waiters.remove(waker) # Still queued: a later release must not spend its wake-up on it
+                        woken = False
+                    except ValueError:
+                        woken = True
+                if woken:
+                    self._wake() # Already woken: pass the wake-up on to the next waiter
+                raise
+        note_queue_wait(time.perf_counter() - started)
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._wake()
+
+    # AIMD
+    def on_success(self, latency):
+        with self._lock:
+            self.counts["success"] += 1
+            if self.latency_target is not None and latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * 0.9)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+        self._wake()
+
+    def on_rate_limit(self):
+        with self._lock:
+            self.counts[RATE_LIMIT] += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self._last_decrease = now
+
+    def backoff(self, attempt, e=None):
+        delay = retry_after(e) if e is not None else None
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)) # Full jitter
+        return min(delay, self.max_delay)
+
+    def _should_retry(self, e, attempt):
+        kind = classify_error(e)
+        with self._lock:
+            self.counts[kind] += 1
+        if kind == RATE_LIMIT:
+            self.on_rate_limit()
+        return kind in retryable_kinds and attempt + 1 < self.max_attempts
+
+    # Calls
+    def call(self, fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.acquire()
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.release()
+                if not self._should_retry(e, attempt):
+                    raise
+                time.sleep(self.backoff(attempt, e))
+                attempt += 1
+                note_retry()
+                continue
+            self.release()
+            self.on_success(time.perf_counter() - started)
+            return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            await self.acquire_async()
+            started = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                self.release()
+                if not self._should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(self.backoff(attempt, e))
+                attempt += 1
+                note_retry()
+                continue
+            except BaseException:
+                self.release()
+                raise
+            self.release()
+            self.on_success(time.perf_counter() - started)
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.limit, "in_flight": self.in_flight, **self.counts}
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+controller = RequestController()
@@ -0,0 +1,243 @@
+"""
+Near-duplicate segment reuse
+* fold_thai folds the differences that make recurring agent scripts miss the exact-match cache: spacing, repeated characters,
+  decomposed vowels / tone mark order, Thai digits, zero-width characters
+* normalize_thai also drops polite particles (ค่ะ / คะ / ครับ ...) at the end of the segment or before a space / punctuation
+* NearDuplicateIndex is a MinHash / LSH index over previously translated thai_transcript rows
+* A lookup at or above reuse_threshold reuses the stored translation; one at or above hint_threshold is passed to the LLM as a few-shot hint;
+  anything else is novel and goes to the LLM as before
+"""
+import pickle, re, threading, unicodedata
+import numpy as np
+
+
+_zero_width = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+# Polite particles, only at the end of the segment or before a space / punctuation (so e.g. คะแนน is left alone). Thai has no word
+# breaks, so a particle glued to the previous word cannot be told from a word ending in the same letters: ขา / คับ / จ้า (ปวดขา, เสื้อคับ)
+# are content words too and are never dropped, and นะ only as a word of its own (not the end of ชนะ)
+_word_end = "(?=$|[^\u0e00-\u0e7fA-Za-z0-9])"
+_word_start = "(?<![\u0e00-\u0e7fA-Za-z0-9])"
+_particles = re.compile("(?:ค่ะ|คะ|ค๊ะ|คร้าบ|ครับ|จ้ะ|จ๊ะ|จ่ะ)" + _word_end + "|" + _word_start + "(?:นะ|น่ะ)" + _word_end)
+_repeats = re.compile(r"(.)\1{2,}")
+_non_word = re.compile("[^0-9a-z\u0e00-\u0e7f]+") # \W would also drop Thai vowel and tone marks
+_thai_digits = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+_tone_marks = "่้๊๋"
+_upper_vowels = "ัิีึื็ํ"
+
+
+def _canonical(text):
+    text = unicodedata.normalize("NFC", str(text)).lower()
+    text = _zero_width.sub("", text).translate(_thai_digits)
+    text = text.replace("ํา", "ำ") # nikhahit + sara aa -> sara am
+    return re.sub(f"([{_tone_marks}])([{_upper_vowels}])", r"\2\1", text) # Upper vowel before tone mark
+
+
+def _squeeze(text):
+    text = _repeats.sub(r"\1\1", text) # ASR stretches (ค่าาาา)
+    return _non_word.sub("", text) # Thai is written without spaces, so ASR spacing carries no meaning
+
+
+def fold_thai(text):
+    """
+    Key that only differs between two segments when their words do
+    """
+    return _squeeze(_canonical(text))
+
+
+def normalize_thai(text):
+    """
+    fold_thai without polite particles, so ค่ะ / ครับ variants of one script share a key; a looser match than fold_thai
+    """
+    return _squeeze(_particles.sub(" ", _canonical(text)))
+
+
+def shingle_hashes(text, n=3):
+    """
+    Distinct 64-bit polynomial hashes of every character n-gram of an already normalized text (a shorter text is one n-gram)
+    """
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    n = min(n, len(codes))
+    hashes = np.zeros(len(codes) - n + 1, dtype=np.uint64)
+    for j in range(n):
+        hashes = hashes * np.uint64(1000003) + codes[j:len(codes) - n + 1 + j] # Wraps modulo 2^64
+    return np.unique(hashes)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures (num_perm hashes) split into bands of rows; two segments become candidates when any band matches exactly
+    * With bands b and rows r, a pair of Jaccard similarity s becomes a candidate with probability 1 - (1 - s^r)^b
+    * Signatures are taken over normalize_thai keys, so particle variants still become candidates; the top max_candidates candidates by
+      matching bands are ranked by their share of equal signature values (an estimate of their Jaccard similarity), and the best rescore
+      of them are scored by the exact Jaccard similarity of their fold_thai keys, so a dropped particle costs similarity
+    * A band bucket holds at most max_bucket segments, so a recurring script cannot make every lookup scan a long list; lookup cost is
+      bounded by bands * max_bucket whatever the index size
+    * Exact matches after fold_thai are answered from a dict, before any hashing
+    """
+
+    def __init__(self, reuse_threshold=0.9, hint_threshold=0.6, num_perm=64, bands=16, n=3, seed=1, max_bucket=64, max_candidates=32,
+                 rescore=4):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.reuse_threshold = reuse_threshold
+        self.hint_threshold = hint_threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.n = n
+        self.max_bucket = max_bucket
+        self.max_candidates = max_candidates
+        self.rescore = rescore
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(0, 1 << 62, size=num_perm, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1) # Odd multipliers
+        self._b = rng.randint(0, 1 << 62, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.texts = []
+            self.keys = [] # fold_thai keys
+            self.shingles = [] # shingle_hashes of the fold_thai keys, for the exact rescoring
+            self.values = []
+            self.exact = {}
+            self.band_tables = [{} for _ in range(self.bands)]
+            self.signatures = np.zeros((1024, self.num_perm), dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.values)
+
+    def signature(self, key):
+        """
+        MinHash signature of a normalize_thai key
+        """
+        hashes = shingle_hashes(key, self.n)
+        if not len(hashes):
+            return None
+        # Multiply-shift hashing, one (a, b) per permutation: the top 32 bits of a * x + b modulo 2^64
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) >> np.uint64(32)
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def similarity(self, hashes, other_hashes):
+        """
+        Jaccard similarity of two shingle_hashes sets
+        """
+        shared = len(np.intersect1d(hashes, other_hashes, assume_unique=True))
+        return shared / max(len(hashes) + len(other_hashes) - shared, 1)
+
+    def candidates(self, signature):
+        """
+        Ids of the indexed segments sharing the most bands with signature, at most max_candidates of them
+        """
+        hits = []
+        for table, band_key in zip(self.band_tables, self._band_keys(signature)):
+            hits.extend(table.get(band_key, ()))
+        if not hits:
+            return np.zeros(0, dtype=np.int64)
+        ids, counts = np.unique(np.asarray(hits, dtype=np.int64), return_counts=True)
+        if len(ids) > self.max_candidates:
+            ids = ids[np.argpartition(-counts, self.max_candidates - 1)[:self.max_candidates]]
+        return ids
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, thai_text, value):
+        """
+        Index one translated segment; value is what a lookup returns for it, e.g. (translation, revision)
+        """
+        key, loose_key = fold_thai(thai_text), normalize_thai(thai_text)
+        if not loose_key or key in self.exact:
+            return
+        signature = self.signature(loose_key)
+        with self._lock:
+            i = len(self.values)
+            self.texts.append(thai_text)
+            self.keys.append(key)
+            self.shingles.append(shingle_hashes(key, self.n))
+            self.values.append(value)
+            self.exact[key] = i
+            if i == len(self.signatures):
+                self.signatures = np.concatenate([self.signatures, np.zeros_like(self.signatures)])
+            self.signatures[i] = signature
+            for table, band_key in zip(self.band_tables, self._band_keys(signature)):
+                bucket = table.setdefault(band_key, [])
+                if len(bucket) < self.max_bucket:
+                    bucket.append(i)
+
+    def lookup(self, thai_text):
+        """
+        (similarity, matched text, value) of the most similar indexed segment at or above hint_threshold, or None
+        """
+        key, loose_key = fold_thai(thai_text), normalize_thai(thai_text)
+        if not loose_key:
+            return None
+        i = self.exact.get(key)
+        if i is not None:
+            return 1.0, self.texts[i], self.values[i]
+        signature = self.signature(loose_key)
+        candidates = self.candidates(signature)
+        if not len(candidates):
+            return None
+        estimates = (self.signatures[candidates] == signature).mean(axis=1)
+        best = np.argsort(-estimates, kind="stable")[:self.rescore]
+        best = best[estimates[best] >= self.hint_threshold]
+        if not len(best):
+            return None
+        hashes = shingle_hashes(key, self.n)
+        similarity, i = max((self.similarity(hashes, self.shingles[i]), int(i)) for i in candidates[best])
+        if similarity < self.hint_threshold:
+            return None
+        return similarity, self.texts[i], self.values[i]
+
+    def reusable(self, match):
+        return match is not None and match[0] >= self.reuse_threshold
+
+    def add_frame(self, df):
+        """
+        Index the translated rows of a _llm file (thai_transcript, translation); failed "NA" rows are skipped
+        """
+        for revision, translation in zip(df['thai_transcript'].tolist(), df['translation'].tolist()):
+            if isinstance(revision, str) and isinstance(translation, str) and translation != "NA":
+                self.add(revision, (translation, revision))
+        return self
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_lock"]
+        state["signatures"] = self.signatures[:len(self.values)]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        if "keys" not in state: # Saved before fold_thai: the exact dict was keyed on normalize_thai
+            self.keys = [fold_thai(text) for text in self.texts]
+            self.exact = {key: i for i, key in reversed(list(enumerate(self.keys)))}
+        if "shingles" not in state:
+            self.shingles = [shingle_hashes(key, self.n) for key in self.keys]
+            self.max_bucket, self.max_candidates, self.rescore = 64, 32, 4
+        if not len(self.signatures):
+            self.signatures = np.zeros((1024, self.num_perm), dtype=np.uint32)
+
+
+def build_index(file_names, **kwargs):
+    """
+    NearDuplicateIndex over the thai_transcript / translation rows of translated (_llm) files
+    """
+    from src.table import read_table
+    index = NearDuplicateIndex(**kwargs)
+    for file_name in file_names:
+        df = read_table(file_name)
+        if 'thai_transcript' in df.columns and 'translation' in df.columns:
+            index.add_frame(df)
+    return index
@@ -0,0 +1,128 @@
+"""
+Map-reduce QA extraction for long transcripts
+* map: the transcript is split into time-ordered chunks of up to max_chars characters that overlap by a few segments;
+  qa_tool runs on every chunk in parallel, each segment numbered by its row so answers come back with their location
+* reduce: answers are merged across chunks, deduplicated (the same answer segment, or the same normalized answer text, seen by two
+  overlapping chunks counts once) and given the Start time / End time span of their question and answer segments
+* A call's latency depends on the chunk size, not on the recording length; chunks only queue when max_concurrency is reached
+
+answers = extract_qa("data/02_llm.csv", qa_questions, api_key)
+"""
+import asyncio, os
+from tqdm import tqdm
+from src.cascade import OPUS
+from src.dedup import normalize_thai
+from src.metrics import timed_slot
+from src.table import SegmentTable, as_segment_table
+from src.translate import qa_chunk_call_anthropic_async, run_async
+
+
+def chunk_ranges(thai_texts, max_chars=2000, overlap=2, max_segments=80):
+    """
+    (start, end) row ranges covering every segment in order; consecutive ranges share overlap segments
+    * A range ends before max_chars characters or max_segments segments; a single longer segment gets a range of its own
+    """
+    ranges = []
+    start, n_rows = 0, len(thai_texts)
+    while start < n_rows:
+        end, n_chars = start, 0
+        while end < n_rows and end - start < max_segments:
+            n_chars += len(str(thai_texts[end]))
+            if n_chars > max_chars and end > start:
+                break
+            end += 1
+        ranges.append((start, end))
+        if end == n_rows:
+            break
+        start = max(end - overlap, start + 1)
+    return ranges
+
+
+def _located(segment, start, end):
+    return segment if isinstance(segment, int) and start <= segment < end else -1
+
+
+def merge_answers(table, ranges, chunk_entries, questions=None):
+    """
+    Reduce step: one answer per (question type, answer segment) across all chunks, in time order
+    * An answer without a valid segment number is matched on its normalized text instead, and spans its whole chunk
+    * Of two copies from overlapping chunks, the one farther from its chunk's edge (more context on both sides) is kept
+    """
+    best = {}
+    for (start, end), entries in zip(ranges, chunk_entries):
+        for entry in entries:
+            question_segment = _located(entry['question_segment'], start, end)
+            answer_segment = _located(entry['answer_segment'], start, end)
+            located = [segment for segment in (question_segment, answer_segment) if segment >= 0]
+            first, last = (min(located), max(located)) if located else (start, end - 1)
+            if answer_segment >= 0:
+                key = (entry['index'], answer_segment)
+            else:
+                key = (entry['index'], normalize_thai(entry['answer']))
+            margin = min(first - start, end - 1 - last)
+            if key in best and best[key][0] >= margin:
+                continue
+            best[key] = (margin, {
+                'index': entry['index'],
+                'question_type': questions[entry['index']] if questions is not None else None,
+                'question': entry['question'],
+                'answer': entry['answer'],
+                'question_segment': question_segment,
+                'answer_segment': answer_segment,
+                'start_time': table.start[first],
+                'end_time': table.end[last],
+                'first_segment': first,
+                'last_segment': last,
+            })
+    # An unlocated answer whose text was also reported with a location is the same answer
+    answers = [answer for _, answer in best.values()]
+    located = {(answer['index'], normalize_thai(answer['answer'])) for answer in answers if answer['answer_segment'] >= 0}
+    answers = [answer for answer in answers if answer['answer_segment'] >= 0 or (answer['index'], normalize_thai(answer['answer'])) not in located]
+    answers.sort(key=lambda answer: (answer['first_segment'], answer['index']))
+    return answers
+
+
+def as_qa_calls(answers):
+    """
+    The single-call format of parse_qa_calls (question_i / answer_i, first occurrence of each type), for code that expects it
+    """
+    call = {'name': 'qa_tool'}
+    for answer in answers:
+        i = answer['index']
+        if 'question_' + str(i) not in call:
+            call['question_' + str(i)] = answer['question']
+            call['answer_' + str(i)] = answer['answer']
+    return [call]
+
+
+async def extract_qa_async(source, questions, api_key=None, max_chars=2000, overlap=2, max_concurrency=16, semaphore=None, model=OPUS,
+                           use_cache=True):
+    """
+    Every answer to the question types in a transcript: a file name, a DataFrame or a SegmentTable
+    * Returns a list of {'index', 'question_type', 'question', 'answer', 'question_segment', 'answer_segment', 'start_time', 'end_time', ...}
+    * A chunk whose call fails is reported and left out
+    """
+    table = SegmentTable.read(source, columns=("thai", "start", "end")) if isinstance(source, str) else as_segment_table(source)
+    api_key = api_key or os.environ.get('ANTHROPIC_API_KEY')
+    ranges = chunk_ranges(table.thai, max_chars=max_chars, overlap=overlap)
+    segments = list(zip(range(len(table)), table.start, table.end, table.thai))
+    semaphore = semaphore or asyncio.Semaphore(max_concurrency)
+    progress = tqdm(total=len(ranges))
+
+    async def extract_chunk(start, end):
+        async with timed_slot(semaphore):
+            try:
+                entries = await qa_chunk_call_anthropic_async(segments[start:end], questions, api_key, model=model, use_cache=use_cache)
+            except Exception:
+                print(f"Chunk {start}-{end} failed")
+                entries = []
+        progress.update(1)
+        return entries
+
+    chunk_entries = await asyncio.gather(*[extract_chunk(start, end) for start, end in ranges])
+    progress.close()
+    return merge_answers(table, ranges, chunk_entries, questions)
+
+
+def extract_qa(source, questions, api_key=None, **kwargs):
+    return run_async(extract_qa_async(source, questions, api_key, **kwargs))
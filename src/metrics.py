@@ -0,0 +1,268 @@
+"""
+Per-call instrumentation for every LLM call site
+* Each call records wall-clock latency, queue wait, input / output tokens, retries, model and cache status
+* Hooks receive every record as it completes; records export as a JSONL trace or a Prometheus text-format summary
+"""
+import contextlib, contextvars, json, os, threading, time
+
+
+# Set by the caller around a call, picked up by the call site's record
+current_queue_wait = contextvars.ContextVar("current_queue_wait", default=0.0)
+current_attempt = contextvars.ContextVar("current_attempt", default=0)
+current_record = contextvars.ContextVar("current_record", default=None)
+# A list the caller sets to collect the record of every call made under it, e.g. to tell cache hits from API calls
+current_calls = contextvars.ContextVar("current_calls", default=None)
+
+
+def usage_tokens(response):
+    """
+    (input tokens, output tokens) from an Anthropic message, an OpenAI chat completion or an assistants run
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return 0, 0
+    input_tokens = getattr(usage, "input_tokens", None)
+    if input_tokens is None:
+        input_tokens = getattr(usage, "prompt_tokens", 0)
+    output_tokens = getattr(usage, "output_tokens", None)
+    if output_tokens is None:
+        output_tokens = getattr(usage, "completion_tokens", 0)
+    return input_tokens or 0, output_tokens or 0
+
+
+def usage_fields(response):
+    input_tokens, output_tokens = usage_tokens(response)
+    # Anthropic prompt caching: prefix tokens written to / read from the provider cache
+    usage = getattr(response, "usage", None)
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cache_write_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        "cache_read_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+    }
+
+
+def has_call_latency(record):
+    """
+    False for records that did not wait on a call of their own: "hit" (local cache), "near" (src.dedup), "batch" (answered by a batch job)
+    """
+    return record["cache"] not in ("hit", "near", "batch")
+
+
+def _collect(record):
+    calls = current_calls.get()
+    if calls is not None:
+        calls.append(record)
+
+
+class CallRecord(dict):
+
+    def set_usage(self, response):
+        self.update(usage_fields(response))
+
+
+class Metrics:
+
+    def __init__(self, max_records=1_000_000):
+        self.max_records = max_records
+        self.records = []
+        self.hooks = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def record(self, call_site, model, **fields):
+        record = CallRecord(
+            call_site=call_site,
+            model=model,
+            started=time.time(),
+            latency=0.0,
+            queue_wait=current_queue_wait.get(),
+            input_tokens=0,
+            output_tokens=0,
+            retries=current_attempt.get(),
+            cache="miss",
+            status="ok",
+            error=None,
+        )
+        record.update(fields)
+        _collect(record)
+        self._finish(record)
+        return record
+
+    @contextlib.contextmanager
+    def track(self, call_site, model, cache="miss"):
+        """
+        with metrics.track("translate_english_call_anthropic", model) as call:
+            response = client.beta.tools.messages.create(...)
+            call.set_usage(response)
+        """
+        record = CallRecord(
+            call_site=call_site,
+            model=model,
+            started=time.time(),
+            queue_wait=current_queue_wait.get(),
+            input_tokens=0,
+            output_tokens=0,
+            retries=current_attempt.get(),
+            cache=cache,
+            status="ok",
+            error=None,
+        )
+        _collect(record)
+        started = time.perf_counter()
+        token = current_record.set(record)
+        try:
+            yield record
+        except BaseException as e:
+            record["status"] = "error"
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            current_record.reset(token)
+            record["latency"] = time.perf_counter() - started
+            self._finish(record)
+
+    def _finish(self, record):
+        with self._lock:
+            self.records.append(record)
+            if len(self.records) > self.max_records:
+                del self.records[:len(self.records) - self.max_records]
+        for hook in self.hooks:
+            hook(record)
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+
+    def export_jsonl(self, path):
+        with self._lock:
+            records = list(self.records)
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def summary(self):
+        """
+        Aggregates per (call_site, model)
+        """
+        with self._lock:
+            records = list(self.records)
+        groups = {}
+        for record in records:
+            groups.setdefault((record["call_site"], record["model"]), []).append(record)
+        summary = {}
+        for key, group in groups.items():
+            latencies = sorted(r["latency"] for r in group if has_call_latency(r))
+            summary[key] = {
+                "calls": len(group),
+                "errors": sum(r["status"] == "error" for r in group),
+                "cache_hits": sum(r["cache"] == "hit" for r in group),
+                "near_duplicates": sum(r["cache"] == "near" for r in group),
+                "retries": sum(r["retries"] for r in group),
+                "input_tokens": sum(r["input_tokens"] for r in group),
+                "output_tokens": sum(r["output_tokens"] for r in group),
+                "cache_read_tokens": sum(r.get("cache_read_tokens", 0) for r in group),
+                "cache_write_tokens": sum(r.get("cache_write_tokens", 0) for r in group),
+                "latency_sum": sum(latencies),
+                "latency_count": len(latencies),
+                "queue_wait_sum": sum(r["queue_wait"] for r in group),
+                "quantiles": {q: _quantile(latencies, q) for q in (0.5, 0.9, 0.99)},
+            }
+        return summary
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP llm_calls_total LLM calls by call site, model, status and cache status.",
+            "# TYPE llm_calls_total counter",
+        ]
+        with self._lock:
+            records = list(self.records)
+        counts = {}
+        for record in records:
+            key = (record["call_site"], record["model"], record["status"], record["cache"])
+            counts[key] = counts.get(key, 0) + 1
+        for (call_site, model, status, cache), count in sorted(counts.items()):
+            lines.append(f'llm_calls_total{{call_site="{call_site}",model="{model}",status="{status}",cache="{cache}"}} {count}')
+
+        summary = self.summary()
+        lines += ["# HELP llm_call_latency_seconds Wall-clock latency of LLM calls that reached the API.", "# TYPE llm_call_latency_seconds summary"]
+        for (call_site, model), stats in sorted(summary.items()):
+            labels = f'call_site="{call_site}",model="{model}"'
+            for q, value in stats["quantiles"].items():
+                lines.append(f'llm_call_latency_seconds{{{labels},quantile="{q}"}} {value:.6f}')
+            lines.append(f"llm_call_latency_seconds_sum{{{labels}}} {stats['latency_sum']:.6f}")
+            lines.append(f"llm_call_latency_seconds_count{{{labels}}} {stats['latency_count']}")
+        lines += ["# HELP llm_queue_wait_seconds_total Time calls waited for a concurrency slot.", "# TYPE llm_queue_wait_seconds_total counter"]
+        for (call_site, model), stats in sorted(summary.items()):
+            lines.append(f'llm_queue_wait_seconds_total{{call_site="{call_site}",model="{model}"}} {stats["queue_wait_sum"]:.6f}')
+        lines += ["# HELP llm_tokens_total Tokens reported by the provider.", "# TYPE llm_tokens_total counter"]
+        for (call_site, model), stats in sorted(summary.items()):
+            for direction in ("input", "output", "cache_read", "cache_write"):
+                lines.append(f'llm_tokens_total{{call_site="{call_site}",model="{model}",direction="{direction}"}} {stats[direction + "_tokens"]}')
+        lines += ["# HELP llm_retries_total Retry attempts.", "# TYPE llm_retries_total counter"]
+        for (call_site, model), stats in sorted(summary.items()):
+            lines.append(f'llm_retries_total{{call_site="{call_site}",model="{model}"}} {stats["retries"]}')
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+
+
+def _quantile(values, q):
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[k]
+
+
+def note_retry():
+    """
+    Count a retry made inside the active call (e.g. by the request controller)
+    """
+    record = current_record.get()
+    if record is not None:
+        record["retries"] += 1
+
+
+def note_queue_wait(seconds):
+    record = current_record.get()
+    if record is not None:
+        record["queue_wait"] += seconds
+
+
+def jsonl_hook(path):
+    """
+    Hook that appends every record to a JSONL trace as it completes
+    """
+    lock = threading.Lock()
+
+    def hook(record):
+        with lock, open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return hook
+
+
+@contextlib.asynccontextmanager
+async def timed_slot(semaphore):
+    """
+    Acquire a concurrency slot and expose the time spent waiting for it to the call's record
+    """
+    started = time.perf_counter()
+    async with semaphore:
+        token = current_queue_wait.set(time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            current_queue_wait.reset(token)
+
+
+metrics = Metrics()
+if os.environ.get("TRANSLATE_TRACE_PATH"):
+    metrics.add_hook(jsonl_hook(os.environ["TRANSLATE_TRACE_PATH"]))
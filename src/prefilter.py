@@ -0,0 +1,208 @@
+"""
+Local pre-filter for post processing
+* Scores each segment against the preset questions with character n-gram TF-IDF, offline and without any LLM call
+* Segments that cannot be a related question, and do not follow one, skip check_transcript_call_anthropic
+"""
+import math, os, re, unicodedata
+from collections import Counter
+
+
+# Thai and English cues that a segment is asking something
+question_cues = ["ไหม", "มั้ย", "หรือเปล่า", "หรือไม่", "หรือยัง", "หรือว่า", "กี่", "อะไร", "อย่างไร", "ยังไง", "เคย", "ไหน", "เท่าไหร่", "?"]
+
+# Segments made only of these are greetings / fillers once particles and spaces are stripped
+filler_phrases = ["สวัสดี", "ค่ะ", "คะ", "ครับ", "คับ", "นะ", "จ้ะ", "จ้า", "อ่า", "อืม", "เอ่อ", "โอเค", "ขอบคุณ", "ขอบพระคุณ", "hello", "okay", "ok", "thank you", "thanks", "yes", "hmm"]
+
+
+def normalize_segment(text):
+    text = unicodedata.normalize("NFC", str(text)).lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def char_ngrams(text, n=3):
+    text = normalize_segment(text)
+    if len(text) < n:
+        return [text] if text else []
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+
+def is_filler(thai_text, english_text=""):
+    for text in (thai_text, english_text):
+        rest = normalize_segment(text)
+        for phrase in sorted(filler_phrases, key=len, reverse=True):
+            rest = rest.replace(phrase, "")
+        if re.sub(r"[\W\d_]+", "", rest):
+            return False
+    return True
+
+
+class SegmentGate:
+    """
+    Decide which segments need an LLM call
+    * score = max cosine similarity of the segment's char n-gram TF-IDF vector to any preset question, plus cue_weight if a question cue is present
+    * A segment is kept if score >= threshold, or if it is one of the follow_window segments after a kept one (a possible answer)
+    * Fillers and segments shorter than min_chars are never kept on score alone
+    """
+
+    def __init__(self, questions, thai_questions=(), threshold=0.08, cue_weight=0.1, follow_window=2, min_chars=4, n=3):
+        self.questions = list(questions)
+        self.thai_questions = list(thai_questions)
+        self.threshold = threshold
+        self.cue_weight = cue_weight
+        self.follow_window = follow_window
+        self.min_chars = min_chars
+        self.n = n
+        self.idf = {}
+        self.n_checked = 0
+        self.n_skipped = 0
+        self.fit([])
+
+    def fit(self, texts):
+        """
+        Fit IDF over the preset questions plus a file's segments, so n-grams common to every segment (greetings, particles) weigh little
+        """
+        documents = [set(char_ngrams(text, self.n)) for text in self.questions + self.thai_questions + list(texts)]
+        document_frequency = Counter(gram for document in documents for gram in document)
+        n_documents = len(documents)
+        self.idf = {gram: math.log((1 + n_documents) / (1 + df)) + 1 for gram, df in document_frequency.items()}
+        self._default_idf = math.log(1 + n_documents) + 1 # Unseen n-grams are rarer than any seen one
+        self._question_vectors = [self._vector(question) for question in self.questions]
+        self._thai_question_vectors = [self._vector(question) for question in self.thai_questions]
+        return self
+
+    def _vector(self, text):
+        counts = Counter(char_ngrams(text, self.n))
+        vector = {gram: count * self.idf.get(gram, self._default_idf) for gram, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return {gram: weight / norm for gram, weight in vector.items()}
+
+    @staticmethod
+    def _cosine(a, b):
+        if len(a) > len(b):
+            a, b = b, a
+        return sum(weight * b.get(gram, 0.0) for gram, weight in a.items())
+
+    def score(self, english_text, thai_text=""):
+        english_text, thai_text = str(english_text), str(thai_text)
+        english_vector = self._vector(english_text)
+        similarity = max((self._cosine(english_vector, q) for q in self._question_vectors), default=0.0)
+        if self.thai_questions and thai_text:
+            thai_vector = self._vector(thai_text)
+            similarity = max([similarity] + [self._cosine(thai_vector, q) for q in self._thai_question_vectors])
+        if any(cue in thai_text or cue in english_text for cue in question_cues):
+            similarity += self.cue_weight
+        return similarity
+
+    def best_question(self, english_text):
+        """
+        (index, similarity) of the preset question closest to english_text, e.g. to file a post-processed question under its type
+        """
+        english_vector = self._vector(str(english_text))
+        similarities = [self._cosine(english_vector, q) for q in self._question_vectors]
+        if not similarities:
+            return None, 0.0
+        index = max(range(len(similarities)), key=similarities.__getitem__)
+        return index, similarities[index]
+
+    def candidate(self, english_text, thai_text=""):
+        if len(normalize_segment(thai_text or english_text)) < self.min_chars or is_filler(thai_text, english_text):
+            return False
+        return self.score(english_text, thai_text) >= self.threshold
+
+    def filter(self, english_texts, thai_texts):
+        """
+        Keep mask over a file's segments: candidates plus the follow_window segments after each candidate
+        """
+        keep = [False] * len(english_texts)
+        follow = 0
+        for i, (english_text, thai_text) in enumerate(zip(english_texts, thai_texts)):
+            if self.candidate(english_text, thai_text):
+                keep[i] = True
+                follow = self.follow_window
+            elif follow > 0:
+                keep[i] = True
+                follow -= 1
+        self.n_checked += len(keep)
+        self.n_skipped += keep.count(False)
+        return keep
+
+    def stats(self):
+        return {
+            "checked": self.n_checked,
+            "skipped": self.n_skipped,
+            "skip_rate": self.n_skipped / self.n_checked if self.n_checked else 0.0,
+        }
+
+
+def labels_from_proc(df_llm, df_proc):
+    """
+    Relevance labels for a translated file from its _llm_proc.csv: rows whose start time is a question or answer start time
+    """
+    relevant_times = set()
+    for column in ["start_time_question", "start_time_answer"]:
+        if column in df_proc.columns:
+            relevant_times.update(round(float(t), 1) for t in df_proc[column].dropna())
+    return [round(float(t), 1) in relevant_times for t in df_llm["Start time"]]
+
+
+def evaluate_gate(gate, english_texts, thai_texts, labels, thresholds=None):
+    """
+    Calls skipped and recall given up on a labeled sample, for each threshold
+    * labels[i] is True if segment i is part of a related question / answer pair
+    """
+    thresholds = thresholds or [gate.threshold]
+    original = gate.threshold, gate.n_checked, gate.n_skipped
+    report = []
+    for threshold in thresholds:
+        gate.threshold = threshold
+        keep = gate.filter(english_texts, thai_texts)
+        n_relevant = sum(labels)
+        n_recalled = sum(1 for kept, label in zip(keep, labels) if kept and label)
+        report.append({
+            "threshold": threshold,
+            "segments": len(keep),
+            "skipped": keep.count(False),
+            "skip_rate": keep.count(False) / len(keep) if keep else 0.0,
+            "recall": n_recalled / n_relevant if n_relevant else 1.0,
+            "missed": n_relevant - n_recalled,
+        })
+    gate.threshold, gate.n_checked, gate.n_skipped = original
+    return report
+
+
+def evaluate_gate_files(gate, file_names, thresholds=None):
+    """
+    evaluate_gate over translated files labeled by their existing _llm_proc outputs, summed per threshold
+    * The gate is refitted on each file, as post processing does; files without an _llm_proc output are skipped
+    """
+    from src.table import read_table, llm_proc_name, SegmentTable
+    totals = {}
+    n_files = 0
+    for file_name in file_names:
+        proc_file = llm_proc_name(file_name)
+        if not os.path.exists(proc_file):
+            continue
+        df_llm = read_table(file_name)
+        try:
+            df_proc = read_table(proc_file)
+        except Exception: # An empty output has no header
+            df_proc = df_llm.iloc[:0, :0]
+        table = SegmentTable.from_frame(df_llm)
+        english_texts = [str(text) for text in table.english]
+        thai_texts = ["" if text is None else str(text) for text in table.thai]
+        labels = labels_from_proc(df_llm, df_proc)
+        gate.fit(english_texts)
+        for row in evaluate_gate(gate, english_texts, thai_texts, labels, thresholds):
+            total = totals.setdefault(row["threshold"], {"threshold": row["threshold"], "segments": 0, "skipped": 0, "relevant": 0, "missed": 0})
+            total["segments"] += row["segments"]
+            total["skipped"] += row["skipped"]
+            total["relevant"] += sum(labels)
+            total["missed"] += row["missed"]
+        n_files += 1
+    report = []
+    for total in totals.values():
+        total["files"] = n_files
+        total["skip_rate"] = total["skipped"] / total["segments"] if total["segments"] else 0.0
+        total["recall"] = 1.0 - total["missed"] / total["relevant"] if total["relevant"] else 1.0
+        report.append(total)
+    return report
@@ -0,0 +1,166 @@
+"""
+Corpus-level job runner
+* Translates and post-processes every recording in a directory with a pool of async workers
+* One semaphore is the global request budget shared by every file and both stages
+* Stages are pipelined: a file moves to the post-processing queue as soon as it is translated, so file B translates while file A post-processes
+"""
+import asyncio, copy, glob, json, os, time
+from src.translate import process_file_async, post_proc_llm, post_proc_llm_windowed_async, run_async
+from src.table import is_table, llm_name, llm_proc_name
+from src.dedup import build_index
+
+
+def is_llm_file(file_name):
+    return is_table(file_name) and os.path.splitext(file_name)[0].endswith("_llm")
+
+
+def is_raw_file(file_name):
+    return is_table(file_name) and not os.path.splitext(file_name)[0].endswith(("_llm", "_llm_proc"))
+
+
+def translated_name(file_name):
+    return llm_name(file_name)
+
+
+def proc_name(llm_file_name):
+    return llm_proc_name(llm_file_name)
+
+
+def up_to_date(source, target):
+    return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+
+
+def resumable(file_name):
+    """
+    A crashed run's <output>.part / .journal is resumed only if it was written after the input last changed;
+    leftovers of a run over an older version of the input are discarded
+    """
+    llm_file = translated_name(file_name)
+    leftovers = [f for f in (llm_file + ".part", llm_file + ".journal") if os.path.exists(f)]
+    return bool(leftovers) and all(up_to_date(file_name, f) for f in leftovers)
+
+
+class CorpusStatus:
+    """
+    Per-file progress: stage, status (pending / running / done / skipped / failed), error and timings
+    * Written to status_file as JSON after every change, so a long run can be watched from outside
+    """
+
+    def __init__(self, status_file=None):
+        self.status_file = status_file
+        self.files = {}
+
+    def update(self, file_name, **fields):
+        entry = self.files.setdefault(file_name, {"stage": None, "status": "pending", "error": None})
+        entry.update(fields)
+        entry["updated"] = time.time()
+        if self.status_file:
+            with open(self.status_file + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.files, f, ensure_ascii=False, indent=2)
+            os.replace(self.status_file + ".tmp", self.status_file)
+
+    def summary(self):
+        counts = {}
+        for entry in self.files.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+
+async def run_corpus_async(data_dir="data", api_key=None, stages=("translate", "postproc"), max_concurrency=16, max_files=4,
+                           batch_chars=None, window=None, overlap=4, gate=None, force=False, status_file=None, cascade=False,
+                           dedup=None, backend=None, store=None, questions=None):
+    """
+    Run translation and / or post processing over every CSV in data_dir
+    * Raw transcripts (no _llm suffix) are translated; existing _llm files go straight to post processing
+    * CSV, Parquet and Arrow files are picked up; outputs keep their input's format
+    * Outputs newer than their input are skipped unless force=True
+    * max_concurrency bounds LLM requests in flight across all files, max_files bounds files per stage
+    * cascade=True translates through the haiku -> sonnet -> opus cascade
+    * dedup=True reuses translations of near-duplicate segments, indexing the _llm files already in data_dir (see src.dedup);
+      a NearDuplicateIndex can also be passed directly
+    * backend (see src.backends) translates single segments, e.g. a HedgedBackend
+    * questions: the preset questions post processing checks for (default: the built-in qa_questions)
+    * store (a src.store.ResultStore) gets every translated chunk and post-processing result; the files are still written, since they
+      are what the up-to-date checks compare
+    """
+    api_key = api_key or os.environ.get('ANTHROPIC_API_KEY')
+    semaphore = asyncio.Semaphore(max_concurrency)
+    status = CorpusStatus(status_file)
+    translate_queue, postproc_queue = asyncio.Queue(), asyncio.Queue()
+
+    file_names = sorted(glob.glob(os.path.join(data_dir, "*.*")))
+    raw_files = [f for f in file_names if is_raw_file(f)]
+    translated = {translated_name(f) for f in raw_files}
+    llm_files = [f for f in file_names if is_llm_file(f) and f not in translated]
+    for file_name in raw_files:
+        status.update(file_name)
+        translate_queue.put_nowait(file_name)
+    for file_name in llm_files:
+        status.update(file_name)
+        postproc_queue.put_nowait(file_name)
+    if dedup is True:
+        dedup = build_index([f for f in file_names if is_llm_file(f)])
+
+    async def translate_worker():
+        while True:
+            file_name = await translate_queue.get()
+            if file_name is None:
+                return
+            llm_file = translated_name(file_name)
+            if "translate" in stages:
+                if not force and up_to_date(file_name, llm_file):
+                    status.update(file_name, stage="translate", status="skipped")
+                else:
+                    status.update(file_name, stage="translate", status="running", started=time.time())
+                    try:
+                        await process_file_async(file_name, api_key, batch_chars=batch_chars, resume=not force and resumable(file_name), semaphore=semaphore, cascade=cascade,
+                                                 dedup=dedup, backend=backend, store=store)
+                    except Exception as e:
+                        status.update(file_name, stage="translate", status="failed", error=repr(e))
+                        continue
+                    status.update(file_name, stage="translate", status="done")
+            if os.path.exists(llm_file):
+                await postproc_queue.put(llm_file)
+            elif "postproc" in stages:
+                status.update(file_name, stage="postproc", status="skipped", error="not translated")
+
+    async def postproc_worker():
+        while True:
+            llm_file = await postproc_queue.get()
+            if llm_file is None:
+                return
+            if "postproc" not in stages:
+                continue
+            if not force and up_to_date(llm_file, proc_name(llm_file)):
+                status.update(llm_file, stage="postproc", status="skipped")
+                continue
+            status.update(llm_file, stage="postproc", status="running", started=time.time())
+            file_gate = copy.deepcopy(gate) # The gate is refitted per file
+            try:
+                if window:
+                    await post_proc_llm_windowed_async(llm_file, window=window, overlap=overlap, gate=file_gate, semaphore=semaphore, store=store,
+                                                       api_key=api_key, questions=questions)
+                else:
+                    # The sequential mode makes one call at a time, so it holds a single slot of the budget
+                    async with semaphore:
+                        await asyncio.to_thread(post_proc_llm, llm_file, gate=file_gate, store=store, api_key=api_key, questions=questions)
+            except Exception as e:
+                status.update(llm_file, stage="postproc", status="failed", error=repr(e))
+                continue
+            status.update(llm_file, stage="postproc", status="done")
+
+    translate_workers = [asyncio.create_task(translate_worker()) for _ in range(max_files)]
+    postproc_workers = [asyncio.create_task(postproc_worker()) for _ in range(max_files)]
+    for _ in translate_workers:
+        translate_queue.put_nowait(None)
+    await asyncio.gather(*translate_workers)
+    for _ in postproc_workers:
+        postproc_queue.put_nowait(None)
+    await asyncio.gather(*postproc_workers)
+
+    print(status.summary())
+    return status.files
+
+
+def run_corpus(data_dir="data", api_key=None, **kwargs):
+    return run_async(run_corpus_async(data_dir, api_key, **kwargs))
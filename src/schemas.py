@@ -0,0 +1,72 @@
+"""
+Precompiled, immutable tool schemas
+* Tool definitions are built once per distinct argument set (functools.lru_cache) and shared by every request
+* FrozenDict / FrozenList are JSON-serializable dict / list subclasses that refuse mutation and hash by content,
+  so a shared schema cannot be edited by accident and its cache-key hash is computed once
+* The last tool carries an Anthropic prompt-caching marker, so the static tool prefix can be cached provider-side.
+  The API only caches a marked prefix on models with prompt caching (not claude-3-sonnet-20240229) and from a minimum size up
+  (1024 tokens, 2048 on haiku); the tool prefixes here are mostly shorter, so the marker pays off only once a prompt grows past that
+"""
+import json
+
+
+PROMPT_CACHING_BETA = "prompt-caching-2024-07-31"
+TOOLS_BETA = "tools-2024-04-04"
+MESSAGE_BATCHES_BETA = "message-batches-2024-09-24"
+# Replaces the SDK's own anthropic-beta header for client.beta.tools, so both betas are listed
+prompt_caching_headers = {"anthropic-beta": f"{TOOLS_BETA},{PROMPT_CACHING_BETA}"}
+# Message batches (src.batch); the headers apply to every request in the batch
+batch_headers = {"anthropic-beta": f"{MESSAGE_BATCHES_BETA},{PROMPT_CACHING_BETA}"}
+ephemeral_cache_control = {"type": "ephemeral"}
+
+
+def _readonly(self, *args, **kwargs):
+    raise TypeError(f"{type(self).__name__} is immutable")
+
+
+class FrozenDict(dict):
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = _readonly
+
+    def __hash__(self):
+        if not hasattr(self, "_hash"):
+            object.__setattr__(self, "_hash", hash(json.dumps(self, sort_keys=True, ensure_ascii=False)))
+        return self._hash
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class FrozenList(list):
+    __setitem__ = __delitem__ = append = extend = insert = pop = remove = clear = sort = reverse = __iadd__ = __imul__ = _readonly
+
+    def __hash__(self):
+        if not hasattr(self, "_hash"):
+            object.__setattr__(self, "_hash", hash(json.dumps(self, sort_keys=True, ensure_ascii=False)))
+        return self._hash
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+def compile_tools(tools, cache_prefix=True):
+    """
+    Frozen copy of a tool list; cache_prefix=True marks the last tool as the end of the cached prompt prefix
+    """
+    tools = [dict(tool) for tool in tools]
+    if cache_prefix and tools:
+        tools[-1]["cache_control"] = ephemeral_cache_control
+    return freeze(tools)
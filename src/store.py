@@ -0,0 +1,415 @@
+"""
+Indexed result store: one SQLite database instead of a _llm / _llm_proc file per recording
+* recordings: one row per recording (name without the _llm / _llm_proc suffix), with the recording date from a DDMMYYYY name or the source file time
+* segments: one row per transcript segment, keyed by (recording, row), with its time span, Thai text, translation, model and status
+* answers: post-processing question / answer pairs and QA extraction answers, with their question index, time span and model
+* segments_fts / answers_fts: FTS5 trigram indexes over the Thai and English text (Thai has no spaces, so word tokenizers do not apply);
+  triggers keep them in sync with their tables
+* Writes are one transaction per chunk / file (executemany), so a crash leaves whole chunks; WAL lets reports read while a run writes
+* The _llm / _llm_proc files become an export: ResultStore.export writes them back in their usual layout
+
+store = ResultStore("results.db")
+store.search("ยาเสพติด")
+store.answers(question_index=1, since="2024-04-01", until="2024-04-30")
+"""
+import datetime, json, os, re, sqlite3, threading, time
+import pandas as pd
+from src.cascade import OPUS, resolve_models
+from src.table import write_table, llm_proc_name
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    source TEXT,
+    recorded_at TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS recordings_recorded_at ON recordings (recorded_at);
+
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    recording_id INTEGER NOT NULL REFERENCES recordings (id) ON DELETE CASCADE,
+    row INTEGER NOT NULL,
+    start_time REAL,
+    end_time REAL,
+    transcript TEXT,
+    revision TEXT,
+    translation TEXT,
+    model TEXT,
+    status TEXT,
+    UNIQUE (recording_id, row)
+);
+CREATE INDEX IF NOT EXISTS segments_time ON segments (recording_id, start_time);
+CREATE INDEX IF NOT EXISTS segments_model ON segments (model, status);
+
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    recording_id INTEGER NOT NULL REFERENCES recordings (id) ON DELETE CASCADE,
+    source TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    question_index INTEGER,
+    question_type TEXT,
+    question TEXT,
+    answer TEXT,
+    thai_question TEXT,
+    thai_answer TEXT,
+    question_start REAL,
+    question_end REAL,
+    answer_start REAL,
+    answer_end REAL,
+    model TEXT
+);
+CREATE INDEX IF NOT EXISTS answers_question ON answers (question_index, recording_id);
+CREATE INDEX IF NOT EXISTS answers_recording ON answers (recording_id, source, position);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5 (revision, translation, content='segments', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS segments_ai AFTER INSERT ON segments BEGIN
+    INSERT INTO segments_fts (rowid, revision, translation) VALUES (new.id, new.revision, new.translation);
+END;
+CREATE TRIGGER IF NOT EXISTS segments_ad AFTER DELETE ON segments BEGIN
+    INSERT INTO segments_fts (segments_fts, rowid, revision, translation) VALUES ('delete', old.id, old.revision, old.translation);
+END;
+CREATE TRIGGER IF NOT EXISTS segments_au AFTER UPDATE ON segments BEGIN
+    INSERT INTO segments_fts (segments_fts, rowid, revision, translation) VALUES ('delete', old.id, old.revision, old.translation);
+    INSERT INTO segments_fts (rowid, revision, translation) VALUES (new.id, new.revision, new.translation);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS answers_fts USING fts5 (question, answer, thai_question, thai_answer, content='answers', content_rowid='id',
+                                                          tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS answers_ai AFTER INSERT ON answers BEGIN
+    INSERT INTO answers_fts (rowid, question, answer, thai_question, thai_answer)
+    VALUES (new.id, new.question, new.answer, new.thai_question, new.thai_answer);
+END;
+CREATE TRIGGER IF NOT EXISTS answers_ad AFTER DELETE ON answers BEGIN
+    INSERT INTO answers_fts (answers_fts, rowid, question, answer, thai_question, thai_answer)
+    VALUES ('delete', old.id, old.question, old.answer, old.thai_question, old.thai_answer);
+END;
+"""
+
+# Answer rows of post_proc_llm (_llm_proc columns) <-> answers columns
+proc_columns = {
+    "translate_question": "question",
+    "thai_question": "thai_question",
+    "start_time_question": "question_start",
+    "end_time_question": "question_end",
+    "translate_answer": "answer",
+    "thai_answer": "thai_answer",
+    "start_time_answer": "answer_start",
+    "end_time_answer": "answer_end",
+}
+answer_columns = ("question_index", "question_type", "question", "answer", "thai_question", "thai_answer", "question_start", "question_end",
+                  "answer_start", "answer_end", "model")
+_suffix = re.compile(r"(_+llm(_proc)?|_qa)$")
+_date = re.compile(r"(?<![0-9A-Za-z])(\d{2})(\d{2})((?:19|20)\d{2})(?!\d)") # Not the digits of a case id like C27072412
+
+
+def recording_name(file_name):
+    """
+    data/02.csv, data/02_llm.csv, data/02__llm_proc.csv and data/02_qa.json all belong to recording "02"
+    """
+    return _suffix.sub("", os.path.splitext(os.path.basename(file_name))[0])
+
+
+def recorded_at(file_name):
+    """
+    ISO date of a recording: a DDMMYYYY date in its name (Memo_19042024 -> 2024-04-19), else the file's modification time
+    """
+    for match in _date.finditer(os.path.basename(file_name)):
+        day, month, year = (int(group) for group in match.groups())
+        try:
+            return datetime.date(year, month, day).isoformat()
+        except ValueError:
+            continue
+    if os.path.exists(file_name):
+        return datetime.datetime.fromtimestamp(os.path.getmtime(file_name)).isoformat(timespec="seconds")
+    return None
+
+
+def model_label(model=OPUS, cascade=False, backend=None):
+    """
+    What a translation run is recorded as in segments.model
+    """
+    if backend is not None:
+        return backend.name
+    if cascade:
+        return "cascade:" + ",".join(resolve_models(cascade))
+    return model
+
+
+def _value(value):
+    # NaN / NA from pandas -> NULL
+    return None if value is None or (isinstance(value, float) and value != value) else value
+
+
+def _fts_query(text):
+    # A phrase query: the trigram tokenizer matches it as a substring
+    return '"' + str(text).replace('"', '""') + '"'
+
+
+class ResultStore:
+    """
+    SQLite result store, safe to share between the event loop and worker threads (one connection behind a lock)
+    """
+
+    def __init__(self, path="results.db"):
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        with self._lock, self.conn:
+            self.conn.executescript(schema)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return pd.read_sql_query(sql, self.conn, params=params)
+
+    def recording_id(self, file_name, source=None):
+        """
+        Id of the recording file_name belongs to, created on first use; source (a raw transcript) dates it
+        """
+        name = recording_name(file_name)
+        with self._lock:
+            row = self.conn.execute("SELECT id, source FROM recordings WHERE name = ?", (name,)).fetchone()
+            if row is not None:
+                if source is not None and source != row[1]:
+                    self.conn.execute("UPDATE recordings SET source = ?, recorded_at = ? WHERE id = ?", (source, recorded_at(source), row[0]))
+                return row[0]
+            source = source or file_name
+            cursor = self.conn.execute("INSERT INTO recordings (name, source, recorded_at, updated_at) VALUES (?, ?, ?, ?)",
+                                       (name, source, recorded_at(source), time.time()))
+            return cursor.lastrowid
+
+    def _touch(self, recording_id):
+        self.conn.execute("UPDATE recordings SET updated_at = ? WHERE id = ?", (time.time(), recording_id))
+
+    # Segments
+
+    def clear_segments(self, file_name):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM segments WHERE recording_id = ?", (self.recording_id(file_name),))
+
+    def write_chunk(self, file_name, chunk, results, row_offset, model=None):
+        """
+        One finished process_file chunk of the raw transcript file_name: its rows (Start time, End time, Transcript) and their
+        (translation, revision) results, None for a failed row; rows already in the store are replaced
+        """
+        starts, ends, transcripts = (chunk[c].tolist() if c in chunk.columns else [None] * len(chunk) for c in ("Start time", "End time", "Transcript"))
+        rows = []
+        for i, result in enumerate(results):
+            translation, revision = result or (None, None)
+            rows.append((row_offset + i, _value(starts[i]), _value(ends[i]), _value(transcripts[i]), revision, translation, model,
+                         "failed" if result is None else "ok"))
+        self._write_segments(file_name, rows, source=file_name)
+
+    def write_frame(self, file_name, df, model=None):
+        """
+        A whole translated (_llm) frame: Start time, End time, thai_transcript, translation; "NA" rows are stored as failed
+        """
+        columns = [df[c].tolist() if c in df.columns else [None] * len(df) for c in ("Start time", "End time", "Transcript", "thai_transcript", "translation")]
+        rows = []
+        for row, (start, end, transcript, revision, translation) in enumerate(zip(*columns)):
+            failed = _value(translation) is None or translation == "NA"
+            rows.append((row, _value(start), _value(end), _value(transcript), None if failed else _value(revision), None if failed else translation,
+                         model, "failed" if failed else "ok"))
+        self._write_segments(file_name, rows, replace=True)
+
+    def _write_segments(self, file_name, rows, source=None, replace=False):
+        with self._lock, self.conn:
+            recording_id = self.recording_id(file_name, source)
+            if replace:
+                self.conn.execute("DELETE FROM segments WHERE recording_id = ?", (recording_id,))
+            self.conn.executemany(
+                "INSERT INTO segments (recording_id, row, start_time, end_time, transcript, revision, translation, model, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (recording_id, row) DO UPDATE SET start_time = excluded.start_time, end_time = excluded.end_time, "
+                "transcript = excluded.transcript, revision = excluded.revision, translation = excluded.translation, model = excluded.model, "
+                "status = excluded.status",
+                [(recording_id, *row) for row in rows])
+            self._touch(recording_id)
+
+    def update_translations(self, file_name, results, model=None):
+        """
+        {row: (translation, revision)} recovered by retry_failed
+        """
+        with self._lock, self.conn:
+            recording_id = self.recording_id(file_name)
+            self.conn.executemany("UPDATE segments SET translation = ?, revision = ?, model = COALESCE(?, model), status = 'ok' "
+                                  "WHERE recording_id = ? AND row = ?",
+                                  [(translation, revision, model, recording_id, row) for row, (translation, revision) in results.items()])
+            self._touch(recording_id)
+
+    def segments_frame(self, file_name):
+        """
+        A recording's segments in the _llm layout (Start time, End time, thai_transcript, translation; "NA" for failed rows)
+        """
+        return self.query(
+            "SELECT s.start_time AS \"Start time\", s.end_time AS \"End time\", COALESCE(s.revision, 'NA') AS thai_transcript, "
+            "COALESCE(s.translation, 'NA') AS translation FROM segments s JOIN recordings r ON r.id = s.recording_id "
+            "WHERE r.name = ? ORDER BY s.row", (recording_name(file_name),))
+
+    # Answers
+
+    def _write_answers(self, file_name, source, answers):
+        with self._lock, self.conn:
+            recording_id = self.recording_id(file_name)
+            self.conn.execute("DELETE FROM answers WHERE recording_id = ? AND source = ?", (recording_id, source))
+            self.conn.executemany(
+                f"INSERT INTO answers (recording_id, source, position, {', '.join(answer_columns)}) VALUES (?, ?, ?{', ?' * len(answer_columns)})",
+                [(recording_id, source, position, *(_value(answer.get(c)) for c in answer_columns)) for position, answer in enumerate(answers)])
+            self._touch(recording_id)
+
+    def write_postproc(self, file_name, complete_list, questions=(), model=OPUS):
+        """
+        post_proc_llm's question / answer slots; the question type is the preset question closest to the English question
+        (a single preset question needs no matching)
+        """
+        gate = None
+        if len(questions) > 1:
+            from src.prefilter import SegmentGate
+            gate = SegmentGate(questions)
+        answers = []
+        for entry in complete_list:
+            answer = {column: entry.get(key) for key, column in proc_columns.items()}
+            if gate is not None:
+                index = gate.best_question(answer["question"] or "")[0]
+            else:
+                index = 0 if questions else None
+            answer.update(question_index=index, question_type=questions[index] if index is not None else None, model=model)
+            answers.append(answer)
+        self._write_answers(file_name, "postproc", answers)
+
+    def write_chunked_answers(self, file_name, answers, model=OPUS):
+        """
+        src.mapreduce answers: Thai question / answer with the time span of the segments they come from
+        """
+        self._write_answers(file_name, "chunked", [{
+            "question_index": answer["index"],
+            "question_type": answer.get("question_type"),
+            "thai_question": answer["question"],
+            "thai_answer": answer["answer"],
+            "question_start": answer["start_time"],
+            "answer_end": answer["end_time"],
+            "model": model,
+        } for answer in answers])
+
+    def write_qa_calls(self, file_name, calls, questions, model=OPUS):
+        """
+        One parse_qa_calls answer (question_i / answer_i per type), which carries no time span
+        """
+        answers = []
+        for call in calls:
+            for i, question_type in enumerate(questions):
+                if call.get(f"answer_{i}"):
+                    answers.append({"question_index": i, "question_type": question_type, "thai_question": call.get(f"question_{i}"),
+                                    "thai_answer": call[f"answer_{i}"], "model": model})
+        self._write_answers(file_name, "qa", answers)
+
+    def proc_frame(self, file_name):
+        """
+        A recording's post-processing answers in the _llm_proc layout
+        """
+        columns = ", ".join(f"a.{column} AS {key}" for key, column in proc_columns.items())
+        return self.query(f"SELECT {columns} FROM answers a JOIN recordings r ON r.id = a.recording_id "
+                          "WHERE r.name = ? AND a.source = 'postproc' ORDER BY a.position", (recording_name(file_name),))
+
+    # Reports
+
+    def recordings(self):
+        return self.query(
+            "SELECT r.name, r.recorded_at, r.source, "
+            "(SELECT COUNT(*) FROM segments s WHERE s.recording_id = r.id) AS segments, "
+            "(SELECT COUNT(*) FROM segments s WHERE s.recording_id = r.id AND s.status = 'failed') AS failed, "
+            "(SELECT COUNT(*) FROM answers a WHERE a.recording_id = r.id) AS answers "
+            "FROM recordings r ORDER BY r.recorded_at, r.name")
+
+    def search(self, text, recording=None, limit=100):
+        """
+        Segments whose Thai revision or English translation contains text (case-insensitive), in recording / time order
+        * Queries of three characters or more go through the trigram index; shorter ones (a two-letter Thai word) scan with instr
+        """
+        where, params = [], []
+        if len(str(text)) >= 3:
+            where.append("s.id IN (SELECT rowid FROM segments_fts WHERE segments_fts MATCH ?)")
+            params.append(_fts_query(text))
+        else:
+            where.append("(instr(s.revision, ?) OR instr(lower(s.translation), lower(?)))")
+            params += [text, text]
+        if recording is not None:
+            where.append("r.name = ?")
+            params.append(recording_name(recording))
+        return self.query(
+            "SELECT r.name AS recording, r.recorded_at, s.row, s.start_time, s.end_time, s.revision, s.translation, s.model "
+            "FROM segments s JOIN recordings r ON r.id = s.recording_id "
+            f"WHERE {' AND '.join(where)} ORDER BY r.recorded_at, r.name, s.row LIMIT ?", (*params, limit))
+
+    def answers(self, question_index=None, since=None, until=None, recording=None, text=None, source=None, limit=1000):
+        """
+        Answers filtered by question index, recording date range (ISO dates, until inclusive), recording, source and / or contained text,
+        e.g. every answer to question 1 in April 2024: answers(1, "2024-04-01", "2024-04-30")
+        """
+        where, params = [], []
+        if question_index is not None:
+            where.append("a.question_index = ?")
+            params.append(question_index)
+        if since is not None:
+            where.append("r.recorded_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("r.recorded_at < ?")
+            params.append(until + "\uffff") # Until the end of that day, whether recorded_at is a date or a timestamp
+        if recording is not None:
+            where.append("r.name = ?")
+            params.append(recording_name(recording))
+        if source is not None:
+            where.append("a.source = ?")
+            params.append(source)
+        if text is not None:
+            where.append("a.id IN (SELECT rowid FROM answers_fts WHERE answers_fts MATCH ?)")
+            params.append(_fts_query(text))
+        return self.query(
+            "SELECT r.name AS recording, r.recorded_at, a.source, a.question_index, a.question, a.answer, a.thai_question, a.thai_answer, "
+            "a.question_start, a.question_end, a.answer_start, a.answer_end, a.model "
+            "FROM answers a JOIN recordings r ON r.id = a.recording_id "
+            f"{'WHERE ' + ' AND '.join(where) if where else ''} ORDER BY r.recorded_at, r.name, a.source, a.position LIMIT ?", (*params, limit))
+
+    # Import / export
+
+    def export(self, file_name, proc=False):
+        """
+        Write a recording back as the file process_file (file_name is the _llm name) or post_proc_llm (proc=True) writes
+        """
+        if proc:
+            write_table(self.proc_frame(file_name), llm_proc_name(file_name))
+        else:
+            write_table(self.segments_frame(file_name), file_name)
+
+    def import_file(self, file_name, questions=()):
+        """
+        Load an existing output into the store: a _llm table, a _llm_proc table or a _qa.json
+        """
+        base = os.path.splitext(file_name)[0]
+        if file_name.endswith(".json"):
+            with open(file_name, encoding="utf-8") as f:
+                data = json.load(f)
+            if "answers" in data:
+                self.write_chunked_answers(file_name, data["answers"], model=None)
+            else:
+                self.write_qa_calls(file_name, data.get("calls", []), data.get("questions", questions), model=None)
+        elif base.endswith("_llm_proc"):
+            from src.table import read_table
+            try:
+                records = read_table(file_name).to_dict("records")
+            except pd.errors.EmptyDataError:
+                records = []
+            self.write_postproc(file_name, records, questions, model=None)
+        else:
+            from src.table import read_table
+            self.write_frame(file_name, read_table(file_name))
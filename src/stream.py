@@ -0,0 +1,174 @@
+"""
+Real-time mode: ASR segments in, translations and QA pairs out while the call is still going
+* stream_segments takes (start_time, end_time, thai_text) segments from any (async) iterable as they arrive
+* Each segment is translated as soon as it arrives, several in flight at once, and yielded the moment its translation is done
+* The question / answer state machine of post_proc_llm runs incrementally, in segment order, and emits each QA pair as soon as its answer is found
+* Every call, including its wait for a concurrency slot, is bounded by segment_timeout, so one slow call cannot hold back the rest of the stream
+"""
+import asyncio, time
+from src.table import SegmentTable
+from src.metrics import timed_slot
+from src.translate import (get_translate_async, check_transcript_call_anthropic_async, query_question, query_answer, slot_answer,
+                           qa_questions)
+
+
+class StreamingQA:
+    """
+    Incremental post_proc_llm: segments are added in order and each check_transcript result updates query_dict
+    * complete_list ends up the same as post_proc_llm's for the same labels
+    """
+
+    def __init__(self):
+        self.table = SegmentTable([], [], [], [])
+        self.query_dict = {}
+        self.complete_list = []
+
+    def add_segment(self, start_time, end_time, thai_text, translation):
+        self.table.start.append(start_time)
+        self.table.end.append(end_time)
+        self.table.thai.append(thai_text)
+        self.table.english.append(translation)
+        return len(self.table) - 1
+
+    @property
+    def prev_question(self):
+        return self.query_dict.get('translate_question')
+
+    def update(self, i, calls):
+        """
+        Apply one check_transcript result; returns the events it produced
+        """
+        events = []
+        if not calls:
+            return events
+        call = calls[0]
+        is_related_question = bool(call.get('is_related_question'))
+        is_answer = bool(call.get('is_answer'))
+        if is_related_question:
+            self.query_dict = query_question(self.table, i, self.query_dict)
+            events.append({"event": "question", "index": i, **self.query_dict})
+        if is_answer and not is_related_question:
+            self.query_dict = query_answer(self.table, i, self.query_dict)
+            if 'translate_answer' in self.query_dict:
+                events.append({"event": "qa", "index": i, **self.query_dict})
+            self.complete_list, self.query_dict = slot_answer(self.complete_list, self.query_dict)
+        return events
+
+
+async def _aiter(segments):
+    if hasattr(segments, "__aiter__"):
+        async for segment in segments:
+            yield segment
+    else:
+        for segment in segments:
+            yield segment
+
+
+async def stream_segments(segments, api_key, max_concurrency=8, cascade=False, preset_questions=None, check=True, segment_timeout=30.0, state=None,
+                          backend=None):
+    """
+    async for event in stream_segments(asr_segments, api_key): ...
+    * {"event": "translation", "index", "start_time", "end_time", "thai_text", "revision", "translation", "latency"} per segment, in completion order
+      (revision / translation are None when the call failed or timed out)
+    * {"event": "question", "index", ...} when a related question is detected, {"event": "qa", "index", ...} when its answer is slotted
+    * latency is seconds from the segment's arrival to its event
+    * state is an optional StreamingQA, to read complete_list once the stream is done
+    * backend (see src.backends) translates the segments, e.g. a HedgedBackend to cut the latency tail
+    """
+    preset_questions = preset_questions or (("\n").join(qa_questions)).strip()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    qa = state or StreamingQA()
+    events = asyncio.Queue()
+    translated = asyncio.Queue() # (index, segment, arrival time, translation task), in arrival order
+
+    async def translate_segment(i, segment, arrived):
+        start_time, end_time, thai_text = segment
+
+        async def translate():
+            async with timed_slot(semaphore):
+                return await get_translate_async(str(thai_text), api_key, cascade=cascade, backend=backend)
+
+        try:
+            # The wait for a free slot counts too: a segment stuck behind slow calls gives up instead of arriving stale
+            result = await asyncio.wait_for(translate(), segment_timeout)
+        except asyncio.TimeoutError:
+            result = None
+        await events.put({
+            "event": "translation", "index": i, "start_time": start_time, "end_time": end_time, "thai_text": thai_text,
+            "revision": result[1] if result else None, "translation": result[0] if result else None,
+            "latency": time.perf_counter() - arrived,
+        })
+        return result
+
+    async def read_segments():
+        i = 0
+        async for segment in _aiter(segments):
+            arrived = time.perf_counter()
+            task = asyncio.create_task(translate_segment(i, tuple(segment), arrived))
+            await translated.put((i, tuple(segment), arrived, task))
+            i += 1
+        await translated.put(None)
+
+    async def check_segments():
+        # The state machine needs the previous question, so segments are checked one at a time, in order
+        while True:
+            item = await translated.get()
+            if item is None:
+                return
+            i, (start_time, end_time, thai_text), arrived, task = item
+            result = await task
+            english_text = result[0] if result else None
+            revision = result[1] if result else thai_text
+            i = qa.add_segment(start_time, end_time, revision, english_text)
+            if not check or english_text is None:
+                continue
+            try:
+                calls = await asyncio.wait_for(
+                    check_transcript_call_anthropic_async(english_text, preset_questions, qa.prev_question, api_key), segment_timeout)
+            except Exception:
+                print(f"Segment {i} check failed")
+                continue
+            for event in qa.update(i, calls):
+                event["latency"] = time.perf_counter() - arrived
+                await events.put(event)
+
+    async def run():
+        reader, checker = asyncio.create_task(read_segments()), asyncio.create_task(check_segments())
+        try:
+            await reader
+            await checker
+        finally:
+            reader.cancel()
+            checker.cancel()
+            await events.put(None)
+
+    runner = asyncio.create_task(run())
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        await runner # Re-raise an error from the input iterator
+    finally:
+        if not runner.done():
+            runner.cancel()
+        while not translated.empty():
+            item = translated.get_nowait()
+            if item is not None:
+                item[3].cancel()
+
+
+async def replay_segments(file_name, speed=1.0):
+    """
+    Feed a raw transcript file as if it were arriving live: each segment is released at its end time / speed (speed=0: no pacing)
+    """
+    from src.table import read_table
+    df = read_table(file_name)
+    started = time.perf_counter()
+    for start_time, end_time, thai_text in zip(df['Start time'].tolist(), df['End time'].tolist(), df['Transcript'].tolist()):
+        if speed:
+            delay = float(end_time) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield start_time, end_time, thai_text
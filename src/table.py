@@ -0,0 +1,165 @@
+"""
+Column-oriented data layer for transcripts
+* CSV, Parquet and Arrow / Feather files are read and written by extension
+* SegmentTable reads the needed columns into plain lists once; the llm_translate / translation aliasing (name_shift) is resolved once per file,
+  and no other column is deserialized (Parquet / Arrow column projection, usecols for CSV)
+* Results are collected into lists and assembled into a frame in one step
+"""
+import os
+import pandas as pd
+
+
+parquet_extensions = (".parquet", ".pq")
+arrow_extensions = (".arrow", ".feather")
+table_extensions = (".csv",) + parquet_extensions + arrow_extensions
+
+# Post-processing columns: preferred name first, then the name written by process_file
+column_aliases = {
+    "english": ("llm_translate", "translation"),
+    "thai": ("llm_revision", "thai_transcript", "Transcript"),
+    "start": ("Start time",),
+    "end": ("End time",),
+}
+
+
+def table_format(file_name):
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext in parquet_extensions:
+        return "parquet"
+    if ext in arrow_extensions:
+        return "arrow"
+    return "csv"
+
+
+def is_table(file_name):
+    return file_name.lower().endswith(table_extensions)
+
+
+def llm_name(file_name):
+    """
+    <name>.<ext> -> <name>_llm.<ext>
+    """
+    base, ext = os.path.splitext(file_name)
+    return base + "_llm" + ext
+
+
+def llm_proc_name(file_name):
+    """
+    <name>_llm.<ext> -> <name>__llm_proc.<ext>, as post_proc_llm has always named it
+    """
+    base, ext = os.path.splitext(file_name)
+    if base.endswith("llm"):
+        base = base[:-len("llm")]
+    return base + "_llm_proc" + ext
+
+
+def qa_name(file_name):
+    """
+    <name>.<ext> or <name>_llm.<ext> -> <name>_qa.json
+    """
+    base = os.path.splitext(file_name)[0]
+    return (base[:-len("_llm")] if base.endswith("_llm") else base) + "_qa.json"
+
+
+def transcript_text(df):
+    """
+    The whole Thai transcript of a file as one text, one segment per line, for QA extraction
+    """
+    column = next(c for c in ("llm_revision", "thai_transcript", "Transcript") if c in df.columns)
+    return "\n".join(df[column].astype(str))
+
+
+def read_table(file_name, columns=None, **csv_kwargs):
+    fmt = table_format(file_name)
+    if fmt == "parquet":
+        return pd.read_parquet(file_name, columns=columns)
+    if fmt == "arrow":
+        return pd.read_feather(file_name, columns=columns)
+    return pd.read_csv(file_name, usecols=columns, **csv_kwargs)
+
+
+def read_present_columns(file_name, names, **csv_kwargs):
+    """
+    Only the columns of names that the file has, without loading the others; the Parquet / Arrow schema is read from the footer / header
+    """
+    fmt = table_format(file_name)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        present = set(pq.read_schema(file_name).names)
+        return pq.read_table(file_name, columns=[name for name in names if name in present]).to_pandas()
+    if fmt == "arrow":
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        with pa.memory_map(file_name) as source:
+            present = set(pa.ipc.open_file(source).schema.names)
+        return feather.read_table(file_name, columns=[name for name in names if name in present]).to_pandas()
+    wanted = set(names)
+    return pd.read_csv(file_name, usecols=lambda name: name in wanted, **csv_kwargs)
+
+
+def write_table(df, file_name):
+    fmt = table_format(file_name)
+    if fmt == "parquet":
+        df.to_parquet(file_name, index=False)
+    elif fmt == "arrow":
+        df.reset_index(drop=True).to_feather(file_name)
+    else:
+        df.to_csv(file_name, index=False)
+
+
+def iter_chunks(file_name, chunk_size, **csv_kwargs):
+    """
+    DataFrames of up to chunk_size rows; Parquet is read batch by batch, Arrow / Feather is read once and sliced
+    """
+    fmt = table_format(file_name)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(file_name).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    elif fmt == "arrow":
+        df = pd.read_feather(file_name)
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+    else:
+        yield from pd.read_csv(file_name, chunksize=chunk_size, **csv_kwargs)
+
+
+def resolve_column(columns, key):
+    for name in column_aliases[key]:
+        if name in columns:
+            return name
+    return None
+
+
+class SegmentTable:
+    """
+    Plain-list view of the columns post processing reads: english, thai, start, end
+    """
+
+    def __init__(self, english, thai, start, end):
+        self.english = english
+        self.thai = thai
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def from_frame(cls, df):
+        columns = {key: resolve_column(df.columns, key) for key in column_aliases}
+        n_rows = len(df)
+        lists = {key: df[name].tolist() if name is not None else [None] * n_rows for key, name in columns.items()}
+        return cls(**lists)
+
+    @classmethod
+    def read(cls, file_name, columns=None):
+        """
+        columns: the keys to load, e.g. ("thai", "start", "end") (default: all four); the others come back as lists of None
+        """
+        names = [name for key in (columns or column_aliases) for name in column_aliases[key]]
+        return cls.from_frame(read_present_columns(file_name, names))
+
+    def __len__(self):
+        return len(self.english)
+
+
+def as_segment_table(table):
+    return table if isinstance(table, SegmentTable) else SegmentTable.from_frame(table)
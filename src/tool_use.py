@@ -1,4 +1,4 @@
-import json, time, openai 
+import asyncio, json, time
 
 def show_json(obj):
     display(json.loads(obj.model_dump_json()))
@@ -6,8 +6,11 @@ def show_json(obj):
 def show_json(obj):
     display(json.loads(obj.model_dump_json()))
 
-from openai import OpenAI
+from src.clients import get_openai_client, get_async_openai_client, assistant_registry
+from src.metrics import metrics
+from src.controller import controller
 
+ASSISTANT_MODEL = "gpt-4-turbo"
 
 
 def contruct_parameters(properties):
@@ -36,64 +39,149 @@ def construct_tool_for_closeAI(tool_name, tool_description, properties):
     return tool
 
 
-def parallel_tool_use(name, instructions, tools, input_text):
+def wait_on_run(client, run, initial_interval=0.05, max_interval=1.0, backoff=1.5):
+    """
+    Poll a run until it leaves queued / in_progress
+    * Starts polling fast and backs off geometrically, so short runs return almost immediately
+    * Each poll goes through src.controller, so a 429 / 5xx while polling is retried instead of failing the run
+    """
+    interval = initial_interval
+    while run.status == "queued" or run.status == "in_progress":
+        time.sleep(interval)
+        interval = min(interval * backoff, max_interval)
+        run = controller.call(
+            client.beta.threads.runs.retrieve,
+            thread_id=run.thread_id,
+            run_id=run.id,
+        )
+    return run
+
+
+async def wait_on_run_async(client, run, initial_interval=0.05, max_interval=1.0, backoff=1.5):
+    interval = initial_interval
+    while run.status == "queued" or run.status == "in_progress":
+        await asyncio.sleep(interval)
+        interval = min(interval * backoff, max_interval)
+        run = await controller.call_async(
+            client.beta.threads.runs.retrieve,
+            thread_id=run.thread_id,
+            run_id=run.id,
+        )
+    return run
+
+
+def stream_run(client, assistant_id, thread):
+    """
+    Start a run and read its events until it asks for tool outputs; returns the last run snapshot
+    """
+    run = None
+    with client.beta.threads.create_and_run_stream(assistant_id=assistant_id, thread=thread) as events:
+        for event in events:
+            if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step"):
+                run = event.data
+            if event.event == "thread.run.requires_action":
+                break
+    return run
+
+
+async def stream_run_async(client, assistant_id, thread):
+    run = None
+    async with client.beta.threads.create_and_run_stream(assistant_id=assistant_id, thread=thread) as events:
+        async for event in events:
+            if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step"):
+                run = event.data
+            if event.event == "thread.run.requires_action":
+                break
+    return run
+
+
+def parallel_tool_use(name, instructions, tools, input_text, stream=True):
 
     """
     Parallel Tool Use
     * Similar to a one-shot completion with system prompt and user input
     * Messages dict is not applicable here
+    * stream=True returns as soon as the run emits its requires_action event, instead of polling for it
     """
 
-    client = OpenAI() # Make you have your API key set in the OPENAI_API_KEY environment variable
+    client = get_openai_client() # Make you have your API key set in the OPENAI_API_KEY environment variable
+
+    # Assistants are created once per (name, instructions, tools) and reused across segments
+    WEATHER_ASSISTANT_ID = assistant_registry.get(client, name, instructions, tools, ASSISTANT_MODEL)
+    thread = {"messages": [{"role": "user", "content": input_text}]}
+
+    with metrics.track("parallel_tool_use", ASSISTANT_MODEL) as call:
+        if not stream:
+            # One request creates the thread, posts the message and starts the run
+            run = controller.call(client.beta.threads.create_and_run, assistant_id=WEATHER_ASSISTANT_ID, thread=thread)
+            run = wait_on_run(client, run)
+        else:
+            run = controller.call(stream_run, client, WEATHER_ASSISTANT_ID, thread)
+            run = wait_on_run(client, run) if run is not None else None
+        call.set_usage(run)
+    return run
+
 
-    assistant = client.beta.assistants.create(
-        name=name,
-        instructions=instructions,
-        model="gpt-4-turbo",
-        tools=tools,
-    )
-        
-    WEATHER_ASSISTANT_ID = assistant.id
+async def parallel_tool_use_async(name, instructions, tools, input_text, stream=True):
+    client = get_async_openai_client()
+    assistant_id = await assistant_registry.get_async(client, name, instructions, tools, ASSISTANT_MODEL)
+    thread = {"messages": [{"role": "user", "content": input_text}]}
+
+    with metrics.track("parallel_tool_use", ASSISTANT_MODEL) as call:
+        if not stream:
+            run = await controller.call_async(client.beta.threads.create_and_run, assistant_id=assistant_id, thread=thread)
+            run = await wait_on_run_async(client, run)
+        else:
+            run = await controller.call_async(stream_run_async, client, assistant_id, thread)
+            run = await wait_on_run_async(client, run) if run is not None else None
+        call.set_usage(run)
+    return run
 
-    def submit_message(assistant_id, thread, user_message):
-        client.beta.threads.messages.create(
-            thread_id=thread.id, role="user", content=user_message
+
+def chat_tool_use(instructions, tools, input_text, model=ASSISTANT_MODEL):
+    """
+    Direct Chat Completions tool call
+    * No assistant, thread or run: one request, and the tool call is in the response
+    * Returns the same (function name, function arguments) tuples as parse_tool_use
+    """
+    client = get_openai_client()
+    with metrics.track("chat_tool_use", model) as call:
+        response = controller.call(
+            client.chat.completions.create,
+            model=model,
+            messages=[{"role": "system", "content": instructions}, {"role": "user", "content": input_text}],
+            tools=tools,
+            tool_choice={"type": "function", "function": {"name": tools[0]["function"]["name"]}},
         )
-        return client.beta.threads.runs.create(
-            thread_id=thread.id,
-            assistant_id=assistant_id,
+        call.set_usage(response)
+    return parse_chat_tool_use(response)
+
+
+async def chat_tool_use_async(instructions, tools, input_text, model=ASSISTANT_MODEL):
+    client = get_async_openai_client()
+    with metrics.track("chat_tool_use", model) as call:
+        response = await controller.call_async(
+            client.chat.completions.create,
+            model=model,
+            messages=[{"role": "system", "content": instructions}, {"role": "user", "content": input_text}],
+            tools=tools,
+            tool_choice={"type": "function", "function": {"name": tools[0]["function"]["name"]}},
         )
+        call.set_usage(response)
+    return parse_chat_tool_use(response)
 
-    def create_thread_and_run(user_input):
-        thread = client.beta.threads.create()
-        run = submit_message(WEATHER_ASSISTANT_ID, thread, user_input)
-        return thread, run
-
-    def get_response(thread):
-        return client.beta.threads.messages.list(thread_id=thread.id, order="asc")
-
-    def wait_on_run(run, thread):
-        while run.status == "queued" or run.status == "in_progress":
-            run = client.beta.threads.runs.retrieve(
-                thread_id=thread.id,
-                run_id=run.id,
-            )
-            time.sleep(0.5)
-        return run
-
-    # Pretty printing helper
-    def pretty_print(messages):
-        print("# Messages")
-        for m in messages:
-            print(f"{m.role}: {m.content[0].text.value}")
-        print()
-
-    thread, run = create_thread_and_run(
-        input_text
-    )
-    run = wait_on_run(run, thread)
 
-    return run
+def parse_chat_tool_use(response):
+    function_calls = []
+    try:
+        for tool_call in response.choices[0].message.tool_calls or []:
+            function_name = tool_call.function.name
+            function_arguments = json.loads(tool_call.function.arguments)
+            function_calls.append((function_name, function_arguments))
+    except:
+        print('Error in parsing chat tool use.')
+        return []
+    return function_calls
 
 
 def parse_tool_use(run):
@@ -1,8 +1,20 @@
 # from .function_call import *
-import anthropic
+import asyncio
+import concurrent.futures
+import functools
 import pandas as pd
 from tqdm import tqdm
-from src.tool_use import parallel_tool_use, parse_tool_use
+from src.tool_use import parallel_tool_use, parallel_tool_use_async, parse_tool_use, chat_tool_use, chat_tool_use_async, ASSISTANT_MODEL
+from src.cache import get_cache, make_key
+from src.clients import get_anthropic_client, get_async_anthropic_client
+from src.checkpoint import TranslationJournal, count_rows, append_rows
+from src.table import SegmentTable, as_segment_table, read_table, write_table, iter_chunks, table_format, llm_name, llm_proc_name
+from src.controller import controller, classify_error, PARSE
+from src.schemas import compile_tools, freeze, prompt_caching_headers
+from src.cascade import OPUS, cascade_tiers, resolve_models, validate_translation, validate_qa, run_cascade, run_cascade_async
+from src.dedup import fold_thai
+from src.store import model_label
+from src.metrics import metrics, current_attempt, timed_slot
 import os
 
 
@@ -24,41 +36,124 @@ def get_translation_properties():
     return properties
 
 
-def get_qa_properties(questions):
+def get_batch_translation_properties():
+    segment_properties = {}
+    segment_properties["index"] = {
+        "type": "integer",
+        "description": "The number of the input segment, exactly as given in the square brackets."
+    }
+    segment_properties.update(get_translation_properties())
     properties = {}
-    for i, question in enumerate(questions):
-        properties["question_" + str(i) + "_present"] = {
-            "type": "boolean",
-            "description": f"Whether the question similar to {question} (Question indexed {i}) is present in the text."
+    properties["segments"] = {
+        "type": "array",
+        "description": "One entry for every numbered input segment, in the same order as the input.",
+        "items": {
+            "type": "object",
+            "properties": segment_properties,
+            "required": list(segment_properties.keys()),
+        }
+    }
+    return properties
+
+
+def get_qa_properties(questions, with_segments=False):
+    """
+    The question list is written once; every question shares the same 4-field entry, so the schema stays small as questions are added
+    * with_segments adds the numbers of the segments the question and answer come from (chunked extraction, src.mapreduce)
+    """
+    question_list = "\n".join(f"[{i}] {question.strip()}" for i, question in enumerate(questions))
+    entry_properties = {}
+    entry_properties["index"] = {
+        "type": "integer",
+        "description": "The number of the question type, exactly as given in the square brackets."
+    }
+    entry_properties["present"] = {
+        "type": "boolean",
+        "description": "Whether a question similar to this question type is present in the text."
+    }
+    entry_properties["question"] = {
+        "type": "string",
+        "description": "The exact question in the transcript which is similar to this question type."
+    }
+    entry_properties["answer"] = {
+        "type": "string",
+        "description": "The exact answer in the transcript to that question."
+    }
+    if with_segments:
+        entry_properties["question_segment"] = {
+            "type": "integer",
+            "description": "The number in square brackets of the segment where the question is asked, -1 if it is not in the text."
         }
-        properties["question_" + str(i)] = {
-            "type": "string",
-            "description": f"The exact question in the transcript which is similar to {question} (Question indexed {i}) in the text"
+        entry_properties["answer_segment"] = {
+            "type": "integer",
+            "description": "The number in square brackets of the segment where the answer is given, -1 if it is not in the text."
         }
-        properties["answer_" + str(i)] = {
-            "type": "string",
-            "description": f"The exact answer in the transcript to the question similar to {question} (Question indexed {i}) in the text"
+    properties = {}
+    properties["questions"] = {
+        "type": "array",
+        "description": (f"""One entry for every question type found in the text, each occurrence separately: 
+        {question_list}
+        """ if with_segments else f"""One entry for every question type: 
+        {question_list}
+        """),
+        "items": {
+            "type": "object",
+            "properties": entry_properties,
+            "required": list(entry_properties.keys()),
         }
+    }
     return properties
 
 
 # If valid question, query, if direct answer, append
-def get_check_transcript_properties(preset_questions, prev_question):
+# The previous question is part of the message, so the tool stays the same across calls and can be cached
+def get_check_transcript_properties(preset_questions):
     properties = {}
-    for i, question in enumerate(preset_questions):
-        properties["is_related_question"] = {
-            "type": "boolean",
-            "description": f"""Whether the question in the transcript is similar to any of the pre-set questions: 
-            Preset Questions: 
-            {preset_questions}
-            """
-        }
-        properties["is_answer"] = {
-            "type": "boolean",
-            "description": f"""Whether the transcript is an answer to the previous question:
-            {prev_question}
-            """
+    properties["is_related_question"] = {
+        "type": "boolean",
+        "description": f"""Whether the question in the transcript is similar to any of the pre-set questions: 
+        Preset Questions: 
+        {preset_questions}
+        """
+    }
+    properties["is_answer"] = {
+        "type": "boolean",
+        "description": "Whether the transcript is an answer to the previous question given in the message."
+    }
+    return properties
+
+
+def get_window_check_properties(preset_questions):
+    segment_properties = {}
+    segment_properties["index"] = {
+        "type": "integer",
+        "description": "The number of the transcript segment, exactly as given in the square brackets."
+    }
+    segment_properties["is_related_question"] = {
+        "type": "boolean",
+        "description": f"""Whether the segment is a question similar to any of the pre-set questions: 
+        Preset Questions: 
+        {preset_questions}
+        """
+    }
+    segment_properties["is_answer"] = {
+        "type": "boolean",
+        "description": "Whether the segment is an answer to an earlier related question."
+    }
+    segment_properties["answer_to"] = {
+        "type": "integer",
+        "description": "If the segment is an answer, the number of the related question segment it answers, otherwise -1."
+    }
+    properties = {}
+    properties["segments"] = {
+        "type": "array",
+        "description": "One entry for every numbered transcript segment, in the same order as the input.",
+        "items": {
+            "type": "object",
+            "properties": segment_properties,
+            "required": list(segment_properties.keys()),
         }
+    }
     return properties
 
 
@@ -77,8 +172,23 @@ def construct_translation_tool_prompt(tool_name, tool_description):
     return system_prompt
 
 
-def construct_check_transcript_tool_prompt(tool_name, tool_description, preset_questions, prev_question):
-    properties = get_check_transcript_properties(preset_questions, prev_question)
+def construct_batch_translation_tool_prompt(tool_name, tool_description):
+    properties = get_batch_translation_properties()
+    argument_names = list(properties.keys())
+    system_prompt = {
+        "name": tool_name,
+        "description": tool_description,
+        "input_schema": {
+            "type": "object",
+            "properties": properties,
+            "required": argument_names,
+        },
+    }
+    return system_prompt
+
+
+def construct_check_transcript_tool_prompt(tool_name, tool_description, preset_questions):
+    properties = get_check_transcript_properties(preset_questions)
     argument_names = list(properties.keys())
     system_prompt = {
         "name": tool_name,
@@ -93,8 +203,23 @@ def construct_check_transcript_tool_prompt(tool_name, tool_description, preset_q
 
 
 
-def construct_qa_tool_prompt(tool_name, tool_description, questions):
-    properties = get_qa_properties(questions)
+def construct_window_check_tool_prompt(tool_name, tool_description, preset_questions):
+    properties = get_window_check_properties(preset_questions)
+    argument_names = list(properties.keys())
+    system_prompt = {
+        "name": tool_name,
+        "description": tool_description,
+        "input_schema": {
+            "type": "object",
+            "properties": properties,
+            "required": argument_names,
+        }
+    }
+    return system_prompt
+
+
+def construct_qa_tool_prompt(tool_name, tool_description, questions, with_segments=False):
+    properties = get_qa_properties(questions, with_segments)
     argument_names = list(properties.keys())
     system_prompt = {
         "name": tool_name,
@@ -112,16 +237,60 @@ qa_tool_description = """
 Parse out the questions and answers according, where the question is similar to the provided ones. Decide whether the question and answer of that specific type of question is present, if it is, provide the specific question and the answer to that. 
 """
 
+qa_chunk_tool_description = """
+Parse out the questions and answers in this numbered part of a call transcript, where the question is similar to the provided ones. For every question of one of the types that is asked in this part, provide the specific question, the answer to it and the numbers of the segments they are in. A question may be asked more than once; report each occurrence.
+"""
+
 translate_tool_description = """
 Translate the Thai text to English. Provide only English translation. Also Revise the original thai text to include proper grammar and space, no other changes and addition of text. Provide only Thai revision.
 [Example]
 สวัสดี --> Hello
 """
 
+batch_translate_tool_description = """
+Translate each numbered Thai segment to English. Provide only English translation. Also Revise each original thai segment to include proper grammar and space, no other changes and addition of text. Provide only Thai revision.
+Keep every segment separate, do not merge or split segments, and return one entry per segment with its number.
+[Example]
+[0] สวัสดี --> Hello
+"""
+
 check_transcript_tool_description = """
 Check whether the current transcript is a question which is similar to any of the pre-set questions. Or is it an answer to the pre-set question.
 """
 
+window_check_tool_description = """
+Check each numbered segment of a call transcript. Decide whether the segment is a question which is similar to any of the pre-set questions, or whether it is an answer to an earlier related question. For answers, give the number of the question segment they answer.
+"""
+
+# Tool lists are compiled once per argument set and shared (read-only) by every request
+def hashable_questions(questions):
+    # Post processing passes the questions as one joined string; keep it a string so the schema text is unchanged
+    return questions if isinstance(questions, str) else tuple(questions)
+
+@functools.lru_cache(maxsize=None)
+def translate_tools():
+    return compile_tools([construct_translation_tool_prompt("translate_tool", translate_tool_description)])
+
+@functools.lru_cache(maxsize=None)
+def batch_translate_tools():
+    return compile_tools([construct_batch_translation_tool_prompt("batch_translate_tool", batch_translate_tool_description)])
+
+@functools.lru_cache(maxsize=None)
+def qa_tools(questions):
+    return compile_tools([construct_qa_tool_prompt("qa_tool", qa_tool_description, questions)])
+
+@functools.lru_cache(maxsize=None)
+def qa_chunk_tools(questions):
+    return compile_tools([construct_qa_tool_prompt("qa_tool", qa_chunk_tool_description, questions, with_segments=True)])
+
+@functools.lru_cache(maxsize=None)
+def check_transcript_tools(preset_questions):
+    return compile_tools([construct_check_transcript_tool_prompt("check_transcript_tool", check_transcript_tool_description, preset_questions)])
+
+@functools.lru_cache(maxsize=None)
+def window_check_tools(preset_questions):
+    return compile_tools([construct_window_check_tool_prompt("window_check_tool", window_check_tool_description, preset_questions)])
+
 def parse_check_transcript_calls(response):
     calls = []
     for content in response.content:
@@ -146,97 +315,423 @@ def parse_translation_calls(response):
             calls.append(call)
     return calls
 
+def parse_batch_translation_calls(response):
+    calls = []
+    for content in response.content:
+        if content.type=='tool_use' and content.name.startswith('batch_translate_tool'):
+            for segment in content.input['segments']:
+                call = {}
+                call['name'] = content.name
+                call['index'] = segment['index']
+                call['translation'] = segment['translation']
+                call['revision'] = segment['revision']
+                calls.append(call)
+    return calls
+
+def parse_window_check_calls(response):
+    calls = []
+    for content in response.content:
+        if content.type=='tool_use' and content.name.startswith('window_check_tool'):
+            for segment in content.input['segments']:
+                call = {}
+                call['name'] = content.name
+                call['index'] = segment['index']
+                call['is_related_question'] = segment['is_related_question']
+                call['is_answer'] = segment['is_answer']
+                call['answer_to'] = segment.get('answer_to', -1)
+                calls.append(call)
+    return calls
+
 def parse_qa_calls(response, n_types=6):
     calls = []
     for content in response.content:
         if content.type=='tool_use' and content.name.startswith('qa_tool'):
             call = {}
             call['name'] = content.name
-            for i in range(n_types):
-                if content.input["question_" + str(i) + "_present"]:
-                    call['question_' + str(i)] = content.input['question_' + str(i)]
-                    call['answer_' + str(i)] = content.input['answer_' + str(i)]
+            for entry in content.input['questions']:
+                i = entry['index']
+                if isinstance(i, int) and 0 <= i < n_types and entry['present']:
+                    call['question_' + str(i)] = entry['question']
+                    call['answer_' + str(i)] = entry['answer']
             calls.append(call)
     return calls
 
 
-def check_transcript_call_anthropic(english_text, preset_questions, prev_question, api_key):
-    tools = []
-    tool_name = "check_transcript_tool"
-    tool_description = check_transcript_tool_description
-    tool = construct_check_transcript_tool_prompt(tool_name, tool_description, preset_questions, prev_question)
-    tools.append(tool)
+def parse_qa_chunk_calls(response, n_types=6):
+    """
+    One {'index', 'question', 'answer', 'question_segment', 'answer_segment'} per question occurrence the model found in the chunk
+    """
+    entries = []
+    for content in response.content:
+        if content.type=='tool_use' and content.name.startswith('qa_tool'):
+            for entry in content.input['questions']:
+                i = entry['index']
+                if isinstance(i, int) and 0 <= i < n_types and entry['present'] and str(entry['answer']).strip():
+                    entries.append({
+                        'index': i,
+                        'question': entry['question'],
+                        'answer': entry['answer'],
+                        'question_segment': entry.get('question_segment', -1),
+                        'answer_segment': entry.get('answer_segment', -1),
+                    })
+    return entries
+
+
+def request_cache_key(request):
+    """
+    Cache key over the whole request: every message (prompt template, text, hints), the model, the tools and the API mode if any,
+    so editing a prompt's wording invalidates its entries
+    """
+    content = "\n".join(str(message["content"]) for message in request["messages"])
+    model = request["model"] if request.get("mode") is None else f"{request['model']}/{request['mode']}"
+    return make_key(content, model, request["tools"])
+
+def cached_tool_call(call_site, request, api_key, parse, use_cache=True):
+    """
+    One tool_use call through the cache, metrics and the request controller; parse(response) gives the calls to return
+    * Empty parses are not cached, so a bad answer is asked again next time
+    """
+    cache = get_cache()
+    key = request_cache_key(request)
+    if use_cache:
+        calls = cache.get(key)
+        if calls is not None:
+            metrics.record(call_site, request["model"], cache="hit")
+            return calls
+
+    client = get_anthropic_client(api_key)
+    with metrics.track(call_site, request["model"], cache="miss" if use_cache else "bypass") as call:
+        response = controller.call(client.beta.tools.messages.create, **request)
+        call.set_usage(response)
+    calls = parse(response)
+    if use_cache and calls:
+        cache.set(key, calls)
+    return calls
+
+async def cached_tool_call_async(call_site, request, api_key, parse, use_cache=True):
+    cache = get_cache()
+    key = request_cache_key(request)
+    if use_cache:
+        calls = cache.get(key)
+        if calls is not None:
+            metrics.record(call_site, request["model"], cache="hit")
+            return calls
+
+    client = get_async_anthropic_client(api_key)
+    with metrics.track(call_site, request["model"], cache="miss" if use_cache else "bypass") as call:
+        response = await controller.call_async(client.beta.tools.messages.create, **request)
+        call.set_usage(response)
+    calls = parse(response)
+    if use_cache and calls:
+        cache.set(key, calls)
+    return calls
+
+def build_check_transcript_request(english_text, preset_questions, prev_question):
+    tools = check_transcript_tools(hashable_questions(preset_questions))
 
-    client = anthropic.Anthropic(api_key = api_key)
     check_transcript_message = {
         "role": "user",
-        "content": "Check whether the current transcript is a question which is similar to any of the pre-set questions. Or is it an answer to the pre-set question. Here is the text: \n" + str(english_text)
-    }
-    response = client.beta.tools.messages.create(
-        # model="claude-3-opus-20240229",
-        model = "claude-3-sonnet-20240229", # "claude-3-opus-20240229
-        max_tokens=1024,
-        tools=tools,
-        messages=[check_transcript_message],
-    )
-    calls = parse_check_transcript_calls(response)
-    return calls
+        "content": "Check whether the current transcript is a question which is similar to any of the pre-set questions. Or is it an answer to the pre-set question. "
+                   + "Previous question: " + str(prev_question) + "\nHere is the text: \n" + str(english_text)
+    }
+    request = {
+        # "model": "claude-3-opus-20240229",
+        "model": "claude-3-sonnet-20240229", # "claude-3-opus-20240229
+        "max_tokens": 1024,
+        "tools": tools,
+        "messages": [check_transcript_message],
+        "extra_headers": prompt_caching_headers,
+    }
+    return request
 
-def parse_qa_anthropic(thai_text, questions, api_key):
-    tools = []
-    tool_name = "qa_tool"
-    tool_description = qa_tool_description
+def check_transcript_call_anthropic(english_text, preset_questions, prev_question, api_key, use_cache=True):
+    request = build_check_transcript_request(english_text, preset_questions, prev_question)
+    return cached_tool_call("check_transcript_call_anthropic", request, api_key, parse_check_transcript_calls, use_cache)
+
+async def check_transcript_call_anthropic_async(english_text, preset_questions, prev_question, api_key, use_cache=True):
+    request = build_check_transcript_request(english_text, preset_questions, prev_question)
+    return await cached_tool_call_async("check_transcript_call_anthropic", request, api_key, parse_check_transcript_calls, use_cache)
+
+def build_window_check_request(segments, preset_questions):
+    """
+    segments is a list of (row index, start time, end time, english text)
+    """
+    tools = window_check_tools(hashable_questions(preset_questions))
+
+    transcript = "\n".join(f"[{i}] ({start_time} - {end_time}) {english_text}" for i, start_time, end_time, english_text in segments)
+    window_check_message = {
+        "role": "user",
+        "content": "Check every segment of the transcript for related questions and their answers. Here is the transcript: \n" + transcript
+    }
+    request = {
+        "model": "claude-3-sonnet-20240229",
+        "max_tokens": 2048,
+        "tools": tools,
+        "messages": [window_check_message],
+        "extra_headers": prompt_caching_headers,
+    }
+    return request
+
+async def check_window_call_anthropic_async(segments, preset_questions, api_key, use_cache=True):
+    request = build_window_check_request(segments, preset_questions)
+    return await cached_tool_call_async("check_window_call_anthropic", request, api_key, parse_window_check_calls, use_cache)
+
+def build_qa_request(thai_text, questions, model=OPUS):
     # questions = ["What is the name of the person?", "What is the name of the place?", "What is the name of the thing?", "What is the name of the action?", "What is the name of the time?"]
-    tool = construct_qa_tool_prompt(tool_name, tool_description, questions)
-    tools.append(tool)
+    tools = qa_tools(tuple(questions))
 
-    client = anthropic.Anthropic(api_key = api_key)
     qa_message = {
         "role": "user",
         "content": "Parse out the questions and answers according to the specific genre and description. Here is the text: " + thai_text
     }
-    response = client.beta.tools.messages.create(
-        model="claude-3-opus-20240229",
-        max_tokens=512,
-        tools=tools,
-        messages=[qa_message],
-    )
+    request = {
+        "model": model,
+        "max_tokens": 512,
+        "tools": tools,
+        "messages": [qa_message],
+        "extra_headers": prompt_caching_headers,
+    }
+    return request
+
+def parse_qa_anthropic(thai_text, questions, api_key, model=OPUS):
+    request = build_qa_request(thai_text, questions, model)
+    client = get_anthropic_client(api_key)
+    with metrics.track("parse_qa_anthropic", model) as call:
+        response = controller.call(client.beta.tools.messages.create, **request)
+        call.set_usage(response)
     calls = parse_qa_calls(response, n_types = len(questions))
     return calls
 
-def translate_english_call_anthropic(thai_text, api_key):
-    tools = []
-    tool_name = "translate_tool"
-    tool_description = translate_tool_description
-    tool = construct_translation_tool_prompt(tool_name, tool_description)
-    tools.append(tool)
+def build_qa_chunk_request(segments, questions, model=OPUS):
+    """
+    segments is a list of (row index, start time, end time, thai text)
+    """
+    transcript = "\n".join(f"[{i}] ({start_time} - {end_time}) {thai_text}" for i, start_time, end_time, thai_text in segments)
+    qa_message = {
+        "role": "user",
+        "content": "Parse out the questions and answers according to the specific genre and description. Here is the transcript: \n" + transcript
+    }
+    request = {
+        "model": model,
+        "max_tokens": 1024,
+        "tools": qa_chunk_tools(tuple(questions)),
+        "messages": [qa_message],
+        "extra_headers": prompt_caching_headers,
+    }
+    return request
+
+async def qa_chunk_call_anthropic_async(segments, questions, api_key, model=OPUS, use_cache=True):
+    """
+    qa_tool over one chunk of a transcript, segments numbered by row (see src.mapreduce)
+    """
+    request = build_qa_chunk_request(segments, questions, model)
+    return await cached_tool_call_async("qa_chunk_call_anthropic", request, api_key,
+                                        lambda response: parse_qa_chunk_calls(response, n_types=len(questions)), use_cache)
+
+def parse_qa_cascade(thai_text, questions, api_key, models=cascade_tiers):
+    """
+    parse_qa_anthropic on the cheapest tier whose answer is well-formed
+    """
+    return run_cascade("parse_qa_anthropic",
+                       lambda model: parse_qa_anthropic(thai_text, questions, api_key, model=model),
+                       lambda calls: validate_qa(calls, len(questions)),
+                       models)
+
+def build_translate_request(thai_text, model=OPUS, hints=()):
+    """
+    hints: (thai, english) pairs of similar segments translated before (see src.dedup), shown to the model as examples
+    """
+    tools = translate_tools()
+
+    content = "Translate the Thai text to English. Here is the text: " + thai_text
+    if hints:
+        examples = "\n".join(f"{hint_thai} --> {hint_english}" for hint_thai, hint_english in hints)
+        content = "Similar segments were translated before:\n" + examples + "\n\n" + content
+    translate_message = {
+        "role": "user",
+        "content": content
+    }
+    request = {
+        "model": model, # Cheaper tiers go through translate_cascade_call_anthropic
+        "max_tokens": 1024,
+        "tools": tools,
+        "messages": [translate_message],
+        "extra_headers": prompt_caching_headers,
+    }
+    return request
+
+def translate_cache_key(thai_text, model=OPUS):
+    return request_cache_key(build_translate_request(thai_text, model))
+
+def translate_english_call_anthropic(thai_text, api_key, use_cache=True, model=OPUS, hints=()):
+    request = build_translate_request(thai_text, model, hints)
+    return cached_tool_call("translate_english_call_anthropic", request, api_key, parse_translation_calls, use_cache)
 
-    client = anthropic.Anthropic(api_key = api_key)
+async def translate_english_call_anthropic_async(thai_text, api_key, use_cache=True, model=OPUS, hints=()):
+    request = build_translate_request(thai_text, model, hints)
+    return await cached_tool_call_async("translate_english_call_anthropic", request, api_key, parse_translation_calls, use_cache)
+
+def translate_cascade_call_anthropic(thai_text, api_key, use_cache=True, models=cascade_tiers, hints=()):
+    """
+    Translation from the cheapest tier whose answer passes validate_translation
+    """
+    return run_cascade("translate_english_call_anthropic",
+                       lambda model: translate_english_call_anthropic(thai_text, api_key, use_cache, model=model, hints=hints),
+                       lambda calls: validate_translation(thai_text, calls),
+                       models)
+
+async def translate_cascade_call_anthropic_async(thai_text, api_key, use_cache=True, models=cascade_tiers, hints=()):
+    return await run_cascade_async("translate_english_call_anthropic",
+                                   lambda model: translate_english_call_anthropic_async(thai_text, api_key, use_cache, model=model, hints=hints),
+                                   lambda calls: validate_translation(thai_text, calls),
+                                   models)
+
+
+def pack_segments(thai_texts, max_chars=1500, max_segments=40):
+    """
+    Group consecutive segments for batched translation
+    * Each group stays under max_chars characters and max_segments segments
+    * A single segment longer than max_chars gets a group of its own
+    """
+    groups = []
+    group, group_chars = [], 0
+    for i, thai_text in enumerate(thai_texts):
+        n_chars = len(str(thai_text))
+        if group and (group_chars + n_chars > max_chars or len(group) >= max_segments):
+            groups.append(group)
+            group, group_chars = [], 0
+        group.append(i)
+        group_chars += n_chars
+    if group:
+        groups.append(group)
+    return groups
+
+def build_batch_translate_request(thai_texts):
+    tools = batch_translate_tools()
+
+    segments = "\n".join(f"[{i}] {thai_text}" for i, thai_text in enumerate(thai_texts))
     translate_message = {
         "role": "user",
-        "content": "Translate the Thai text to English. Here is the text: " + thai_text
-    }
-    response = client.beta.tools.messages.create(
-        model="claude-3-opus-20240229",
-        # model = "claude-3-haiku-20240229", # "claude-3-opus-20240229
-        # model = "claude-3-sonnet-20240229", # "claude-3-opus-20240229
-        max_tokens=1024,
-        tools=tools,
-        messages=[translate_message],
-    )
-    calls = parse_translation_calls(response)
+        "content": "Translate each numbered Thai segment to English. Here are the segments: \n" + segments
+    }
+    request = {
+        "model": OPUS,
+        "max_tokens": 4096,
+        "tools": tools,
+        "messages": [translate_message],
+        "extra_headers": prompt_caching_headers,
+    }
+    return request
+
+async def translate_batch_call_anthropic_async(thai_texts, api_key):
+    client = get_async_anthropic_client(api_key)
+    request = build_batch_translate_request(thai_texts)
+    with metrics.track("translate_batch_call_anthropic", request["model"]) as call:
+        response = await controller.call_async(client.beta.tools.messages.create, **request)
+        call.set_usage(response)
+    calls = parse_batch_translation_calls(response)
     return calls
 
 
-def get_translate(thai_text, api_key):
+# (translation, revision), or None once all attempts failed
+# cascade=True starts on the fastest model and escalates to opus only when the answer fails the local checks
+# cascade can also be a list of models (or aliases: haiku, sonnet, opus) to use as the tiers
+# hints are (thai, english) pairs of near-duplicate segments, see src.dedup
+# backend is any src.backends backend (e.g. a HedgedBackend, or OpenAIBackend); it replaces the Claude call and cascade
+def get_translate(thai_text, api_key, cascade=False, hints=(), backend=None):
     num_attempt = 0
     while num_attempt < 3:
+        token = current_attempt.set(num_attempt)
         try:
-            calls = translate_english_call_anthropic(thai_text, api_key)
+            if backend is not None:
+                record = backend.translate(thai_text, hints)
+                return record['translation'], record['revision']
+            if cascade:
+                calls = translate_cascade_call_anthropic(thai_text, api_key, models=resolve_models(cascade), hints=hints)
+            else:
+                calls = translate_english_call_anthropic(thai_text, api_key, hints=hints)
             return calls[0]['translation'], calls[0]['revision']
-        except:
+        except Exception as e:
+            # Transient API errors were already retried by the controller; only a malformed answer is worth another call
+            if classify_error(e) != PARSE:
+                return None
+            num_attempt += 1
+        finally:
+            current_attempt.reset(token)
+    return None
+
+async def get_translate_async(thai_text, api_key, cascade=False, hints=(), backend=None):
+    num_attempt = 0
+    while num_attempt < 3:
+        token = current_attempt.set(num_attempt)
+        try:
+            if backend is not None:
+                record = await backend.translate_async(thai_text, hints)
+                return record['translation'], record['revision']
+            if cascade:
+                calls = await translate_cascade_call_anthropic_async(thai_text, api_key, models=resolve_models(cascade), hints=hints)
+            else:
+                calls = await translate_english_call_anthropic_async(thai_text, api_key, hints=hints)
+            return calls[0]['translation'], calls[0]['revision']
+        except Exception as e:
+            if classify_error(e) != PARSE:
+                return None
             num_attempt += 1
-    return "NA"
+        finally:
+            current_attempt.reset(token)
+    return None
+
+
+async def get_translate_batch_async(thai_texts, api_key, use_cache=True):
+    """
+    Translate a group of segments in one call
+    * Returns one (translation, revision) per segment, in input order
+    * Segments already in the cache are served from it and left out of the call
+    * Segments the model dropped, duplicated or left empty are None, so the caller can re-send them alone
+    """
+    cache = get_cache()
+    results = [None] * len(thai_texts)
+    pending = []
+    for i, thai_text in enumerate(thai_texts):
+        calls = cache.get(translate_cache_key(thai_text)) if use_cache else None
+        if calls:
+            results[i] = (calls[0]['translation'], calls[0]['revision'])
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+
+    try:
+        calls = await translate_batch_call_anthropic_async([thai_texts[i] for i in pending], api_key)
+    except Exception:
+        return results
+
+    seen = set()
+    for call in calls:
+        j = call['index']
+        if not isinstance(j, int) or not 0 <= j < len(pending) or j in seen:
+            continue
+        seen.add(j)
+        if call['translation'] and call['revision']:
+            i = pending[j]
+            results[i] = (call['translation'], call['revision'])
+            if use_cache:
+                cache.set(translate_cache_key(thai_texts[i]), [{'name': 'translate_tool', 'translation': call['translation'], 'revision': call['revision']}])
+    return results
+
+
+def run_async(coro):
+    """
+    Run a coroutine from synchronous code
+    * Uses asyncio.run when no event loop is running
+    * Inside a running loop (e.g. Jupyter) the coroutine runs on a worker thread
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
 
 
 ###############
@@ -262,22 +757,17 @@ def construct_tool_prompt(tool_name, tool_description, properties):
     return system_prompt
 
 
-def get_translation_gpt(thai_text):
+translate_gpt_instructions = "Revision of the original thai text to include proper grammar and space, revision only in thai. Also provide English translation on the revised thai text."
 
+@functools.lru_cache(maxsize=None)
+def get_translation_gpt_tool():
     properties = get_translation_properties()
     tool_name = "translate_tool"
     tool_description = translate_tool_description
     tool = construct_tool_prompt(tool_name, tool_description, properties)
+    return freeze(tool)
 
-    
-    function_calls = parallel_tool_use(name = "translate_tool",
-                    instructions = "Revision of the original thai text to include proper grammar and space, revision only in thai. Also provide English translation on the revised thai text.",
-                    tools = [tool], 
-                    input_text = "Here is the thai text: \n" + thai_text,
-                    )
-
-    revise_calls = parse_tool_use(function_calls)
-
+def parse_translation_gpt_calls(revise_calls):
     calls = []
     for revise_call in revise_calls:
         name, arguments = revise_call
@@ -290,19 +780,310 @@ def get_translation_gpt(thai_text):
         calls.append(call)
     return calls
 
+def build_translation_gpt_request(thai_text, use_assistant):
+    """
+    The GPT translation as a request dict, for the cache key: the assistant's instructions, the user message, the tool and the API mode
+    """
+    return {
+        "mode": "assistant" if use_assistant else "chat",
+        "model": ASSISTANT_MODEL,
+        "tools": [get_translation_gpt_tool()],
+        "messages": [
+            {"role": "system", "content": translate_gpt_instructions},
+            {"role": "user", "content": "Here is the thai text: \n" + thai_text},
+        ],
+    }
+
+def get_translation_gpt(thai_text, use_cache=True, use_assistant=True):
+    """
+    GPT translation of one segment
+    * use_assistant=True goes through the (streamed) assistants run, otherwise a direct chat completions tool call
+    """
+    request = build_translation_gpt_request(thai_text, use_assistant)
+    cache = get_cache()
+    key = request_cache_key(request)
+    if use_cache:
+        calls = cache.get(key)
+        if calls is not None:
+            metrics.record("get_translation_gpt", ASSISTANT_MODEL, cache="hit")
+            return calls
+
+    instructions, input_text = (message["content"] for message in request["messages"])
+    if use_assistant:
+        function_calls = parallel_tool_use(name = "translate_tool",
+                        instructions = instructions,
+                        tools = request["tools"],
+                        input_text = input_text,
+                        )
+        revise_calls = parse_tool_use(function_calls)
+    else:
+        revise_calls = chat_tool_use(instructions, request["tools"], input_text)
+
+    calls = parse_translation_gpt_calls(revise_calls)
+    if use_cache and calls:
+        cache.set(key, calls)
+    return calls
+
+async def get_translation_gpt_async(thai_text, use_cache=True, use_assistant=False):
+    """
+    Awaitable GPT translation, so many segments can be in flight without a sleeping thread each
+    """
+    request = build_translation_gpt_request(thai_text, use_assistant)
+    cache = get_cache()
+    key = request_cache_key(request)
+    if use_cache:
+        calls = cache.get(key)
+        if calls is not None:
+            metrics.record("get_translation_gpt", ASSISTANT_MODEL, cache="hit")
+            return calls
+
+    instructions, input_text = (message["content"] for message in request["messages"])
+    if use_assistant:
+        run = await parallel_tool_use_async("translate_tool", instructions, request["tools"], input_text)
+        revise_calls = parse_tool_use(run)
+    else:
+        revise_calls = await chat_tool_use_async(instructions, request["tools"], input_text)
+
+    calls = parse_translation_gpt_calls(revise_calls)
+    if use_cache and calls:
+        cache.set(key, calls)
+    return calls
+
+
+async def translate_rows_async(thai_texts, api_key, semaphore, batch_chars=None, on_result=None, cascade=False, dedup=None, backend=None):
+    """
+    Translate a list of segments with the shared semaphore bounding requests in flight
+    * Returns one (translation, revision) or None (failed) per segment, in input order
+    * on_result(i, result) is called as soon as each segment finishes
+    * cascade=True translates single segments through the haiku -> sonnet -> opus cascade (batches stay on opus)
+    * dedup is an optional src.dedup.NearDuplicateIndex: near-duplicates of indexed segments reuse their translation without a call,
+      weaker matches go to the model with the match as a hint, and every new translation is added to the index;
+      repeats of a pending segment (same fold_thai key) wait for its result instead of making their own call
+    * backend (see src.backends) translates single segments instead of the Claude call, e.g. with hedged requests
+    """
+    results = [None] * len(thai_texts)
+    hints = {}
+    reused = set()
+    repeats = {} # First pending row -> later rows with the same key
+
+    def finish(i, result):
+        results[i] = result
+        if dedup is not None and result is not None and i not in reused:
+            dedup.add(str(thai_texts[i]), result)
+        if on_result is not None:
+            on_result(i, result)
+        for j in repeats.pop(i, ()):
+            if result is not None:
+                metrics.record("translate_english_call_anthropic", OPUS, cache="near")
+            finish(j, result and reused_result(j, thai_texts[i], result))
 
-def process_file(file_name, api_key):
-    df = pd.read_csv(file_name)
-    df['thai_transcript'] = df.apply(lambda x: "NA", axis=1)
-    df['translation'] = df.apply(lambda x: "NA", axis=1)
-    for i in tqdm(range(len(df))):
-        text = df['Transcript'].iloc[i]
-        translated_text, revision = get_translate(text, api_key)
-        df.at[i, 'translation'] = translated_text  
-        df.at[i, 'thai_transcript'] = revision 
-    #df.drop(columns=['English Translation'], inplace=True)
-    df.drop(columns=['Transcript'], inplace=True)
-    df.to_csv(file_name.replace(".csv", "_llm.csv"), index=False)
+    def reused_result(i, matched_text, result):
+        # The revision belongs to the matched Thai; a segment that differs (particles, spacing, a word) keeps its own text
+        translation, revision = result
+        return translation, revision if str(thai_texts[i]) == str(matched_text) else str(thai_texts[i])
+
+    async def translate_row(i):
+        async with timed_slot(semaphore):
+            result = await get_translate_async(thai_texts[i], api_key, cascade=cascade, hints=hints.get(i, ()), backend=backend)
+        finish(i, result)
+
+    async def translate_group(group):
+        async with timed_slot(semaphore):
+            group_results = await get_translate_batch_async([thai_texts[i] for i in group], api_key)
+        retry = []
+        for i, result in zip(group, group_results):
+            if result is None:
+                retry.append(translate_row(i))
+            else:
+                finish(i, result)
+        await asyncio.gather(*retry)
+
+    pending = list(range(len(thai_texts)))
+    if dedup is not None:
+        pending = []
+        first = {}
+        for i, thai_text in enumerate(thai_texts):
+            key = fold_thai(thai_text)
+            if key in first:
+                reused.add(i)
+                repeats.setdefault(first[key], []).append(i)
+                continue
+            match = dedup.lookup(str(thai_text))
+            if dedup.reusable(match):
+                reused.add(i)
+                metrics.record("translate_english_call_anthropic", OPUS, cache="near")
+                finish(i, reused_result(i, match[1], match[2]))
+            else:
+                if match is not None:
+                    hints[i] = ((match[1], match[2][0]),)
+                if key:
+                    first[key] = i
+                pending.append(i)
+
+    if batch_chars:
+        # Hinted segments are sent alone, where the hint fits the request
+        unhinted = [i for i in pending if i not in hints]
+        groups = [[unhinted[j] for j in group] for group in pack_segments([thai_texts[i] for i in unhinted], max_chars=batch_chars)]
+        await asyncio.gather(*[translate_group(group) for group in groups], *[translate_row(i) for i in hints])
+    else:
+        await asyncio.gather(*[translate_row(i) for i in pending])
+    return results
+
+
+def fill_translation_columns(chunk, results):
+    chunk = chunk.drop(columns=['Transcript'])
+    results = [result or ("NA", "NA") for result in results]
+    translations, revisions = (list(column) for column in zip(*results)) if results else ([], [])
+    return chunk.assign(thai_transcript=revisions, translation=translations)
+
+
+def finish_part(part_name, output_name):
+    """
+    Move the finished CSV part file to the output, converting it when the output is Parquet / Arrow
+    """
+    if table_format(output_name) == "csv":
+        os.replace(part_name, output_name)
+    else:
+        write_table(pd.read_csv(part_name, keep_default_na=False), output_name)
+        os.remove(part_name)
+
+
+async def process_file_async(file_name, api_key, max_concurrency=8, batch_chars=None, chunk_size=256, resume=False, retry_failed=False, semaphore=None, cascade=False,
+                             dedup=None, backend=None, store=None, export=True):
+    """
+    Translate every row of file_name with up to max_concurrency requests in flight
+    * The input is read chunk_size rows at a time; finished chunks are appended to <output>.part in row order
+    * Every finished row is journaled to <output>.journal, so resume=True skips written chunks and finished rows
+    * Failed rows are written as "NA" and journaled as failed; retry_failed=True re-translates only those
+    * batch_chars packs consecutive rows into one batch_translate_tool call of up to that many characters
+    * semaphore shares one request budget across files (max_concurrency is ignored when it is given)
+    * cascade=True tries haiku, then sonnet, before opus (see src.cascade)
+    * dedup (a src.dedup.NearDuplicateIndex, shared across files) reuses translations of near-duplicate segments
+    * backend (see src.backends) swaps the provider or hedges slow calls; batched calls stay on Claude
+    * CSV, Parquet and Arrow inputs are supported; the output has the input's format
+    * store (a src.store.ResultStore) gets every finished chunk in one transaction; export=False then skips the _llm output file
+    """
+    output_name = llm_name(file_name)
+    if retry_failed:
+        return await retry_failed_rows_async(output_name, api_key, max_concurrency=max_concurrency, chunk_size=chunk_size, semaphore=semaphore, cascade=cascade,
+                                             dedup=dedup, backend=backend, store=store)
+
+    part_name = output_name + ".part"
+    journal = TranslationJournal(output_name + ".journal")
+    if resume:
+        n_written = count_rows(part_name)
+    else:
+        n_written = 0
+        journal.reset()
+        if os.path.exists(part_name):
+            os.remove(part_name)
+        if store is not None:
+            store.clear_segments(output_name)
+    finished = journal.entries(min_row=n_written)
+    model = model_label(cascade=cascade, backend=backend)
+    semaphore = semaphore or asyncio.Semaphore(max_concurrency)
+    progress = tqdm(initial=n_written)
+
+    row_offset = 0
+    for chunk in iter_chunks(file_name, chunk_size):
+        chunk_start, row_offset = row_offset, row_offset + len(chunk)
+        if row_offset <= n_written:
+            continue
+        if chunk_start < n_written:
+            chunk = chunk.iloc[n_written - chunk_start:]
+            chunk_start = n_written
+
+        thai_texts = chunk['Transcript'].tolist()
+        results = [None] * len(thai_texts)
+        pending = []
+        for i in range(len(thai_texts)):
+            entry = finished.get(chunk_start + i)
+            if entry is not None and entry["status"] == "ok":
+                results[i] = (entry["translation"], entry["revision"])
+            else:
+                pending.append(i)
+        progress.update(len(thai_texts) - len(pending))
+
+        def on_result(j, result):
+            i = pending[j]
+            results[i] = result
+            if result is None:
+                journal.record(chunk_start + i, "failed", text=str(thai_texts[i]))
+            else:
+                journal.record(chunk_start + i, "ok", translation=result[0], revision=result[1])
+            progress.update(1)
+
+        await translate_rows_async([thai_texts[i] for i in pending], api_key, semaphore, batch_chars=batch_chars, on_result=on_result, cascade=cascade,
+                                  dedup=dedup, backend=backend)
+        append_rows(fill_translation_columns(chunk, results), part_name)
+        if store is not None:
+            store.write_chunk(file_name, chunk, results, chunk_start, model=model)
+
+    progress.close()
+    journal.close()
+    if not os.path.exists(part_name):
+        append_rows(fill_translation_columns(read_table(file_name).iloc[:0], []), part_name)
+    if export or store is None:
+        finish_part(part_name, output_name)
+    else:
+        os.remove(part_name)
+
+    failed = journal.failed_rows()
+    if failed:
+        print(f"{len(failed)} rows failed, rerun with retry_failed=True to retry them: {output_name}.journal")
+    else:
+        journal.remove()
+
+
+async def retry_failed_rows_async(output_name, api_key, max_concurrency=8, chunk_size=256, semaphore=None, cascade=False, dedup=None, backend=None, store=None):
+    journal = TranslationJournal(output_name + ".journal")
+    failed = journal.failed_rows()
+    if not failed:
+        return
+
+    rows = sorted(failed)
+    semaphore = semaphore or asyncio.Semaphore(max_concurrency)
+
+    def on_result(j, result):
+        if result is not None:
+            journal.record(rows[j], "ok", translation=result[0], revision=result[1])
+
+    results = await translate_rows_async([failed[row]["text"] for row in rows], api_key, semaphore, on_result=on_result, cascade=cascade, dedup=dedup,
+                                         backend=backend)
+    retried = {row: result for row, result in zip(rows, results) if result is not None}
+    if store is not None:
+        store.update_translations(output_name, retried, model=model_label(cascade=cascade, backend=backend))
+
+    # Rewrite the output chunk by chunk with the recovered rows patched in (there is none when it was only written to the store)
+    if os.path.exists(output_name):
+        part_name = output_name + ".part"
+        if os.path.exists(part_name):
+            os.remove(part_name)
+        row_offset = 0
+        csv_kwargs = {"keep_default_na": False} if table_format(output_name) == "csv" else {}
+        for chunk in iter_chunks(output_name, chunk_size, **csv_kwargs):
+            translations, revisions = chunk['translation'].tolist(), chunk['thai_transcript'].tolist()
+            for i in range(len(chunk)):
+                result = retried.get(row_offset + i)
+                if result is not None:
+                    translations[i], revisions[i] = result
+            row_offset += len(chunk)
+            append_rows(chunk.assign(translation=translations, thai_transcript=revisions), part_name)
+        finish_part(part_name, output_name)
+
+    journal.close()
+    n_failed = len(rows) - len(retried)
+    if n_failed:
+        print(f"{n_failed} rows still failed: {output_name}.journal")
+    else:
+        journal.remove()
+
+
+def process_file(file_name, api_key, max_concurrency=8, batch_chars=None, chunk_size=256, resume=False, retry_failed=False, cascade=False, dedup=None,
+                 backend=None, store=None, export=True):
+    return run_async(process_file_async(file_name, api_key, max_concurrency=max_concurrency, batch_chars=batch_chars, chunk_size=chunk_size,
+                                        resume=resume, retry_failed=retry_failed, cascade=cascade, dedup=dedup, backend=backend, store=store,
+                                        export=export))
 
 
 
@@ -333,19 +1114,17 @@ qa_questions = [
 # Post Processing #
 ###################
 
-name_shift = {"llm_translate": "translation", "llm_revision": "thai_transcript"}
+name_shift = {"llm_translate": "translation", "llm_revision": "thai_transcript"} # Resolved once per file by table.SegmentTable
 
-def query_question(df, i, query_dict):
+# table is a table.SegmentTable (a DataFrame is converted, which is slow inside a loop)
+def query_question(table, i, query_dict):
     print("Query Question")
-    try:
-        english_question = df['llm_translate'].iloc[i]
-        thai_question = df['llm_revision'].iloc[i]
-    except:
-        english_question = df['translation'].iloc[i]
-        thai_question = df['thai_transcript'].iloc[i]
-
-    start_time_question = df['Start time'].iloc[i]
-    end_time_question = df['End time'].iloc[i]
+    table = as_segment_table(table)
+    english_question = table.english[i]
+    thai_question = table.thai[i]
+
+    start_time_question = table.start[i]
+    end_time_question = table.end[i]
     query_dict = {}
     query_dict['translate_question'] = english_question
     query_dict['thai_question'] = thai_question
@@ -353,20 +1132,17 @@ def query_question(df, i, query_dict):
     query_dict['end_time_question'] = end_time_question
     return query_dict
 
-def query_answer(df, i, query_dict):
+def query_answer(table, i, query_dict):
     if 'translate_question' not in query_dict:
         return query_dict
     
     print("Answer found, query answer")
-    try:
-        english_answer = df['llm_translate'].iloc[i]
-        thai_answer = df['llm_revision'].iloc[i]
-    except:
-        english_answer = df['translation'].iloc[i]
-        thai_answer = df['thai_transcript'].iloc[i]
-
-    start_time_answer = df['Start time'].iloc[i]
-    end_time_answer = df['End time'].iloc[i]
+    table = as_segment_table(table)
+    english_answer = table.english[i]
+    thai_answer = table.thai[i]
+
+    start_time_answer = table.start[i]
+    end_time_answer = table.end[i]
     query_dict['translate_answer'] = english_answer
     query_dict['thai_answer'] = thai_answer
     query_dict['start_time_answer'] = start_time_answer
@@ -380,25 +1156,67 @@ def slot_answer(complete_list, query_dict):
     return complete_list + [query_dict], {}
 
 
+def read_segments(file_name, store=None):
+    """
+    SegmentTable of a translated file, or of its recording in the store when the file was never exported
+    """
+    if store is not None and not os.path.exists(file_name):
+        return SegmentTable.from_frame(store.segments_frame(file_name))
+    return SegmentTable.read(file_name)
+
+
+def save_proc(file_name, complete_list, model, store=None, export=True, questions=None):
+    """
+    Post-processing output: the store and / or <name>__llm_proc; model and questions are the ones the check requests went out with
+    """
+    if store is not None:
+        store.write_postproc(file_name, complete_list, questions or qa_questions, model=model)
+    if export or store is None:
+        write_table(pd.DataFrame(complete_list), llm_proc_name(file_name))
+
+
+def get_gate_mask(table, gate):
+    """
+    Pre-filter keep mask for a file, fitted on the file's own segments
+    """
+    if gate is None:
+        return None
+    table = as_segment_table(table)
+    english_texts = [str(text) for text in table.english]
+    thai_texts = ["" if text is None else str(text) for text in table.thai]
+    return gate.fit(english_texts).filter(english_texts, thai_texts)
+
+
  # Initialize Temporary info
-def post_proc_llm(file_name):
-    df = pd.read_csv(file_name)
+def post_proc_llm(file_name, window=None, overlap=4, max_concurrency=8, gate=None, store=None, export=True, api_key=None, questions=None):
+    """
+    gate is an optional prefilter.SegmentGate; segments it rejects skip the LLM call unless a question is waiting for its answer
+    store (a src.store.ResultStore) gets the question / answer slots; export=False then skips the _llm_proc file
+    api_key defaults to $ANTHROPIC_API_KEY, questions to the built-in qa_questions
+    """
+    if window:
+        return run_async(post_proc_llm_windowed_async(file_name, window=window, overlap=overlap, max_concurrency=max_concurrency, gate=gate,
+                                                      store=store, export=export, api_key=api_key, questions=questions))
+    api_key = api_key or os.environ.get('ANTHROPIC_API_KEY')
+    questions = questions or qa_questions
+    preset_questions = (("\n").join(questions)).strip()
+    table = read_segments(file_name, store)
     complete_list = []
     query_dict = {}
-    for i in tqdm(range(len(df))):
-        try:
-            english_text = df['llm_translate'].iloc[i]
-        except:
-            english_text = df['translation'].iloc[i]
-
-        preset_questions = (("\n").join(qa_questions)).strip()
+    keep = get_gate_mask(table, gate)
+    n_skipped = 0
+    for i in tqdm(range(len(table))):
+        if keep is not None and not keep[i] and 'translate_question' not in query_dict:
+            n_skipped += 1
+            continue
+        english_text = table.english[i]
 
         prev_question = None
         if 'translate_question' in query_dict:
             prev_question = query_dict['translate_question']
             # print("Previous Question: ", prev_question)
             
-        calls = check_transcript_call_anthropic(english_text, preset_questions = preset_questions, prev_question = prev_question, api_key = os.environ['ANTHROPIC_API_KEY'])
+        calls = check_transcript_call_anthropic(english_text, preset_questions = preset_questions, prev_question = prev_question, api_key = api_key)
         # Initialize Temporary info
         is_related_question = False
         is_answer = False
@@ -414,12 +1232,12 @@ def post_proc_llm(file_name):
                     # print("Found answer")
             # Slot in question & answer
             if is_related_question:
-                query_dict = query_question(df, i, query_dict)
+                query_dict = query_question(table, i, query_dict)
                 print("Found related question.... ")
             if is_answer and not is_related_question:
                 print("Detect Answer")
                 # print("Before sloting in answer: ", query_dict)
-                query_dict = query_answer(df, i, query_dict)
+                query_dict = query_answer(table, i, query_dict)
                 # print("After sloting in answer: ", query_dict)
                 # print("Before slotting answer: ")
                 # print(complete_list)
@@ -431,7 +1249,110 @@ def post_proc_llm(file_name):
         except:
             print("No related question, or answer")
 
-    df_proc = pd.DataFrame(complete_list)
-    df_proc.to_csv(file_name.replace("llm.csv", "_llm_proc.csv"), index=False)
+    if keep is not None:
+        print(f"Pre-filter skipped {n_skipped} of {len(table)} LLM calls")
+    model = build_check_transcript_request("", preset_questions, None)["model"]
+    save_proc(file_name, complete_list, model, store, export, questions)
     return 
 
+
+def make_windows(n_rows, window, overlap):
+    stride = max(window - overlap, 1)
+    windows = []
+    for start in range(0, n_rows, stride):
+        end = min(start + window, n_rows)
+        windows.append((start, end))
+        if end == n_rows:
+            break
+    return windows
+
+
+def reconcile_windows(n_rows, windows, window_calls):
+    """
+    Merge per-window labels into one label per row
+    * A row seen by several overlapping windows takes its label from the window where it sits furthest from the edge
+    * answer_to links are kept only if they point back to an earlier row of the same window
+    """
+    labels = [None] * n_rows
+    margins = [-1] * n_rows
+    for (start, end), calls in zip(windows, window_calls):
+        for call in calls:
+            i = call['index']
+            if not isinstance(i, int) or not start <= i < end:
+                continue
+            margin = min(i - start, end - 1 - i)
+            if margin <= margins[i]:
+                continue
+            answer_to = call['answer_to']
+            if not isinstance(answer_to, int) or not start <= answer_to < i:
+                answer_to = -1
+            labels[i] = {'is_related_question': bool(call['is_related_question']), 'is_answer': bool(call['is_answer']), 'answer_to': answer_to}
+            margins[i] = margin
+    return labels
+
+
+def slot_labels(table, labels):
+    """
+    Replay the question / answer state machine of post_proc_llm over reconciled labels
+    * An answer linked to a related question is paired with that question, otherwise with the current one
+    """
+    table = as_segment_table(table)
+    complete_list = []
+    query_dict = {}
+    question_row = None
+    for i, label in enumerate(labels):
+        if label is None:
+            continue
+        if label['is_related_question']:
+            query_dict = query_question(table, i, query_dict)
+            question_row = i
+        elif label['is_answer']:
+            q = label['answer_to']
+            if q >= 0 and labels[q] is not None and labels[q]['is_related_question'] and q != question_row:
+                query_dict = query_question(table, q, {})
+                question_row = q
+            query_dict = query_answer(table, i, query_dict)
+            complete_list, query_dict = slot_answer(complete_list, query_dict)
+            question_row = None
+    return complete_list
+
+
+async def post_proc_llm_windowed_async(file_name, window=16, overlap=4, max_concurrency=8, gate=None, semaphore=None, store=None, export=True,
+                                       api_key=None, questions=None):
+    """
+    Windowed post processing
+    * Each window of consecutive segments (with start / end times) is labelled in one window_check_tool call
+    * Windows overlap by overlap segments and run in parallel; labels are reconciled with reconcile_windows
+    * gate is an optional prefilter.SegmentGate
+    * store / export / api_key / questions as in post_proc_llm
+    """
+    api_key = api_key or os.environ.get('ANTHROPIC_API_KEY')
+    questions = questions or qa_questions
+    table = read_segments(file_name, store)
+    segments = list(zip(range(len(table)), table.start, table.end, table.english))
+    windows = make_windows(len(table), window, overlap)
+    keep = get_gate_mask(table, gate)
+    if keep is not None:
+        # Windows without a single kept segment are not sent at all
+        n_windows = len(windows)
+        windows = [(start, end) for start, end in windows if any(keep[start:end])]
+        print(f"Pre-filter skipped {n_windows - len(windows)} of {n_windows} LLM calls")
+    preset_questions = (("\n").join(questions)).strip()
+    semaphore = semaphore or asyncio.Semaphore(max_concurrency)
+    progress = tqdm(total=len(windows))
+
+    async def check_window(start, end):
+        async with timed_slot(semaphore):
+            try:
+                calls = await check_window_call_anthropic_async(segments[start:end], preset_questions, api_key = api_key)
+            except Exception:
+                print(f"Window {start}-{end} failed")
+                calls = []
+        progress.update(1)
+        return calls
+
+    window_calls = await asyncio.gather(*[check_window(start, end) for start, end in windows])
+    progress.close()
+    complete_list = slot_labels(table, reconcile_windows(len(table), windows, window_calls))
+    save_proc(file_name, complete_list, build_window_check_request([], preset_questions)["model"], store, export, questions)
+
@@ -0,0 +1,31 @@
+import asyncio
+from src.backends import Backend, HedgedBackend
+from src.metrics import metrics
+
+
+class CachedBackend(Backend):
+    """
+    Answers some texts from the "cache" (no call), the rest with a tracked call
+    """
+    name = "cached"
+
+    async def translate_async(self, thai_text, hints=()):
+        if thai_text.startswith("cached"):
+            metrics.record("test", "m", cache="hit")
+        else:
+            with metrics.track("test", "m"):
+                await asyncio.sleep(0.01)
+        return {"translation": thai_text, "revision": thai_text}
+
+
+def test_cache_hits_do_not_feed_the_hedge_delay():
+    backend = HedgedBackend(CachedBackend(), initial_delay=1.0)
+
+    async def run():
+        await asyncio.gather(*[backend.translate_async(f"cached {i}") for i in range(5)])
+        assert len(backend.latencies) == 0
+        await asyncio.gather(*[backend.translate_async(f"call {i}") for i in range(3)])
+        assert len(backend.latencies) == 3
+        assert backend.latencies.percentile(0.0) >= 0.01
+
+    asyncio.run(run())
@@ -0,0 +1,69 @@
+import json
+from src.batch import BatchRunner
+from src.translate import parse_translation_calls
+
+
+class FakeClient:
+    """
+    Batches end at once and every request succeeds
+    """
+
+    def __init__(self, content=()):
+        self.batches = {}
+        self.retrieved = []
+        self.content = list(content)
+
+    def create(self, requests):
+        batch_id = f"batch_{len(self.batches)}"
+        self.batches[batch_id] = [request["custom_id"] for request in requests]
+        return {"id": batch_id}
+
+    def retrieve(self, batch_id):
+        self.retrieved.append(batch_id)
+        return {"id": batch_id, "processing_status": "ended"}
+
+    def results(self, batch):
+        for i in self.batches.get(batch["id"], []):
+            yield {"custom_id": i, "result": {"type": "succeeded", "message": {"content": self.content, "usage": {}, "model": "m"}}}
+
+
+def test_batches_of_other_jobs_are_left_alone(tmp_path):
+    state_file = str(tmp_path / "batches.json")
+    with open(state_file, "w") as f:
+        json.dump({"batch_other": ["qa-other"]}, f)
+    client = FakeClient()
+    handled = []
+    failed = BatchRunner(client, poll_interval=0.0, state_file=state_file).run({"t-1": {}, "t-2": {}}, lambda i, message: handled.append(i))
+    assert failed == {}
+    assert sorted(handled) == ["t-1", "t-2"]
+    assert "batch_other" not in client.retrieved
+    with open(state_file) as f:
+        assert json.load(f) == {"batch_other": ["qa-other"]}
+
+
+def test_own_interrupted_batch_is_picked_up(tmp_path):
+    state_file = str(tmp_path / "batches.json")
+    client = FakeClient()
+    client.batches["batch_old"] = ["t-1"]
+    with open(state_file, "w") as f:
+        json.dump({"batch_old": ["t-1"]}, f)
+    handled = []
+    BatchRunner(client, poll_interval=0.0, state_file=state_file).run({"t-1": {}, "t-2": {}}, lambda i, message: handled.append(i))
+    assert sorted(handled) == ["t-1", "t-2"]
+    assert client.batches["batch_1"] == ["t-2"] # t-1 was not submitted again
+    assert not (tmp_path / "batches.json").exists()
+
+
+def test_malformed_tool_input_is_resubmitted(tmp_path):
+    # A tool_use whose input lacks its fields must not abort the run and leave the batch in the state file
+    state_file = str(tmp_path / "batches.json")
+    client = FakeClient(content=[{"type": "tool_use", "id": "toolu_1", "name": "translate_tool", "input": {"revision": "x"}}])
+
+    def handle(i, message):
+        calls = parse_translation_calls(message)
+        return bool(calls and calls[0]['translation'])
+
+    failed = BatchRunner(client, max_rounds=2, poll_interval=0.0, state_file=state_file).run({"t-1": {}}, handle)
+    assert failed == {"t-1": "unparsable answer"}
+    assert len(client.batches) == 2 # Resubmitted once
+    assert not (tmp_path / "batches.json").exists()
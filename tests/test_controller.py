@@ -0,0 +1,103 @@
+import asyncio
+from src.controller import RequestController
+
+
+def make_controller():
+    return RequestController(initial_limit=1, min_limit=1, max_limit=1, base_delay=0.0)
+
+
+async def ok():
+    return "ok"
+
+
+def test_cancelled_waiter_does_not_swallow_wake_up():
+    # limit=1: holder in flight, B and C queued, B cancelled, holder fails with a non-retryable error -> C must still run
+    async def run():
+        controller = make_controller()
+        release_holder = asyncio.Event()
+
+        async def holder():
+            await release_holder.wait()
+            raise RuntimeError("fatal")
+
+        holder_task = asyncio.create_task(controller.call_async(holder))
+        await asyncio.sleep(0)
+        b = asyncio.create_task(controller.call_async(ok))
+        c = asyncio.create_task(controller.call_async(ok))
+        await asyncio.sleep(0.01)
+        assert controller.in_flight == 1
+        b.cancel()
+        await asyncio.gather(b, return_exceptions=True)
+        release_holder.set()
+        await asyncio.gather(holder_task, return_exceptions=True)
+        assert await asyncio.wait_for(c, timeout=1.0) == "ok"
+        assert controller.in_flight == 0
+        assert not controller._waiters
+
+    asyncio.run(run())
+
+
+def test_cancelled_after_wake_up_passes_it_on():
+    # B is woken and cancelled before it runs: the slot goes to C
+    async def run():
+        controller = make_controller()
+        controller.acquire()
+        b = asyncio.create_task(controller.acquire_async())
+        c = asyncio.create_task(controller.acquire_async())
+        await asyncio.sleep(0.01)
+        controller.release()
+        b.cancel()
+        await asyncio.gather(b, return_exceptions=True)
+        await asyncio.wait_for(c, timeout=1.0)
+        assert controller.in_flight == 1
+        controller.release()
+        assert controller.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_slots_bound_concurrency():
+    async def run():
+        controller = RequestController(initial_limit=2, min_limit=2, max_limit=2)
+        running, peak = 0, 0
+
+        async def work():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.005)
+            running -= 1
+            return "ok"
+
+        results = await asyncio.gather(*[controller.call_async(work) for _ in range(10)])
+        assert results == ["ok"] * 10
+        assert peak == 2
+        assert controller.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_retries_transient_errors_only():
+    controller = RequestController(base_delay=0.0)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert controller.call(flaky) == "ok"
+    assert len(attempts) == 3
+
+    def broken():
+        attempts.append(1)
+        raise KeyError("no tool call")
+
+    attempts.clear()
+    try:
+        controller.call(broken)
+    except KeyError:
+        pass
+    assert len(attempts) == 1
+    assert controller.in_flight == 0
@@ -0,0 +1,52 @@
+import pickle
+from src.dedup import NearDuplicateIndex, fold_thai, normalize_thai
+
+
+def test_particles_dropped_only_where_a_word_ends():
+    assert normalize_thai("สวัสดีค่ะ ยินดีต้อนรับค่ะ") == "สวัสดียินดีต้อนรับ"
+    assert normalize_thai("ไป นะ ครับ") == "ไป"
+    assert normalize_thai("คะแนนดี") == "คะแนนดี"
+
+
+def test_content_words_are_kept():
+    # Thai has no spaces: these end in particle-like letters but are words
+    for text in ("ปวดขา", "เสื้อคับ", "ชนะ", "แดดจ้า"):
+        assert normalize_thai(text) == text
+    assert normalize_thai("ชนะครับ") == "ชนะ"
+
+
+def test_particle_variant_is_not_an_exact_match():
+    index = NearDuplicateIndex(reuse_threshold=0.9, hint_threshold=0.3)
+    index.add("สวัสดีค่ะ", ("hello", "สวัสดีค่ะ"))
+    match = index.lookup("สวัสดีครับ")
+    assert match is not None and match[0] < 1.0
+    assert not index.reusable(match)
+    assert index.lookup("สวัสดี  ค่ะ")[0] == 1.0
+
+
+def test_different_words_do_not_collide():
+    index = NearDuplicateIndex()
+    index.add("ปวดขา", ("leg pain", "ปวดขา"))
+    match = index.lookup("ปวด")
+    assert not index.reusable(match)
+
+
+def test_pickle_round_trip():
+    index = NearDuplicateIndex()
+    index.add("สวัสดีค่ะ ยินดีต้อนรับค่ะ", ("hello, welcome", "สวัสดีค่ะ ยินดีต้อนรับค่ะ"))
+    loaded = pickle.loads(pickle.dumps(index))
+    assert loaded.lookup("สวัสดีค่ะ ยินดีต้อนรับค่ะ")[0] == 1.0
+    assert loaded.keys == [fold_thai("สวัสดีค่ะ ยินดีต้อนรับค่ะ")]
+
+
+def test_lookup_cost_stays_bounded_on_a_large_index():
+    # A recurring script: thousands of segments that share most bands
+    index = NearDuplicateIndex(max_bucket=16, max_candidates=8)
+    script = "ขออนุญาตสอบถามข้อมูลเพิ่มเติมเกี่ยวกับประวัติการรักษา"
+    for i in range(5000):
+        index.add(f"{script} {i}", (str(i), f"{script} {i}"))
+    assert max(len(bucket) for table in index.band_tables for bucket in table.values()) <= 16
+    signature = index.signature(normalize_thai(f"{script} 12345"))
+    assert len(index.candidates(signature)) <= 8
+    match = index.lookup(f"{script} 12345")
+    assert match is not None and index.reusable(match)
@@ -0,0 +1,21 @@
+import asyncio
+import src.stream
+from src.stream import stream_segments
+
+
+def test_segment_timeout_covers_the_slot_wait(monkeypatch):
+    # One slot, calls slower than the timeout: queued segments must time out too instead of arriving stale
+    async def slow_translate(thai_text, api_key, cascade=False, backend=None):
+        await asyncio.sleep(0.2)
+        return thai_text, thai_text
+
+    monkeypatch.setattr(src.stream, "get_translate_async", slow_translate)
+
+    async def run():
+        segments = [(i, i + 1, f"segment {i}") for i in range(3)]
+        return [event async for event in stream_segments(segments, None, max_concurrency=1, check=False, segment_timeout=0.1)]
+
+    events = asyncio.run(run())
+    assert len(events) == 3
+    assert all(event["translation"] is None for event in events)
+    assert all(event["latency"] < 0.15 for event in events)
@@ -0,0 +1,20 @@
+import pandas as pd
+import pytest
+from src.table import SegmentTable, read_present_columns, write_table
+
+
+@pytest.mark.parametrize("ext", [".csv", ".parquet", ".arrow"])
+def test_read_loads_only_the_requested_columns(tmp_path, ext):
+    file_name = str(tmp_path / ("x_llm" + ext))
+    write_table(pd.DataFrame({
+        "Start time": [0.0, 1.5], "End time": [1.5, 3.0], "thai_transcript": ["สวัสดี", "ครับ"], "translation": ["hello", "yes"],
+        "notes": ["a", "b"],
+    }), file_name)
+    assert sorted(read_present_columns(file_name, ["translation", "llm_translate", "Start time"]).columns) == ["Start time", "translation"]
+
+    table = SegmentTable.read(file_name, columns=("thai", "start", "end"))
+    assert table.thai == ["สวัสดี", "ครับ"] and table.start == [0.0, 1.5] and table.end == [1.5, 3.0]
+    assert table.english == [None, None]
+
+    full = SegmentTable.read(file_name)
+    assert full.english == ["hello", "yes"] and full.thai == table.thai
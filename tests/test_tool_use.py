@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+from src.clients import AssistantRegistry
+from src.tool_use import wait_on_run, wait_on_run_async
+
+
+class RateLimited(Exception):
+    status_code = 429
+    response = SimpleNamespace(headers={"retry-after-ms": "1"})
+
+
+def run(status):
+    return SimpleNamespace(id="run_1", thread_id="thread_1", status=status, metadata=None)
+
+
+class FlakyRuns:
+    """
+    runs.retrieve answers 429 once, then the finished run
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def retrieve(self, thread_id, run_id):
+        self.calls += 1
+        if self.calls == 1:
+            raise RateLimited()
+        return run("requires_action")
+
+    async def retrieve_async(self, thread_id, run_id):
+        return self.retrieve(thread_id, run_id)
+
+
+def test_run_polling_retries_rate_limits():
+    runs = FlakyRuns()
+    client = SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(runs=SimpleNamespace(retrieve=runs.retrieve))))
+    assert wait_on_run(client, run("queued"), initial_interval=0.0).status == "requires_action"
+    assert runs.calls == 2
+
+    runs = FlakyRuns()
+    client = SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(runs=SimpleNamespace(retrieve=runs.retrieve_async))))
+    assert asyncio.run(wait_on_run_async(client, run("queued"), initial_interval=0.0)).status == "requires_action"
+    assert runs.calls == 2
+
+
+def test_assistant_lookup_retries_rate_limits():
+    calls = []
+
+    def list_assistants(limit):
+        calls.append("list")
+        if len(calls) == 1:
+            raise RateLimited()
+        return []
+
+    def create(**kwargs):
+        calls.append("create")
+        return SimpleNamespace(id="asst_1")
+
+    client = SimpleNamespace(beta=SimpleNamespace(assistants=SimpleNamespace(list=list_assistants, create=create)))
+    assert AssistantRegistry().get(client, "name", "instructions", [], "model") == "asst_1"
+    assert calls == ["list", "list", "create"]
@@ -0,0 +1,15 @@
+from src.translate import build_translate_request, build_translation_gpt_request, request_cache_key
+
+
+def test_gpt_cache_key_covers_mode_and_prompt():
+    chat, assistant = build_translation_gpt_request("สวัสดี", False), build_translation_gpt_request("สวัสดี", True)
+    assert request_cache_key(chat) != request_cache_key(assistant)
+    edited = dict(chat, messages=[chat["messages"][0], {"role": "user", "content": "Translate: สวัสดี"}])
+    assert request_cache_key(chat) != request_cache_key(edited)
+    assert request_cache_key(chat) == request_cache_key(build_translation_gpt_request("สวัสดี", False))
+
+
+def test_anthropic_cache_key_covers_the_message():
+    request = build_translate_request("สวัสดี", "claude-3-opus-20240229")
+    edited = dict(request, messages=[{"role": "user", "content": request["messages"][0]["content"].replace("Translate", "Render")}])
+    assert request_cache_key(request) != request_cache_key(edited)